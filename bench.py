@@ -0,0 +1,339 @@
+"""
+Бенчмарк подбора, экспорта КП и справочника компаний (через Flask test client).
+
+Замеры:
+  selection — _select_components по всему пространству конфигураций (config_space):
+              холодный проход (кэш подбора пуст), тёплый и из таблицы подбора (с временем
+              её построения); /api/select — на выборке;
+  export    — /api/export и /api/export/project на КП из 1/10/100 строк: время, размер
+              файла и пик памяти Python (tracemalloc);
+  directory — /api/catalog/companies на копии pifagor.db, увеличенной в --scale раз:
+              поиск, фильтры, глубокая страница по offset и по курсору.
+
+Результаты пишутся в JSON; два прогона (например, до и после коммита) сравнивает --compare.
+
+Запуск:
+    python bench.py [--out bench_results.json] [--scale 200] [--repeat 20] [--only selection,export,directory]
+    python bench.py --compare old.json new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import config_space
+import db_migrate
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUT = os.path.join(BASE_DIR, "bench_results.json")
+SUITES = ("selection", "export", "directory")
+EXPORT_ROWS = (1, 10, 100)
+API_SELECT_SAMPLE = 500
+PAGE_LIMIT = 50
+
+
+def _stats(samples: List[float]) -> Dict[str, float]:
+    """Сводка по замерам в секундах — в миллисекундах."""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]
+    return {
+        "runs": len(ordered),
+        "min_ms": ordered[0] * 1000,
+        "median_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": p95 * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _timed(call: Callable[[], Any], repeat: int) -> Tuple[Dict[str, float], Any]:
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = call()
+        samples.append(time.perf_counter() - t0)
+    return _stats(samples), result
+
+
+def _peak_kb(call: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def _check(resp) -> Any:
+    if resp.status_code != 200:
+        raise RuntimeError(f"{resp.request.path}: HTTP {resp.status_code} {resp.get_data(as_text=True)[:200]}")
+    return resp
+
+
+# === Подбор ===
+
+def bench_selection(main, client, repeat: int) -> Dict[str, Any]:
+    configs = list(config_space.iter_configurations(main.catalog.code_mapping))
+    out: Dict[str, Any] = {"configurations": len(configs)}
+    main.selection_cache.clear()
+    for label in ("cold", "warm"):
+        t0 = time.perf_counter()
+        for payload in configs:
+            main._select_components(payload)
+        elapsed = time.perf_counter() - t0
+        out[label] = {"seconds": elapsed, "per_second": len(configs) / elapsed}
+    out["cache"] = main.selection_cache.stats()
+
+    table = main.precompute_selections()
+    t0 = time.perf_counter()
+    for payload in configs:
+        main._select_components(payload)
+    elapsed = time.perf_counter() - t0
+    out["table"] = {"seconds": elapsed, "per_second": len(configs) / elapsed,
+                    "build_seconds": table.build_seconds, "entries": len(table.entries)}
+
+    step = max(1, len(configs) // API_SELECT_SAMPLE)
+    sample = configs[::step]
+    samples = []
+    for payload in sample:
+        t0 = time.perf_counter()
+        _check(client.post("/api/select", json=payload))
+        samples.append(time.perf_counter() - t0)
+    out["api_select"] = _stats(samples)
+    return out
+
+
+# === Экспорт КП ===
+
+def _project_of(main, configs: List[Dict[str, Any]], rows: int) -> Tuple[Dict[str, Any], int]:
+    """Проект ровно на rows строк КП (по группе на конфигурацию), если такой собирается."""
+    groups = []
+    total = 0
+    for payload in configs:
+        n = len(main._select_components(payload)[0])
+        if not n or total + n > rows:
+            continue
+        groups.append({"title": f"Шахта {len(groups) + 1}", "items": [payload]})
+        total += n
+        if total == rows:
+            break
+    return {"title": f"bench_{rows}", "groups": groups}, total
+
+
+def bench_export(main, client, repeat: int) -> Dict[str, Any]:
+    configs = list(config_space.iter_configurations(main.catalog.code_mapping))
+    out: Dict[str, Any] = {}
+
+    single = next(p for p in configs if main._select_components(p)[0])
+    call = lambda: _check(client.post("/api/export", json=single)).get_data()  # noqa: E731
+    stats, data = _timed(call, repeat)
+    out["single"] = dict(stats, rows=len(main._select_components(single)[0]), bytes=len(data), peak_kb=_peak_kb(call))
+
+    for rows in EXPORT_ROWS:
+        project, actual = _project_of(main, configs, rows)
+        call = lambda body=project: _check(client.post("/api/export/project", json=body)).get_data()  # noqa: E731
+        stats, data = _timed(call, repeat)
+        out[f"project_{rows}"] = dict(stats, rows=actual, bytes=len(data), peak_kb=_peak_kb(call))
+    return out
+
+
+# === Справочник компаний ===
+
+def build_scaled_db(src: str, dst: str, scale: int) -> int:
+    """Копия pifagor.db с миграциями, где компании размножены в scale раз (новые id и имена)."""
+    source = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+    target = sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    db_migrate.migrate(dst)
+
+    conn = sqlite3.connect(dst)
+    try:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(companies)")]
+        exprs = {"id": "id + :offset", "name": "name || ' #' || :copy", "parent_company_id": "parent_company_id + :offset"}
+        select = ", ".join(exprs.get(c, c) for c in columns)
+        base = conn.execute("SELECT MAX(id) FROM companies").fetchone()[0] or 0
+        with conn:
+            for copy in range(1, scale):
+                conn.execute(
+                    f"INSERT INTO companies ({', '.join(columns)}) SELECT {select} FROM companies WHERE id <= :base",
+                    {"offset": copy * base, "copy": copy, "base": base},
+                )
+        conn.execute("ANALYZE")
+        return conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _top_value(db_path: str, expr: str) -> str:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        sql = f"SELECT {expr} AS v FROM companies WHERE v IS NOT NULL GROUP BY v ORDER BY COUNT(*) DESC LIMIT 1"
+        return conn.execute(sql).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _name_word(db_path: str, region: str) -> str:
+    """Слово из названия компании региона — поиск, который внутри фильтра что-то находит."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        names = [row[0] for row in conn.execute("SELECT name FROM companies WHERE region = ? LIMIT 50", (region,))]
+    finally:
+        conn.close()
+    words = [w for name in names for w in re.findall(r"\w{4,}", name)]
+    return max(words, key=len) if words else "агро"
+
+
+def bench_directory(main, client, repeat: int) -> Dict[str, Any]:
+    db_path = main.PIFAGOR_DB
+    region = _top_value(db_path, "region")
+    production = _top_value(db_path, "json_extract(production_type, '$.primary')")
+    url = "/api/catalog/companies"
+
+    def get(**params):
+        return _check(client.get(url, query_string=dict(params, limit=PAGE_LIMIT))).get_json()
+
+    first = get()
+    last_page = max(1, -(-first["total"] // PAGE_LIMIT))
+    # курсор последней страницы: проходим список целиком, как пролистал бы пользователь
+    cursor, pages = None, 1
+    while pages < last_page:
+        cursor = get(**({"cursor": cursor} if cursor else {}))["next_cursor"]
+        pages += 1
+
+    cases = {
+        "first_page": {},
+        "search_fts": {"q": "агро"},
+        "search_short": {"q": "ао"},
+        "filter_region": {"region": region},
+        "filter_production": {"production": production},
+        "filter_region_search": {"region": region, "q": _name_word(db_path, region)},
+        "deep_page_offset": {"page": last_page},
+    }
+    if cursor:
+        cases["deep_page_cursor"] = {"cursor": cursor}
+
+    out: Dict[str, Any] = {"companies": first["total"], "last_page": last_page}
+    for label, params in cases.items():
+        stats, payload = _timed(lambda p=params: get(**p), repeat)
+        out[label] = dict(stats, items=len(payload["items"]))
+    return out
+
+
+# === Запуск и сравнение ===
+
+def _git_revision() -> Optional[str]:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                             check=True, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR,
+                               check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return rev + ("-dirty" if dirty else "")
+
+
+def run(suites: List[str], scale: int, repeat: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="chimeney_bench_") as tmp:
+        companies = None
+        if "directory" in suites:
+            src = os.environ.get("CHIMENEY_PIFAGOR_DB") or os.path.join(BASE_DIR, "PIFAGOR_DB", "pifagor.db")
+            dst = os.path.join(tmp, "pifagor.db")
+            companies = build_scaled_db(src, dst, scale)
+            # main читает путь к справочнику при импорте
+            os.environ["CHIMENEY_PIFAGOR_DB"] = dst
+        import main
+
+        client = main.app.test_client()
+        results: Dict[str, Any] = {
+            "meta": {
+                "revision": _git_revision(),
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "catalog_items": len(main.catalog.items),
+                "scale": scale if companies is not None else None,
+                "repeat": repeat,
+            }
+        }
+        benches = {"selection": bench_selection, "export": bench_export, "directory": bench_directory}
+        for name in suites:
+            print(f"… {name}", file=sys.stderr)
+            results[name] = benches[name](main, client, repeat)
+        return results
+
+
+def _flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[path] = value
+    return out
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.10) -> List[str]:
+    """Строки сравнения метрик времени, скорости и памяти; ⚠ — ухудшение больше threshold."""
+    before = _flatten({k: v for k, v in old.items() if k != "meta"})
+    after = _flatten({k: v for k, v in new.items() if k != "meta"})
+    lines = []
+    for path, value in after.items():
+        base = before.get(path)
+        metric = path.rsplit(".", 1)[-1]
+        if not base or metric not in ("median_ms", "p95_ms", "seconds", "per_second", "peak_kb", "bytes"):
+            continue
+        change = value / base - 1
+        worse = -change if metric == "per_second" else change
+        mark = "⚠" if worse > threshold else " "
+        lines.append(f"{mark} {path:<45} {base:>12.2f} → {value:>12.2f}  ({change:+.1%})")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк подбора, экспорта и справочника компаний")
+    parser.add_argument("--out", default=DEFAULT_OUT, help="куда записать результаты (JSON)")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"наборы через запятую: {', '.join(SUITES)}")
+    parser.add_argument("--scale", type=int, default=200, help="размножить компании справочника в N раз")
+    parser.add_argument("--repeat", type=int, default=20, help="повторов на замер латентности")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два файла результатов")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        print(f"{old['meta'].get('revision')} → {new['meta'].get('revision')}")
+        for line in compare(old, new):
+            print(line)
+        return
+
+    suites = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"неизвестные наборы: {', '.join(sorted(unknown))}")
+    results = run(suites, max(1, args.scale), max(1, args.repeat))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результаты: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
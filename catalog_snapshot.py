@@ -0,0 +1,326 @@
+"""
+Компактный бинарный снимок каталога комплектующих (data/komplektuyushchie.snapshot).
+
+Снимок — колоночное представление того же JSON: одна таблица уникальных значений
+(строки интернируются, повторяющиеся «секция», «VBV», «560» хранятся один раз) и по
+столбцу uint32-ссылок на каждое поле записей. Файл читается через mmap, столбцы —
+без копирования (memoryview.cast). В заголовке — размер, mtime и sha1 исходного JSON.
+Снимок свежий, если размер и mtime JSON совпадают с записанными (JSON при этом не читается);
+иначе (JSON скопирован, взят из git) JSON читается и сверяется по sha1 — снимок берётся,
+только если совпадает с JSON байт в байт, иначе main.py разбирает JSON.
+
+Запуск:
+    python catalog_snapshot.py build [data/komplektuyushchie.json]
+    python catalog_snapshot.py bench [data/komplektuyushchie.json] [--scale 500] [--repeat 5]
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_JSON = os.path.join(BASE_DIR, "data", "komplektuyushchie.json")
+
+MAGIC = b"CHSNAP"
+FORMAT_VERSION = 2
+# magic, версия формата, порядок байт (0 — little, 1 — big), размер JSON, mtime JSON (нс), sha1 JSON,
+# записей, полей
+HEADER = struct.Struct("<6sHBQQ20sII")
+SECTION = struct.Struct("<I")
+
+# uint32 на любой платформе: у array «I» бывает 2 байта только на экзотике
+REF_TYPECODE = "I" if array("I").itemsize == 4 else "L"
+BYTEORDER = 0 if sys.byteorder == "little" else 1
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def snapshot_path(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + ".snapshot"
+
+
+def encode(raw: Any, source: bytes, mtime_ns: int = 0) -> bytes:
+    """Снимок каталога raw (словарь с items или список записей), собранного из JSON source.
+
+    mtime_ns — mtime файла JSON: по нему и размеру свежесть проверяется без чтения JSON.
+
+    ValueError — если каталог не укладывается в колоночный вид (вложенные значения в записях,
+    словарь без items); такой каталог main.py просто читает из JSON.
+    """
+    if isinstance(raw, dict):
+        items = raw.get("items")
+        if not isinstance(items, list):
+            raise ValueError("в каталоге нет списка items")
+        meta = {"layout": "dict", "keys": list(raw), "blocks": {k: v for k, v in raw.items() if k != "items"}}
+    elif isinstance(raw, list):
+        items = raw
+        meta = {"layout": "list"}
+    else:
+        raise ValueError("каталог должен быть словарём или списком")
+
+    fields: Dict[str, int] = {}
+    values: List[Any] = []
+    value_refs: Dict[str, int] = {}
+    rows: List[Dict[int, int]] = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("запись каталога должна быть словарём")
+        row = {}
+        for key, value in item.items():
+            if not isinstance(value, _SCALARS):
+                raise ValueError(f"поле {key!r}: в снимке хранятся только скалярные значения")
+            # ключ по JSON-представлению: 1 и "1", 1 и 1.0, True и 1 не склеиваются
+            text = json.dumps(value, ensure_ascii=False)
+            ref = value_refs.get(text)
+            if ref is None:
+                values.append(value)
+                ref = value_refs[text] = len(values)  # 0 — «поля нет»
+            row[fields.setdefault(key, len(fields))] = ref
+        rows.append(row)
+
+    columns = [array(REF_TYPECODE, bytes(SECTION.size * len(items))) for _ in fields]
+    for pos, row in enumerate(rows):
+        for field_pos, ref in row.items():
+            columns[field_pos][pos] = ref
+
+    out = [HEADER.pack(MAGIC, FORMAT_VERSION, BYTEORDER, len(source), mtime_ns, hashlib.sha1(source).digest(),
+                       len(items), len(fields))]
+    for blob in (list(fields), meta, values):
+        data = json.dumps(blob, ensure_ascii=False, allow_nan=True).encode("utf-8")
+        out.append(SECTION.pack(len(data)))
+        out.append(data)
+    size = sum(len(part) for part in out)
+    out.append(b"\0" * (-size % SECTION.size))  # столбцы выровнены по 4 байтам для cast
+    out.extend(column.tobytes() for column in columns)
+    return b"".join(out)
+
+
+def decode(buf, source: Optional[bytes] = None, stat: Optional[os.stat_result] = None) -> Optional[Any]:
+    """Каталог из снимка buf (bytes/mmap) или None, если снимок не от этого JSON или другого формата.
+
+    Свежесть: по stat JSON (размер и mtime), если задан stat, иначе по sha1 содержимого source.
+    """
+    view = memoryview(buf)
+    if len(view) < HEADER.size:
+        return None
+    magic, version, byteorder, size, mtime_ns, digest, n_items, n_fields = HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version != FORMAT_VERSION or byteorder != BYTEORDER:
+        return None
+    if stat is not None:
+        if size != stat.st_size or not mtime_ns or mtime_ns != stat.st_mtime_ns:
+            return None
+    elif source is None or size != len(source) or digest != hashlib.sha1(source).digest():
+        return None
+
+    offset = HEADER.size
+    blobs = []
+    for _ in range(3):
+        (length,) = SECTION.unpack_from(view, offset)
+        offset += SECTION.size
+        blobs.append(json.loads(bytes(view[offset:offset + length]).decode("utf-8")))
+        offset += length
+    offset += -offset % SECTION.size
+    fields, meta, values = blobs
+
+    values = [None] + [sys.intern(v) if isinstance(v, str) else v for v in values]
+    fields = [sys.intern(f) for f in fields]
+    items: List[Dict[str, Any]] = [{} for _ in range(n_items)]
+    step = n_items * SECTION.size
+    for field in fields:
+        column = view[offset:offset + step].cast(REF_TYPECODE)
+        offset += step
+        for item, ref in zip(items, column):
+            if ref:
+                item[field] = values[ref]
+        column.release()
+    view.release()
+
+    if meta["layout"] == "list":
+        return items
+    blocks = meta["blocks"]
+    return {key: items if key == "items" else blocks[key] for key in meta["keys"]}
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Временный файл рядом + os.replace: читатели видят либо старый файл, либо новый целиком.
+
+    Права — как у заменяемого файла (для нового — по umask), а не 0600 от mkstemp.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_snapshot(json_path: str, raw: Any, source: bytes) -> str:
+    """Пишет снимок рядом с JSON атомарно; возвращает путь. JSON уже записан: берётся его mtime."""
+    path = snapshot_path(json_path)
+    write_atomic(path, encode(raw, source, os.stat(json_path).st_mtime_ns))
+    return path
+
+
+def read_snapshot(json_path: str, source: Optional[bytes] = None,
+                  stat: Optional[os.stat_result] = None) -> Optional[Any]:
+    path = snapshot_path(json_path)
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return decode(buf, source, stat)
+    except (OSError, ValueError, struct.error, UnicodeDecodeError):
+        return None
+
+
+def load_catalog(json_path: str) -> Tuple[Any, str]:
+    """Сырой каталог и откуда он прочитан.
+
+    "snapshot" — снимок свежий по размеру и mtime JSON, JSON не читался;
+    "snapshot-sha1" — mtime другой, но содержимое JSON совпало со снимком по sha1;
+    "json" — снимка нет или он устарел.
+    """
+    raw = read_snapshot(json_path, stat=os.stat(json_path))
+    if raw is not None:
+        return raw, "snapshot"
+    with open(json_path, "rb") as f:
+        source = f.read()
+    raw = read_snapshot(json_path, source)
+    if raw is not None:
+        return raw, "snapshot-sha1"
+    return json.loads(source.decode("utf-8")), "json"
+
+
+# === Бенчмарк загрузки ===
+
+# Меряется то, что держит воркер: main.CatalogSnapshot.load (чтение + записи CatalogItem +
+# индексы, автоматы, приводы, цены). main импортируется до замера — Flask и зависимости не
+# входят в прирост. RSS — текущий резидентный объём (/proc/self/statm) при живом снимке:
+# ru_maxrss не годится, дочерний процесс наследует пик родителя на момент fork
+_BENCH_CODE = """
+import gc, json, os, sys, time
+sys.path.insert(0, {base!r})
+import main
+def rss_kb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+path, expected = sys.argv[1], sys.argv[2]
+gc.collect()
+rss0 = rss_kb()
+t0 = time.perf_counter()
+cat = main.CatalogSnapshot.load(path)
+elapsed = time.perf_counter() - t0
+assert cat.source == expected, cat.source
+gc.collect()
+print(json.dumps({{"seconds": elapsed, "rss_kb": rss_kb() - rss0, "items": len(cat.items)}}))
+"""
+
+# Вариант -> как готовится каталог рядом с JSON
+BENCH_MODES = {
+    "json": "снимка нет",
+    "snapshot": "снимок свежий по размеру и mtime, JSON не читается",
+    "snapshot-sha1": "mtime JSON другой (копия, git checkout): JSON читается и сверяется по sha1",
+}
+
+
+def _scaled_catalog(raw: Any, scale: int) -> Any:
+    """Каталог в scale раз больше: копии записей с уникальными артикулами."""
+    items = raw["items"] if isinstance(raw, dict) else raw
+    scaled = []
+    for copy in range(scale):
+        for item in items:
+            item = dict(item)
+            if copy:
+                item["artikul"] = f"{item.get('artikul')}-{copy}"
+            scaled.append(item)
+    if isinstance(raw, dict):
+        return dict(raw, items=scaled)
+    return scaled
+
+
+def bench(json_path: str, scale: int = 1, repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    """Время и прирост RSS main.CatalogSnapshot.load по вариантам BENCH_MODES.
+
+    Каждая попытка — в отдельном процессе (Linux); у каждого варианта свой каталог с копией JSON.
+    """
+    with open(json_path, "rb") as f:
+        raw = json.loads(f.read().decode("utf-8"))
+    source = json.dumps(_scaled_catalog(raw, scale), ensure_ascii=False, indent=2).encode("utf-8")
+    code = _BENCH_CODE.format(base=BASE_DIR)
+    env = dict(os.environ)
+    env.pop("CHIMENEY_PROFILE_SLOW_MS", None)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in BENCH_MODES:
+            os.makedirs(os.path.join(tmp, mode))
+            path = os.path.join(tmp, mode, os.path.basename(json_path))
+            with open(path, "wb") as f:
+                f.write(source)
+            size = len(source)
+            if mode != "json":
+                write_snapshot(path, json.loads(source.decode("utf-8")), source)
+                size = os.path.getsize(snapshot_path(path))
+            if mode == "snapshot-sha1":
+                st = os.stat(path)
+                os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+            runs = []
+            for _ in range(repeat):
+                out = subprocess.run([sys.executable, "-c", code, path, mode], env=env,
+                                     check=True, capture_output=True, text=True).stdout
+                runs.append(json.loads(out.strip().splitlines()[-1]))
+            runs.sort(key=lambda r: r["seconds"])
+            median = runs[len(runs) // 2]
+            results[mode] = {"bytes": size, "seconds": median["seconds"], "rss_kb": median["rss_kb"],
+                             "items": median["items"]}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бинарный снимок каталога комплектующих")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="собрать снимок по JSON-каталогу")
+    p_build.add_argument("json_path", nargs="?", default=DEFAULT_JSON)
+    p_bench = sub.add_parser("bench", help="сравнить загрузку каталога main.py из JSON и из снимка (время, RSS)")
+    p_bench.add_argument("json_path", nargs="?", default=DEFAULT_JSON)
+    p_bench.add_argument("--scale", type=int, default=1, help="размножить записи каталога в N раз")
+    p_bench.add_argument("--repeat", type=int, default=5, help="запусков на вариант (берётся медиана)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with open(args.json_path, "rb") as f:
+            source = f.read()
+        path = write_snapshot(args.json_path, json.loads(source.decode("utf-8")), source)
+        print(f"✅ Снимок каталога: {path} ({os.path.getsize(path)} байт)")
+        return
+
+    results = bench(args.json_path, scale=args.scale, repeat=args.repeat)
+    print(f"main.CatalogSnapshot.load, каталог ×{args.scale}, медиана из {args.repeat} запусков:")
+    for mode, r in results.items():
+        print(f"  {mode:<14} {r['bytes'] / 1024:>9.1f} КБ  {r['seconds'] * 1000:>8.2f} мс  "
+              f"RSS +{r['rss_kb'] / 1024:.1f} МБ  — {BENCH_MODES[mode]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Пространство конфигураций шахты: все сочетания ответов опроса question_flow
+(с учётом depends_on) и значений, встречающихся в ключах _code_mapping каталога.
+
+Используется бенчмарком подбора (bench.py) и предрасчётом таблицы подбора (main.py).
+"""
+
+import itertools
+from typing import Any, Collection, Dict, Iterator, List, Optional, Sequence
+
+from question_flow import question_flow
+
+# Вопросы, на которые можно не отвечать (параметр в payload отсутствует)
+OPTIONAL_PARAMS = {"verhnyaya_chast"}
+# Удлинение — число; перебираем «без удлинения» и одно значение с удлинением
+EXTENSION_METERS = (0, 2)
+# Части ключа _code_mapping (VBV_560_370_1_pov_niz), совпадающие с ответами опроса
+_CODE_KEY_PARAMS = {0: "tip", 1: "diametr", 2: "moshchnost"}
+
+
+def _option_values(question: Dict[str, Any]) -> List[Any]:
+    return [o["value"] if isinstance(o, dict) else o for o in question.get("options", [])]
+
+
+def _code_mapping_values(code_mapping: Optional[Dict[str, str]]) -> Dict[str, List[str]]:
+    values: Dict[str, List[str]] = {}
+    for key in code_mapping or {}:
+        parts = key.split("_")
+        for pos, param in _CODE_KEY_PARAMS.items():
+            if pos < len(parts):
+                seen = values.setdefault(param, [])
+                if parts[pos] not in seen:
+                    seen.append(parts[pos])
+    return values
+
+
+def _answers(question: Dict[str, Any], extra: Dict[str, List[str]], extensions: Sequence[int]) -> List[Any]:
+    kind = question.get("type")
+    if kind == "checkbox":
+        return [False, True]
+    if kind == "checkbox-group":
+        options = _option_values(question)
+        return [dict(zip(options, flags)) for flags in itertools.product([False, True], repeat=len(options))]
+    if kind == "number":
+        return list(extensions)
+    values = _option_values(question)
+    values += [v for v in extra.get(question["param"], []) if v not in values]
+    if question["param"] in OPTIONAL_PARAMS:
+        values = [None] + values
+    return values
+
+
+def _depends_met(question: Dict[str, Any], answered: Dict[str, Any]) -> bool:
+    return all(answered.get(title) in allowed for title, allowed in question.get("depends_on", {}).items())
+
+
+def iter_configurations(code_mapping: Optional[Dict[str, str]] = None,
+                        extensions: Sequence[int] = EXTENSION_METERS,
+                        follow_depends: bool = True,
+                        params: Optional[Dict[str, Sequence[Any]]] = None,
+                        only: Optional[Collection[str]] = None,
+                        exclude: Collection[str] = ()) -> Iterator[Dict[str, Any]]:
+    """Все payload'ы /api/select, которые можно собрать по опросу.
+
+    follow_depends=False — задаются все параметры, в том числе скрытые по depends_on
+    (так payload шлёт веб-форма: все поля сразу). params — параметры вне опроса
+    ({"montazhny_komplekt": [False, True]}), перебираются после вопросов.
+    only/exclude — перебирать только эти параметры опроса / все, кроме этих.
+    """
+    questions = [(title, q) for title, q in question_flow.items()
+                 if (only is None or q["param"] in only) and q["param"] not in exclude]
+    for param, values in (params or {}).items():
+        questions.append((param, {"param": param, "type": "select", "options": list(values)}))
+    extra = _code_mapping_values(code_mapping)
+
+    def walk(i: int, payload: Dict[str, Any], answered: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        if i == len(questions):
+            yield dict(payload)
+            return
+        title, question = questions[i]
+        if follow_depends and not _depends_met(question, answered):
+            yield from walk(i + 1, payload, answered)
+            return
+        param = question["param"]
+        for value in _answers(question, extra, extensions):
+            if value is not None:
+                payload[param] = value
+            answered[title] = value
+            yield from walk(i + 1, payload, answered)
+            payload.pop(param, None)
+            answered.pop(title, None)
+
+    yield from walk(0, {}, {})
@@ -2,136 +2,434 @@
 Скрипт конвертации Excel-файла с комплектующими вентиляционных шахт в JSON-формат.
 Автоматически определяет строку с заголовками ['Артикул', 'Наименование', 'Цена'] и загружает данные ниже неё.
 Используется на этапе локальной отладки и разработки интерфейса под Flask.
+
+Файл читается один раз; правка названий и разбор параметров идут по столбцам (pandas .str),
+правила разбора — таблицы ниже (первое совпадение в порядке списка).
+Каталог обновляется инкрементально: заново разбираются только новые и изменившиеся строки,
+служебные блоки (_code_mapping) и ручные правки записей сохраняются, запись атомарная.
+«Изменилась» — по сравнению с прошлой выгрузкой: хэши её строк лежат рядом с JSON
+(*.sources.json, хранить вместе с каталогом), а не с записью каталога, которую могли поправить руками.
+Рядом с JSON пишется бинарный снимок (*.snapshot, см. catalog_snapshot.py) для быстрой загрузки.
+Запуск: python converter.py [--input data/catalog.xlsx] [--output data/komplektuyushchie.json] [--full] [--no-snapshot]
+        python converter.py --merge RawData [--price-priority catalog.xlsx ...]  # свод всех выгрузок
 """
 
-import pandas as pd
+import argparse
+import hashlib
 import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import catalog_snapshot
 
 # Входной файл
-input_file = 'data/catalog.xlsx'
-output_file = 'data/komplektuyushchie.json'
-
-# Загрузка Excel без заголовков
-raw_df = pd.read_excel(input_file, header=None, dtype=str)
-
-# Поиск строки с заголовками
-header_row_index = None
-for idx, row in raw_df.iterrows():
-    if list(row[:3]) == ['Артикул', 'Наименование', 'Цена']:
-        header_row_index = idx
-        break
-
-if header_row_index is None:
-    raise ValueError('Заголовки не найдены. Убедитесь, что файл содержит "Артикул", "Наименование", "Цена".')
-
-# Загрузка данных начиная со строки после заголовков
-df = pd.read_excel(input_file, header=header_row_index, dtype=str)
-
-# Удаление пустых строк
-df = df.dropna(subset=['Артикул', 'Наименование', 'Цена'])
-
-# Переименование столбцов
-df = df.rename(columns={
-    'Артикул': 'artikul',
-    'Наименование': 'name',
-    'Цена': 'price'
-})
-
-# Преобразование и сохранение
-data = df.to_dict(orient='records')
-
-import re
-
-def replace_cyrillic_e_in_technical(name):
-    # Заменяет кириллические е/Е на латинские в частях артикулов вида 6е/6Е (например AGVF370-6Е)
-    return re.sub(r'6[еЕ](?=[\W_]|$)', lambda m: '6E' if m.group(0)[-1].isupper() else '6e', name)
-
-for item in data:
-    if 'name' in item and isinstance(item['name'], str):
-        item['name'] = replace_cyrillic_e_in_technical(item['name'])
-    if 'price' in item and isinstance(item['price'], str):
-        item['price'] = item['price'].replace('\u00A0', '').replace(' ', '')
-
-# Парсинг параметров из поля name
-for item in data:
-    if 'name' in item and isinstance(item['name'], str):
-        name_lower = item['name'].lower()
-
-        # type
-        type_match = re.search(r'\b(vbv|vba|vbr|vbp)\b', name_lower)
-        if type_match:
-            item['type'] = type_match.group(1).upper()
-
-        # diameter - число из 3 цифр
-        diameter_match = re.search(r'\b(\d{3})\b', item['name'])
-        if diameter_match:
-            item['diameter'] = diameter_match.group(1)
-
-        # power
-        if 'agvf370' in name_lower:
-            item['power'] = 'AGVF370'
-        elif 'agvf750' in name_lower:
-            item['power'] = 'AGVF750'
-
-        # phase
-        if '6d' in name_lower:
-            item['phase'] = '3'
-        elif '6e' in name_lower:
-            item['phase'] = '1'
-
-        # valve
-        if 'поворотный' in name_lower:
-            item['valve'] = 'поворотный'
-        elif 'гравитационный' in name_lower:
-            item['valve'] = 'гравитационный'
-        elif 'двустворчатый' in name_lower:
-            item['valve'] = 'двустворчатый'
-        elif 'без' in name_lower:
-            item['valve'] = 'без'
-
-        # position
-        if 'верх' in name_lower:
-            item['position'] = 'верх'
-        elif 'низ' in name_lower:
-            item['position'] = 'низ'
-        elif 'внутр' in name_lower:
-            item['position'] = 'внутр'
-        elif 'внешн' in name_lower:
-            item['position'] = 'внешн'
-
-        # category
-        if 'секция' in name_lower:
-            item['category'] = 'секция'
-        elif 'автомат' in name_lower:
-            item['category'] = 'автомат'
-        elif 'мембрана' in name_lower:
-            item['category'] = 'мембрана'
-        elif 'лента' in name_lower:
-            item['category'] = 'удлинение'
-        elif 'зонт' in name_lower:
-            item['category'] = 'зонт'
-        elif 'раструб' in name_lower:
-            item['category'] = 'раструб'
-        elif 'каплеуловливатель' in name_lower:
-            item['category'] = 'каплеулавливатель'
-        elif 'корона' in name_lower:
-            item['category'] = 'корона'
-        elif 'привод' in name_lower or 'электропривод' in name_lower:
-            item['category'] = 'привод'
-
-import re
-
-def replace_cyrillic_e_in_technical(name):
-    # Заменяет кириллические е/Е на латинские в частях артикулов вида 6е/6Е (например AGVF370-6Е)
-    return re.sub(r'6[еЕ](?=[\W_]|$)', lambda m: '6E' if m.group(0)[-1].isupper() else '6e', name)
-
-for item in data:
-    if 'name' in item and isinstance(item['name'], str):
-        item['name'] = replace_cyrillic_e_in_technical(item['name'])
-    if 'price' in item and isinstance(item['price'], str):
-        item['price'] = item['price'].replace('\u00A0', '').replace(' ', '')
-
-with open(output_file, 'w', encoding='utf-8') as f:
-    json.dump(data, f, ensure_ascii=False, indent=2)
-
-print(f'✅ Успешно конвертировано {len(data)} записей в файл: {output_file}')
\ No newline at end of file
+INPUT_FILE = 'data/catalog.xlsx'
+OUTPUT_FILE = 'data/komplektuyushchie.json'
+
+HEADERS = ['Артикул', 'Наименование', 'Цена']
+COLUMNS = {'Артикул': 'artikul', 'Наименование': 'name', 'Цена': 'price'}
+
+# Многоисточниковый режим (--merge): столбец цены в рублях по убыванию предпочтения и типы файлов
+PRICE_COLUMNS = ['Цена', 'Базовая_Цена_RUB']
+SOURCE_EXTENSIONS = ('.xlsx', '.csv')
+
+# Кириллические е/Е в частях артикулов вида 6е/6Е (например AGVF370-6Е) -> латинские
+CYRILLIC_E_RE = r'6[еЕ](?=[\W_]|$)'
+
+# Регулярные выражения: (поле, шаблон, по какому тексту искать)
+REGEX_RULES = [
+    ('type', r'\b(vbv|vba|vbr|vbp)\b', 'lower'),
+    ('diameter', r'\b(\d{3})\b', 'name'),  # число из 3 цифр
+]
+
+# Подстроки в name.lower(): поле -> [(подстрока, значение)], выигрывает первое совпадение
+SUBSTRING_RULES = {
+    'power': [('agvf370', 'AGVF370'), ('agvf750', 'AGVF750')],
+    'phase': [('6d', '3'), ('6e', '1')],
+    'valve': [
+        ('поворотный', 'поворотный'),
+        ('гравитационный', 'гравитационный'),
+        ('двустворчатый', 'двустворчатый'),
+        ('без', 'без'),
+    ],
+    'position': [('верх', 'верх'), ('низ', 'низ'), ('внутр', 'внутр'), ('внешн', 'внешн')],
+    'category': [
+        ('секция', 'секция'),
+        ('автомат', 'автомат'),
+        ('мембрана', 'мембрана'),
+        ('лента', 'удлинение'),
+        ('зонт', 'зонт'),
+        ('раструб', 'раструб'),
+        ('каплеуловливатель', 'каплеулавливатель'),
+        ('корона', 'корона'),
+        ('привод', 'привод'),  # в т.ч. «электропривод»
+    ],
+}
+
+# Порядок ключей разобранных параметров в JSON
+PARSED_FIELDS = ['type', 'diameter', 'power', 'phase', 'valve', 'position', 'category']
+
+
+def _column_names(header: List[Any]) -> List[str]:
+    """Имена столбцов так же, как их даёт pd.read_excel(header=N): Unnamed: i и суффиксы .1, .2 у дублей."""
+    names = [f'Unnamed: {i}' if pd.isna(v) else v for i, v in enumerate(header)]
+    counts: Dict[Any, int] = defaultdict(int)
+    for i, col in enumerate(names):
+        cur_count = counts[col]
+        while cur_count > 0:
+            counts[col] = cur_count + 1
+            col = f'{col}.{cur_count}'
+            cur_count = counts[col]
+        names[i] = col
+        counts[col] = cur_count + 1
+    return names
+
+
+def read_catalog(path: str) -> pd.DataFrame:
+    """Строки с артикулом, наименованием и ценой из листа Excel (одно чтение файла)."""
+    raw_df = pd.read_excel(path, header=None, dtype=str)
+
+    is_header = pd.Series(True, index=raw_df.index)
+    for pos, title in enumerate(HEADERS):
+        column = raw_df.iloc[:, pos] if pos < raw_df.shape[1] else pd.Series(index=raw_df.index, dtype=object)
+        is_header &= column.eq(title).fillna(False).astype(bool)
+    if not is_header.any():
+        raise ValueError('Заголовки не найдены. Убедитесь, что файл содержит "Артикул", "Наименование", "Цена".')
+    header_pos = raw_df.index.get_loc(is_header.idxmax())
+
+    df = raw_df.iloc[header_pos + 1:].copy()
+    df.columns = _column_names(list(raw_df.iloc[header_pos]))
+    df = df.dropna(subset=HEADERS)
+    return df.rename(columns=COLUMNS).astype(object)
+
+
+def read_source(path: str) -> pd.DataFrame:
+    """artikul/name/price из XLSX или CSV любой из выгрузок RawData (price — NaN, если цены нет).
+
+    Заголовок — строка, начинающаяся с «Артикул», «Наименование»; строки без артикула
+    (заголовки групп, пустые) отбрасываются, повтор артикула внутри файла — тоже.
+    """
+    if path.lower().endswith('.csv'):
+        raw_df = pd.read_csv(path, sep=None, engine='python', header=None, dtype=str, encoding='utf-8-sig')
+    else:
+        raw_df = pd.read_excel(path, header=None, dtype=str)
+    if raw_df.shape[1] < 2:
+        raise ValueError(f'{path}: нужны хотя бы столбцы "Артикул", "Наименование"')
+
+    is_header = raw_df.iloc[:, 0].str.strip().eq('Артикул') & raw_df.iloc[:, 1].str.strip().eq('Наименование')
+    is_header = is_header.fillna(False).astype(bool)
+    if not is_header.any():
+        raise ValueError(f'{path}: заголовки "Артикул", "Наименование" не найдены')
+    header_pos = raw_df.index.get_loc(is_header.idxmax())
+    header = [str(v).strip() for v in raw_df.iloc[header_pos]]
+    body = raw_df.iloc[header_pos + 1:]
+
+    price_pos = next((header.index(c) for c in PRICE_COLUMNS if c in header), None)
+    df = pd.DataFrame({
+        'artikul': body.iloc[:, 0].str.strip(),
+        'name': body.iloc[:, 1],
+        'price': body.iloc[:, price_pos] if price_pos is not None else None,
+    })
+    df = df.dropna(subset=['artikul', 'name'])
+    df = df[df['artikul'] != '']
+    return df.drop_duplicates('artikul').reset_index(drop=True).astype(object)
+
+
+def expand_sources(paths: List[str]) -> List[str]:
+    """Файлы как есть, каталоги — их XLSX/CSV по имени (временные ~$-файлы Excel пропускаются)."""
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(SOURCE_EXTENSIONS) and not name.startswith('~$')
+            )
+        else:
+            result.append(path)
+    return result
+
+
+def _priority(path: str, price_priority: List[str], default: int) -> int:
+    for pos, entry in enumerate(price_priority):
+        if entry in (path, os.path.basename(path)):
+            return pos
+    return len(price_priority) + default
+
+
+def load_sources(paths: List[str], price_priority: Optional[List[str]] = None,
+                 workers: Optional[int] = None) -> pd.DataFrame:
+    """Читает источники параллельно (пул процессов) и сводит их по артикулу.
+
+    Порядок записей и наименование — по первому появлению в порядке paths; цена — из первого
+    источника с непустой ценой в порядке price_priority (пути или имена файлов; неуказанные
+    источники идут после, в порядке paths).
+    """
+    if len(paths) > 1:
+        workers = workers or min(len(paths), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(read_source, paths))
+    else:
+        frames = [read_source(path) for path in paths]
+
+    for pos, (path, frame) in enumerate(zip(paths, frames)):
+        frame['price_rank'] = _priority(path, price_priority or [], pos)
+    rows = pd.concat(frames, ignore_index=True)
+
+    merged = rows.drop_duplicates('artikul')[['artikul', 'name']].reset_index(drop=True)
+    priced = rows[rows['price'].notna()].sort_values('price_rank', kind='stable').drop_duplicates('artikul')
+    merged['price'] = merged['artikul'].map(priced.set_index('artikul')['price'])
+    return merged.astype(object)
+
+
+def _first_match(lower: pd.Series, rules) -> pd.Series:
+    result = pd.Series(None, index=lower.index, dtype=object)
+    # в обратном порядке: более раннее правило перезаписывает более позднее
+    for needle, value in reversed(rules):
+        result = result.mask(lower.str.contains(needle, regex=False), value)
+    return result
+
+
+def clean_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Латинские 6e/6E в названиях, цена без пробелов (в т.ч. неразрывных)."""
+    df = df.copy()
+    df['name'] = df['name'].str.replace(
+        CYRILLIC_E_RE, lambda m: '6E' if m.group(0)[-1].isupper() else '6e', regex=True
+    )
+    price = df['price'].str.replace('\u00A0', '', regex=False).str.replace(' ', '', regex=False).astype(object)
+    df['price'] = price.where(price.notna(), None)  # цены может не быть в сводном каталоге
+    return df
+
+
+def extract_params(df: pd.DataFrame) -> pd.DataFrame:
+    """Добавляет столбцы PARSED_FIELDS по очищенному name (None — параметр не найден)."""
+    df = df.copy()
+    texts = {'name': df['name'], 'lower': df['name'].str.lower()}
+    parsed = {}
+    for field, pattern, source in REGEX_RULES:
+        parsed[field] = texts[source].str.extract(pattern, expand=False)
+    parsed['type'] = parsed['type'].str.upper()
+    for field, rules in SUBSTRING_RULES.items():
+        parsed[field] = _first_match(texts['lower'], rules)
+
+    for field in PARSED_FIELDS:
+        values = parsed[field].astype(object)
+        df[field] = values.where(values.notna(), None)
+    return df
+
+
+def parse_params(df: pd.DataFrame) -> pd.DataFrame:
+    """Правит name/price и добавляет столбцы PARSED_FIELDS (None — параметр не найден)."""
+    return extract_params(clean_rows(df))
+
+
+def to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Записи JSON: исходные столбцы, затем найденные параметры (ненайденные не пишутся)."""
+    base_columns = [c for c in df.columns if c not in PARSED_FIELDS]
+    records = df[base_columns].to_dict(orient='records')
+    parsed = [df[field].tolist() for field in PARSED_FIELDS]
+    for record, values in zip(records, zip(*parsed)):
+        for field, value in zip(PARSED_FIELDS, values):
+            if value is not None:
+                record[field] = value
+    return records
+
+
+def convert(input_file: str = INPUT_FILE, output_file: Optional[str] = OUTPUT_FILE) -> List[Dict[str, Any]]:
+    data = to_records(parse_params(read_catalog(input_file)))
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    return data
+
+
+def _record_hash(record: Dict[str, Any]) -> str:
+    body = json.dumps(record, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def sources_path(output_file: str) -> str:
+    """Хэши строк выгрузки, по которой собран каталог: data/komplektuyushchie.sources.json."""
+    return os.path.splitext(output_file)[0] + '.sources.json'
+
+
+def _load_source_hashes(path: str) -> Optional[Dict[str, str]]:
+    """{артикул: хэш исходной строки} прошлой конвертации или None, если истории нет."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+    except FileNotFoundError:
+        return None
+    rows = raw.get('rows') if isinstance(raw, dict) else None
+    if not isinstance(rows, dict):
+        raise ValueError(f'{path}: ожидается {{"rows": {{артикул: хэш}}}}')
+    return rows
+
+
+def _load_existing(path: str) -> Tuple[Any, List[Dict[str, Any]]]:
+    """Текущий каталог и его items; словарь со служебными блоками или «плоский» список."""
+    if not os.path.exists(path):
+        return None, []
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    if isinstance(raw, dict):
+        return raw, raw.get('items') or []
+    return raw, raw
+
+
+def write_json_atomic(path: str, data: Any) -> bytes:
+    """Пишет во временный файл рядом и подменяет os.replace — читатели не видят недописанный JSON.
+
+    Возвращает записанные байты (по ним подписывается бинарный снимок каталога).
+    """
+    body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    catalog_snapshot.write_atomic(path, body)
+    return body
+
+
+def _diff_items(old_items: List[Dict[str, Any]], new_items: List[Dict[str, Any]],
+                reparsed: List[str], unverified: List[str]) -> Dict[str, List[str]]:
+    old = {str(i.get('artikul')): i for i in old_items}
+    new = {str(i.get('artikul')): i for i in new_items}
+    repriced = [a for a in new if a in old and old[a].get('price') != new[a].get('price')]
+    repriced_set = set(repriced)
+    return {
+        'added': [a for a in new if a not in old],
+        'removed': [a for a in old if a not in new],
+        'repriced': repriced,
+        'changed': [a for a in dict.fromkeys(reparsed) if a in old and a not in repriced_set],
+        'unverified': unverified,
+    }
+
+
+def convert_incremental(input_file: str = INPUT_FILE, output_file: str = OUTPUT_FILE,
+                        full: bool = False, sources: Optional[pd.DataFrame] = None,
+                        snapshot: bool = True) -> Tuple[Any, Dict[str, List[str]]]:
+    """Обновляет каталог по выгрузке, разбирая заново только новые и изменившиеся строки.
+
+    Строка не изменилась, если хэш её исходных полей (после очистки name/price) совпадает
+    с хэшем той же строки прошлой выгрузки (sources_path) — тогда запись каталога берётся
+    как есть, вместе с ручными правками. Сравнение с самой записью вернуло бы поправленные
+    руками поля к выгрузке. Если истории выгрузки ещё нет, существующие записи сохраняются,
+    а отличающиеся от выгрузки перечисляются в сводке (unverified) — их можно пересобрать
+    через full. У перепарсенных записей сохраняются ключи, которых конвертер не порождает
+    (например code). Служебные блоки (_code_mapping, reverse_code_mapping) переносятся без
+    изменений. full=True разбирает все строки (после правки таблиц правил).
+    sources — уже сведённые строки (load_sources) вместо чтения input_file.
+    snapshot — рядом с JSON записать бинарный снимок для быстрой загрузки (catalog_snapshot).
+    Возвращает (записанный каталог, сводку изменений по артикулам).
+    """
+    existing, old_items = _load_existing(output_file)
+    previous = {str(item.get('artikul')): item for item in old_items}
+
+    df = clean_rows(read_catalog(input_file) if sources is None else sources)
+    source_columns = list(df.columns)
+    rows = df.to_dict(orient='records')
+    source_hashes = {row['artikul']: _record_hash(row) for row in rows}
+    previous_hashes = _load_source_hashes(sources_path(output_file))
+    unchanged = []
+    unverified: List[str] = []
+    for row in rows:
+        old = previous.get(row['artikul'])
+        if full or old is None:
+            unchanged.append(False)
+        elif previous_hashes is None:
+            unchanged.append(True)
+            if _record_hash({c: old.get(c) for c in source_columns}) != source_hashes[row['artikul']]:
+                unverified.append(row['artikul'])
+        else:
+            unchanged.append(previous_hashes.get(row['artikul']) == source_hashes[row['artikul']])
+
+    changed_mask = [not u for u in unchanged]
+    reparsed = iter(to_records(extract_params(df[changed_mask])))
+    generated = set(source_columns) | set(PARSED_FIELDS)
+    items: List[Dict[str, Any]] = []
+    reparsed_articles: List[str] = []
+    for row, keep in zip(rows, unchanged):
+        if keep:
+            items.append(previous[row['artikul']])
+            continue
+        item = next(reparsed)
+        old = previous.get(row['artikul'])
+        if old is not None:
+            item.update((k, v) for k, v in old.items() if k not in generated)
+        items.append(item)
+        reparsed_articles.append(row['artikul'])
+
+    if isinstance(existing, dict):
+        data: Any = dict(existing)
+        data['items'] = items
+    else:
+        data = items
+    body = write_json_atomic(output_file, data)
+    write_json_atomic(sources_path(output_file), {'columns': source_columns, 'rows': source_hashes})
+    if snapshot:
+        try:
+            catalog_snapshot.write_snapshot(output_file, data, body)
+        except ValueError as exc:
+            print(f'⚠️ Бинарный снимок не записан ({exc}), main.py будет читать JSON')
+    return data, _diff_items(old_items, items, reparsed_articles, unverified)
+
+
+def _print_summary(diff: Dict[str, List[str]], items: List[Dict[str, Any]], code_mapping: Dict[str, str],
+                   output_file: str, limit: int = 10) -> None:
+    total = len(items)
+    unpriced = [str(i.get('artikul')) for i in items if i.get('price') in (None, '')]
+    titles = {'added': 'Добавлено', 'removed': 'Удалено', 'repriced': 'Изменена цена', 'changed': 'Изменено'}
+    unverified = diff.get('unverified') or []
+    print(f'✅ Каталог обновлён: {total} записей в файле {output_file}')
+    for key, title in titles.items():
+        articles = diff[key]
+        if not articles:
+            continue
+        tail = f' … (+{len(articles) - limit})' if len(articles) > limit else ''
+        print(f'   {title}: {len(articles)} — {", ".join(articles[:limit])}{tail}')
+    if not any(diff[key] for key in titles):
+        print('   Изменений нет')
+    if unverified:
+        tail = f' … (+{len(unverified) - limit})' if len(unverified) > limit else ''
+        print(f'⚠️ Истории выгрузки ({os.path.basename(sources_path(output_file))}) ещё не было: '
+              f'{len(unverified)} записей отличаются от выгрузки и оставлены как есть (ручные правки?) — '
+              f'{", ".join(unverified[:limit])}{tail}. Пересобрать их по выгрузке: --full')
+    if unpriced:
+        tail = f' … (+{len(unpriced) - limit})' if len(unpriced) > limit else ''
+        print(f'⚠️ Без цены: {len(unpriced)} — {", ".join(unpriced[:limit])}{tail}')
+    removed = set(diff['removed'])
+    lost = sorted({art for art in code_mapping.values() if art in removed})
+    if lost:
+        print(f'⚠️ Артикулы из _code_mapping пропали из выгрузки: {", ".join(lost)}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Конвертация Excel-каталога комплектующих в JSON')
+    parser.add_argument('--input', default=INPUT_FILE, help='Excel-файл выгрузки')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='JSON-файл каталога')
+    parser.add_argument('--full', action='store_true', help='разобрать все строки заново (после правки правил)')
+    parser.add_argument('--merge', nargs='+', metavar='PATH',
+                        help='свести несколько XLSX/CSV (файлы или каталоги, напр. RawData) вместо --input')
+    parser.add_argument('--price-priority', nargs='+', metavar='FILE',
+                        help='порядок источников для цены (пути или имена файлов); по умолчанию — порядок --merge')
+    parser.add_argument('--workers', type=int, help='число процессов для чтения источников')
+    parser.add_argument('--no-snapshot', action='store_true', help='не писать бинарный снимок каталога')
+    args = parser.parse_args()
+
+    sources = None
+    if args.merge:
+        paths = expand_sources(args.merge)
+        if not paths:
+            parser.error('в --merge нет XLSX/CSV файлов')
+        sources = load_sources(paths, args.price_priority, args.workers)
+        print(f'Источники ({len(paths)}): {", ".join(os.path.basename(p) for p in paths)}')
+
+    data, diff = convert_incremental(args.input, args.output, full=args.full, sources=sources,
+                                     snapshot=not args.no_snapshot)
+    items = data['items'] if isinstance(data, dict) else data
+    code_mapping = data.get('_code_mapping', {}) if isinstance(data, dict) else {}
+    _print_summary(diff, items, code_mapping, args.output)
+
+
+if __name__ == '__main__':
+    main()
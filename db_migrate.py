@@ -0,0 +1,219 @@
+"""
+Миграции схемы справочника компаний (PIFAGOR_DB/pifagor.db).
+Версия схемы хранится в PRAGMA user_version; каждая миграция применяется один раз.
+Запуск: python db_migrate.py [--db путь] [--rebuild-fts] [--check-plans]
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+from typing import List
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(BASE_DIR, "PIFAGOR_DB", "pifagor.db")
+
+# Колонки полнотекстового индекса компаний (holding_name — из holdings)
+FTS_COLUMNS = ["name", "address_full", "region", "district", "locality", "street", "holding_name"]
+
+FTS_SELECT = """
+    SELECT c.id, c.name, c.address_full, c.region, c.district, c.locality, c.street,
+           (SELECT h.name FROM holdings h WHERE h.id = c.holding_id)
+    FROM companies c
+"""
+
+
+def _fts_insert(alias: str) -> str:
+    return (
+        "INSERT INTO companies_fts(rowid, name, address_full, region, district, locality, street, holding_name) "
+        f"VALUES ({alias}.id, {alias}.name, {alias}.address_full, {alias}.region, {alias}.district, "
+        f"{alias}.locality, {alias}.street, (SELECT h.name FROM holdings h WHERE h.id = {alias}.holding_id));"
+    )
+
+
+def _migration_fts(conn: sqlite3.Connection) -> None:
+    """FTS5 (trigram, регистр не важен) по названию, адресу и холдингу; синхронизация триггерами."""
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS companies_fts USING fts5("
+        + ", ".join(FTS_COLUMNS)
+        + ", tokenize = 'trigram')"
+    )
+    conn.executescript(f"""
+        CREATE TRIGGER IF NOT EXISTS companies_fts_ai AFTER INSERT ON companies BEGIN
+            {_fts_insert("new")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS companies_fts_ad AFTER DELETE ON companies BEGIN
+            DELETE FROM companies_fts WHERE rowid = old.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS companies_fts_au AFTER UPDATE ON companies BEGIN
+            DELETE FROM companies_fts WHERE rowid = old.id;
+            {_fts_insert("new")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS holdings_fts_au AFTER UPDATE OF name ON holdings BEGIN
+            UPDATE companies_fts SET holding_name = new.name
+            WHERE rowid IN (SELECT id FROM companies WHERE holding_id = new.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS holdings_fts_ad AFTER DELETE ON holdings BEGIN
+            UPDATE companies_fts SET holding_name = NULL
+            WHERE rowid IN (SELECT id FROM companies WHERE holding_id = old.id);
+        END;
+    """)
+    rebuild_fts(conn)
+
+
+def _migration_indexes(conn: sqlite3.Connection) -> None:
+    """Индексы под фильтры/сортировку списка компаний и под связи карточки компании.
+
+    sites(company_id) и site_contacts(site_id) уже покрыты индексами UNIQUE-ограничений.
+    Телефоны — покрывающий (contact_id, phone): тот же порядок group_concat, что и у
+    автоматического индекса, который SQLite строил на каждый запрос.
+    """
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_companies_name ON companies(name COLLATE NOCASE, id);
+        CREATE INDEX IF NOT EXISTS idx_companies_region ON companies(region, name COLLATE NOCASE, id);
+        CREATE INDEX IF NOT EXISTS idx_companies_parent ON companies(parent_company_id, name COLLATE NOCASE, id);
+        CREATE INDEX IF NOT EXISTS idx_companies_holding ON companies(holding_id);
+        CREATE INDEX IF NOT EXISTS idx_companies_production
+            ON companies(json_extract(production_type, '$.primary'), name COLLATE NOCASE, id);
+        CREATE INDEX IF NOT EXISTS idx_site_contact_phones_contact ON site_contact_phones(contact_id, phone);
+        CREATE INDEX IF NOT EXISTS idx_site_websites_site ON site_websites(site_id, url);
+    """)
+
+
+# (версия, описание, функция) — только добавлять в конец
+MIGRATIONS = [
+    (1, "companies_fts: полнотекстовый поиск по компаниям", _migration_fts),
+    (2, "индексы справочника компаний", _migration_indexes),
+]
+
+
+def rebuild_fts(conn: sqlite3.Connection) -> int:
+    """Полностью пересобирает companies_fts из companies/holdings."""
+    conn.execute("DELETE FROM companies_fts")
+    conn.execute(
+        "INSERT INTO companies_fts(rowid, name, address_full, region, district, locality, street, holding_name) "
+        + FTS_SELECT
+    )
+    conn.execute("INSERT INTO companies_fts(companies_fts) VALUES ('optimize')")
+    return conn.execute("SELECT COUNT(*) FROM companies_fts").fetchone()[0]
+
+
+def migrate(db_path: str = DEFAULT_DB) -> int:
+    """Применяет недостающие миграции; возвращает итоговую версию схемы."""
+    conn = sqlite3.connect(db_path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, title, apply in MIGRATIONS:
+            if target <= version:
+                continue
+            with conn:
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {int(target)}")
+            print(f"✅ Миграция {target}: {title}")
+            version = target
+        return version
+    finally:
+        conn.close()
+
+
+# «SCAN <таблица>» в плане — полный проход; виртуальные таблицы (FTS) и подзапросы не в счёт.
+# «SCAN <таблица> USING INDEX» без сортировки во временном B-дереве — обход индекса в порядке
+# ORDER BY, который останавливается на LIMIT
+_FULL_SCAN_RE = re.compile(r"^SCAN (\w+)(?!\w| VIRTUAL TABLE)")
+_INDEX_SCAN_RE = re.compile(r"^SCAN \w+ USING (?:COVERING )?INDEX ")
+_TEMP_SORT = "USE TEMP B-TREE FOR ORDER BY"
+_SUBQUERY_RE = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)")
+
+
+def _directory_queries(conn: sqlite3.Connection):
+    """Запросы справочника в том виде, в каком их строит main.py: (метка, sql, params)."""
+    import main  # noqa: E402 — нужен только для проверки планов
+
+    has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'companies_fts'").fetchone() is not None
+    filter_sets = {
+        "region": {"region": "x"},
+        "production": {"production": "x"},
+        "roots": {"only_roots": True},
+        "region+production": {"region": "x", "production": "x"},
+    }
+    for label, filters in dict(filter_sets, all={}).items():
+        data_sql, params, _, _ = main._companies_query(filters, use_fts=False)
+        yield f"list[{label}]", data_sql, params + [10, 0]
+        data_sql, params, _, _ = main._companies_query(filters, use_fts=False, after=["x", 1])
+        yield f"cursor[{label}]", data_sql, params + [10]
+    for label, filters in filter_sets.items():
+        for name, (_, _, own_filter) in main.FACETS.items():
+            if set(filters) <= {own_filter}:
+                continue  # без собственного фильтра фасет считает все строки
+            sql, params = main._facet_query(name, filters, use_fts=False)
+            yield f"facet:{name}[{label}]", sql, params
+    if has_fts:
+        for name in main.FACETS:
+            sql, params = main._facet_query(name, {"search_norm": "xyz"}, use_fts=True)
+            yield f"facet:{name}[fts]", sql, params
+        data_sql, params, _, _ = main._companies_query({"search_norm": "xyz"}, use_fts=True)
+        yield "search[fts]", data_sql, params + [10, 0]
+        data_sql, params, _, _ = main._companies_query({"search_norm": "xyz", "region": "x"}, use_fts=True, after=[0.0, "x", 1])
+        yield "cursor[fts+region]", data_sql, params + [10]
+    yield "company", main.COMPANY_DETAIL_SQL, [1]
+
+
+def check_query_plans(db_path: str = DEFAULT_DB) -> List[str]:
+    """EXPLAIN QUERY PLAN по запросам справочника; возвращает найденные полные проходы.
+
+    Фасеты без фильтров (считают все строки) и поиск короче трёх символов (LIKE)
+    сканируют таблицу по определению и не проверяются.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.create_function("normtxt", 1, lambda v: "" if v is None else str(v).strip().casefold(), deterministic=True)
+    problems = []
+    try:
+        for label, sql, params in _directory_queries(conn):
+            details = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            subqueries = {m.group(1) for m in map(_SUBQUERY_RE.match, details) if m}
+            ordered = _TEMP_SORT not in details
+            scans = []
+            for detail in details:
+                m = _FULL_SCAN_RE.match(detail)
+                if not m or m.group(1) in subqueries:
+                    continue
+                if ordered and "LIMIT ?" in sql and _INDEX_SCAN_RE.match(detail):
+                    continue
+                scans.append(detail)
+            if scans:
+                problems.append(f"{label}: {'; '.join(scans)}")
+    finally:
+        conn.close()
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Миграции схемы pifagor.db")
+    parser.add_argument("--db", default=DEFAULT_DB, help="путь к pifagor.db")
+    parser.add_argument("--rebuild-fts", action="store_true", help="пересобрать полнотекстовый индекс компаний")
+    parser.add_argument("--check-plans", action="store_true",
+                        help="проверить EXPLAIN QUERY PLAN запросов справочника (код выхода 1 при полном проходе)")
+    args = parser.parse_args()
+
+    version = migrate(args.db)
+    print(f"Схема pifagor.db: версия {version}")
+    if args.rebuild_fts:
+        conn = sqlite3.connect(args.db)
+        try:
+            with conn:
+                count = rebuild_fts(conn)
+        finally:
+            conn.close()
+        print(f"✅ companies_fts пересобран: {count} записей")
+    if args.check_plans:
+        problems = check_query_plans(args.db)
+        for line in problems:
+            print(f"❌ Полный проход: {line}")
+        if problems:
+            sys.exit(1)
+        print("✅ Планы запросов справочника используют индексы")
+
+
+if __name__ == "__main__":
+    main()
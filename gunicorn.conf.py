@@ -0,0 +1,76 @@
+"""
+Конфигурация gunicorn для продакшена: gunicorn -c gunicorn.conf.py
+
+Приложение загружается в мастере до fork (preload_app): каталог, индексы и таблица
+подбора строятся один раз, воркеры получают их копией страниц. Воркеры gthread —
+процессы по числу ядер, в каждом пул потоков: SQLite справочника и запись xlsx
+отпускают GIL, keep-alive держит соединения клиентов между запросами.
+
+Переопределение через окружение:
+    CHIMENEY_BIND       адрес (по умолчанию 0.0.0.0:$CHIMENEY_PORT, порт 5001)
+    CHIMENEY_WORKERS    процессов (по умолчанию число доступных ядер)
+    CHIMENEY_THREADS    потоков на процесс (по умолчанию 4)
+    CHIMENEY_KEEPALIVE  секунд keep-alive (по умолчанию 5)
+    CHIMENEY_METRICS_DIR  каталог метрик воркеров (по умолчанию временный): /metrics
+                          в любом воркере сводит значения всех процессов (см. metrics.py)
+
+Профилирование медленных запросов (profiling.py) здесь выключено: cProfile замедляет каждый
+профилируемый запрос. Включать на время разбора — CHIMENEY_PROFILE_ENABLE=1 и
+CHIMENEY_PROFILE_SLOW_MS, лучше вместе с CHIMENEY_PROFILE_SAMPLE=0.1.
+"""
+
+import gc
+import os
+import tempfile
+
+
+def _cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))  # учитывает ограничение ядер контейнера/taskset
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+wsgi_app = "main:create_app(watch=False)"
+bind = os.environ.get("CHIMENEY_BIND") or f"0.0.0.0:{os.environ.get('CHIMENEY_PORT', '5001')}"
+preload_app = True
+
+worker_class = "gthread"
+workers = int(os.environ.get("CHIMENEY_WORKERS") or _cpu_count())
+threads = int(os.environ.get("CHIMENEY_THREADS") or 4)
+keepalive = int(os.environ.get("CHIMENEY_KEEPALIVE") or 5)
+# Экспорт большого проекта в xlsx — секунды; 60 с с запасом
+timeout = 60
+graceful_timeout = 30
+
+# Явно: профилировщик не включается унаследованной переменной без CHIMENEY_PROFILE_ENABLE=1
+if os.environ.get("CHIMENEY_PROFILE_ENABLE") != "1":
+    os.environ.pop("CHIMENEY_PROFILE_SLOW_MS", None)
+
+# До загрузки приложения: metrics читает каталог при импорте
+if not os.environ.get("CHIMENEY_METRICS_DIR"):
+    os.environ["CHIMENEY_METRICS_DIR"] = tempfile.mkdtemp(prefix="chimeney_metrics_")
+
+import metrics  # noqa: E402
+
+metrics.clear_multiprocess_dir()
+
+accesslog = "-"
+errorlog = "-"
+
+
+def when_ready(server):
+    # Объекты, созданные при загрузке, — в постоянное поколение GC: сборщик в воркерах
+    # их не обходит и не трогает их заголовки, страницы остаются общими с мастером
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import main
+
+    main.start_catalog_watcher()
+
+
+def child_exit(server, worker):
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,256 @@
+"""
+Нагрузочный тест HTTP: dev-сервер Flask (`python main.py`) против gunicorn (gunicorn.conf.py).
+
+Каждый сервер поднимается на свободном порту, прогревается и нагружается одной и той же
+смесью запросов: /api/select по конфигурациям опроса (config_space), страницы
+/api/catalog/companies на всю глубину (по номеру page= и по курсору next_cursor) и
+/api/export. Клиенты — процессы с потоками, у каждого потока одно keep-alive соединение
+(http.client), поэтому клиент не упирается в GIL.
+Результат — запросов в секунду, перцентили латентности и ошибки по каждой цели.
+
+dev по умолчанию запускается как раньше в продакшене — с отладчиком и перезагрузчиком
+(CHIMENEY_DEBUG=1); --dev-nodebug — без них.
+
+Запуск:
+    python loadtest.py                                   # dev и gunicorn, по 20 с
+    python loadtest.py --targets gunicorn --concurrency 64 --duration 60
+    python loadtest.py --url http://127.0.0.1:5001       # уже запущенный сервер
+    python loadtest.py --out loadtest.json
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TARGETS = ("dev", "gunicorn")
+# Доли запросов в смеси: подбор — основной трафик формы, экспорт — редкий и тяжёлый
+MIX = (("select", 8), ("companies", 2), ("export", 1))
+READY_PATH = "/api/select/cache"
+PAYLOADS = 2000
+DIRECTORY_LIMIT = 20
+# Сколько страниц справочника пройти по курсору (next_cursor) при сборке смеси
+DIRECTORY_CURSORS = 50
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _directory_paths(main) -> List[str]:
+    """Страницы справочника: по номеру (page=) на всю глубину и по курсору (keyset)."""
+    client = main.app.test_client()
+    base = f"/api/catalog/companies?limit={DIRECTORY_LIMIT}"
+    first = client.get(base).get_json()
+    pages = max(1, -(-first["total"] // DIRECTORY_LIMIT))
+    paths = [f"{base}&page={page}" for page in range(1, pages + 1)]
+    cursor = first.get("next_cursor")
+    while cursor and len(paths) < pages + DIRECTORY_CURSORS:
+        paths.append(f"{base}&cursor={cursor}")
+        cursor = client.get(f"{base}&cursor={cursor}").get_json().get("next_cursor")
+    return paths
+
+
+def _requests_pool() -> List[Tuple[str, str, Optional[bytes]]]:
+    """Запросы смеси (метод, путь, тело) в нужных долях, перемешанные."""
+    import config_space
+    import main
+
+    configs = list(config_space.iter_configurations(main.catalog.code_mapping))
+    rnd = random.Random(42)
+    configs = [c for c in rnd.sample(configs, min(PAYLOADS, len(configs))) if main._select_components(dict(c))[0]]
+    directory = _directory_paths(main)
+    pool: List[Tuple[str, str, Optional[bytes]]] = []
+    for kind, weight in MIX:
+        for i in range(weight * 50):
+            payload = json.dumps(configs[rnd.randrange(len(configs))]).encode("utf-8")
+            if kind == "select":
+                pool.append(("POST", "/api/select", payload))
+            elif kind == "export":
+                pool.append(("POST", "/api/export", payload))
+            else:
+                pool.append(("GET", directory[rnd.randrange(len(directory))], None))
+    rnd.shuffle(pool)
+    return pool
+
+
+# === Клиент ===
+
+def _client_thread(host: str, port: int, pool, deadline: float, seed: int, out: Dict[str, Any]) -> None:
+    rnd = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+    while time.perf_counter() < deadline:
+        method, path, body = pool[rnd.randrange(len(pool))]
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            out["errors"] += 1
+            continue
+        out["latencies"].append(time.perf_counter() - t0)
+        if status != 200:
+            out["non_200"] += 1
+    conn.close()
+
+
+def _client_process(args: Tuple[str, int, list, float, int, int]) -> Dict[str, Any]:
+    host, port, pool, duration, threads, seed = args
+    deadline = time.perf_counter() + duration
+    results = [{"latencies": [], "errors": 0, "non_200": 0} for _ in range(threads)]
+    workers = [threading.Thread(target=_client_thread, args=(host, port, pool, deadline, seed * 1000 + i, r))
+               for i, r in enumerate(results)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return {
+        "latencies": [x for r in results for x in r["latencies"]],
+        "errors": sum(r["errors"] for r in results),
+        "non_200": sum(r["non_200"] for r in results),
+    }
+
+
+def run_load(url: str, pool, duration: float, concurrency: int, procs: int) -> Dict[str, Any]:
+    parts = urlsplit(url)
+    procs = max(1, min(procs, concurrency))
+    per_proc = [concurrency // procs + (1 if i < concurrency % procs else 0) for i in range(procs)]
+    ctx = multiprocessing.get_context("spawn")
+    started = time.perf_counter()
+    with ctx.Pool(procs) as p:
+        parts_out = p.map(_client_process, [(parts.hostname, parts.port or 80, pool, duration, n, i)
+                                            for i, n in enumerate(per_proc)])
+    elapsed = time.perf_counter() - started
+    latencies = sorted(x for r in parts_out for x in r["latencies"])
+    if not latencies:
+        return {"requests": 0, "errors": sum(r["errors"] for r in parts_out)}
+
+    def pct(q: float) -> float:
+        return latencies[min(len(latencies) - 1, round(q * (len(latencies) - 1)))] * 1000
+
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / duration,
+        "wall_seconds": elapsed,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": latencies[-1] * 1000,
+        "errors": sum(r["errors"] for r in parts_out),
+        "non_200": sum(r["non_200"] for r in parts_out),
+    }
+
+
+# === Серверы ===
+
+def _server_command(target: str, port: int, dev_debug: bool) -> Tuple[List[str], Dict[str, str]]:
+    env = dict(os.environ, CHIMENEY_PORT=str(port))
+    env.pop("CHIMENEY_PROFILE_SLOW_MS", None)
+    if target == "dev":
+        env["CHIMENEY_DEBUG"] = "1" if dev_debug else "0"
+        return [sys.executable, os.path.join(BASE_DIR, "main.py")], env
+    env["CHIMENEY_BIND"] = f"127.0.0.1:{port}"
+    # без access-лога: запись строки на каждый запрос меряла бы диск, а не сервер
+    return [sys.executable, "-m", "gunicorn", "-c", os.path.join(BASE_DIR, "gunicorn.conf.py"),
+            "--access-logfile", "/dev/null"], env
+
+
+def _wait_ready(port: int, proc: subprocess.Popen, timeout: float = 90.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"сервер завершился с кодом {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", READY_PATH)
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"сервер не ответил за {timeout:.0f} с")
+
+
+def run_target(target: str, pool, duration: float, concurrency: int, procs: int, dev_debug: bool) -> Dict[str, Any]:
+    port = _free_port()
+    cmd, env = _server_command(target, port, dev_debug)
+    # своя группа процессов: перезагрузчик dev-сервера порождает дочерний процесс
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=env, start_new_session=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_ready(port, proc)
+        url = f"http://127.0.0.1:{port}"
+        run_load(url, pool, min(duration, 3.0), concurrency, procs)  # прогрев
+        return run_load(url, pool, duration, concurrency, procs)
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+
+
+def _print(label: str, r: Dict[str, Any]) -> None:
+    if not r.get("requests"):
+        print(f"  {label:<10} нет ответов (ошибок: {r.get('errors', 0)})")
+        return
+    print(f"  {label:<10} {r['rps']:>8.1f} rps  p50 {r['p50_ms']:>7.1f} мс  p95 {r['p95_ms']:>7.1f} мс  "
+          f"p99 {r['p99_ms']:>7.1f} мс  ошибок {r['errors']}, не 200: {r['non_200']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест: dev-сервер Flask против gunicorn")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"через запятую: {', '.join(TARGETS)}")
+    parser.add_argument("--url", help="нагрузить уже запущенный сервер вместо запуска своих")
+    parser.add_argument("--duration", type=float, default=20.0, help="секунд нагрузки на цель")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных соединений")
+    parser.add_argument("--procs", type=int, default=4, help="процессов-клиентов")
+    parser.add_argument("--dev-nodebug", action="store_true", help="dev-сервер без отладчика и перезагрузчика")
+    parser.add_argument("--out", help="записать результаты в JSON")
+    args = parser.parse_args()
+
+    pool = _requests_pool()
+    print(f"Смесь: {len(pool)} запросов ({', '.join(f'{k} ×{w}' for k, w in MIX)}), "
+          f"{args.concurrency} соединений, {args.duration:.0f} с")
+    results: Dict[str, Any] = {}
+    if args.url:
+        results["url"] = run_load(args.url, pool, args.duration, args.concurrency, args.procs)
+        _print("url", results["url"])
+    else:
+        targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            parser.error(f"неизвестные цели: {', '.join(sorted(unknown))}")
+        for target in targets:
+            results[target] = run_target(target, pool, args.duration, args.concurrency, args.procs,
+                                         dev_debug=not args.dev_nodebug)
+            _print(target, results[target])
+        if results.get("dev", {}).get("requests") and results.get("gunicorn", {}).get("requests"):
+            print(f"gunicorn / dev: ×{results['gunicorn']['rps'] / results['dev']['rps']:.2f} rps")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
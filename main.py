@@ -2,44 +2,41 @@
 # Flask-сервер для подбора вентиляционной шахты
 # Контракт: POST /api/select -> {results: [{article, name, quantity}]}
 
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, g, request, jsonify, send_from_directory, send_file
+import base64
+import hashlib
+import itertools
 import json
+import math
 import os
 import re
 import sqlite3
-from typing import Dict, Any, List, Optional
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Any, List, Optional, Tuple
+
+import catalog_snapshot
+import config_space
+import metrics
+import profiling
 
-from io import BytesIO
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
 
 app = Flask(__name__)
 
 # === Загрузка каталога ===
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CATALOG_PATH = os.path.join(BASE_DIR, "data", "komplektuyushchie.json")
-PIFAGOR_DB = os.path.join(BASE_DIR, "PIFAGOR_DB", "pifagor.db")
-
-with open(CATALOG_PATH, "r", encoding="utf-8") as f:
-    raw = json.load(f)
-
-if isinstance(raw, dict):
-    code_mapping: Dict[str, str] = raw.get("_code_mapping", {})
-    items: List[Dict[str, Any]] = raw.get("items")
-    if not items:
-        # fallback: если данные пришли «плоским» массивом внутри словаря
-        items = [v for v in raw.values() if isinstance(v, dict)]
-else:
-    # fallback: если это список словарей без служебного блока
-    items = raw
-    code_mapping = {}
-
-# Индексы
-by_art: Dict[str, Dict[str, Any]] = {}
-for it in items:
-    art = str(it.get("artikul") or it.get("article") or "").strip()
-    if art:
-        by_art[art] = it
-
+# CHIMENEY_PIFAGOR_DB — другой файл справочника (копия для бенчмарка, стенд)
+PIFAGOR_DB = os.environ.get("CHIMENEY_PIFAGOR_DB") or os.path.join(BASE_DIR, "PIFAGOR_DB", "pifagor.db")
 
 # === Утилиты ===
 
@@ -57,58 +54,175 @@ def _phase_from_motor(motor: str) -> str:
     return {"6e": "1", "6d": "3"}.get(motor, "")
 
 
-def _find(predicate):
-    for it in items:
-        try:
-            if predicate(it):
-                return it
-        except Exception:
-            continue
-    return None
+def _name_has(it: "CatalogItem", *need):
+    name = it.name_lower
+    return all(w in name for w in need)
 
 
-def _find_all(predicate):
-    out = []
-    for it in items:
+# === Запись каталога ===
+
+def _parse_price(raw: Dict[str, Any]) -> float:
+    for key in ("price", "цена", "cost"):
+        v = raw.get(key)
+        if v is None:
+            continue
         try:
-            if predicate(it):
-                out.append(it)
+            price = float(str(v).replace(' ', '').replace(',', '.'))
         except Exception:
             continue
-    return out
+        if math.isfinite(price):
+            return price
+    return 0.0
 
 
-def _name_has(it: Dict[str, Any], *need):
-    name = _norm(it.get("name"))
-    return all(w in name for w in need)
+def _field(raw: Dict[str, Any], key: str) -> str:
+    v = raw.get(key)
+    return "" if v is None else sys.intern(str(v).strip())
+
+
+class CatalogItem:
+    """Запись каталога, нормализованная один раз при загрузке снимка.
+
+    Отсутствующие строковые поля — ""; name_lower, category и type — как после _norm
+    (нижний регистр), price — число (0.0, если цена не разбирается).
+    """
+
+    __slots__ = ("article", "name", "name_lower", "category", "type", "diameter",
+                 "power", "phase", "valve", "position", "price")
+
+    def __init__(self, article: str, name: str, category: str = "", type: str = "", diameter: str = "",
+                 power: str = "", phase: str = "", valve: str = "", position: str = "", price: float = 0.0):
+        self.article = article
+        self.name = name
+        self.name_lower = _norm(name)
+        self.category = category
+        self.type = type
+        self.diameter = diameter
+        self.power = power
+        self.phase = phase
+        self.valve = valve
+        self.position = position
+        self.price = price
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "CatalogItem":
+        return cls(
+            article=str(raw.get("artikul") or raw.get("article") or "").strip(),
+            name=str(raw.get("name") or ""),
+            category=sys.intern(_norm(raw.get("category"))),
+            type=sys.intern(_norm(raw.get("type"))),
+            diameter=_field(raw, "diameter"),
+            power=_field(raw, "power"),
+            phase=_field(raw, "phase"),
+            valve=_field(raw, "valve"),
+            position=_field(raw, "position"),
+            price=_parse_price(raw),
+        )
+
+    def __repr__(self) -> str:
+        return f"CatalogItem({self.article!r}, {self.name!r})"
+
 
+# === Индекс каталога ===
 
-def pick_membrana_by_diam(diam: str):
+_WORD_RE = re.compile(r"\w+")
+
+
+class CatalogIndex:
+    """Индекс каталога: строится один раз при загрузке, пикеры обращаются к словарям вместо полного прохода.
+
+    Позиции элементов сохраняют порядок каталога, поэтому «первый подходящий» совпадает
+    с тем, что раньше находил линейный поиск.
+    """
+
+    MEMO_LIMIT = 4096
+
+    def __init__(self, items: List[CatalogItem]):
+        self.items = items
+        self._by_attr: Dict[tuple, List[int]] = {}
+        self._tokens: Dict[str, List[int]] = {}
+        self._memo: Dict[tuple, tuple] = {}
+
+        for pos, it in enumerate(items):
+            cat, typ, diam = it.category, it.type, it.diameter
+            # (категория, тип, диаметр); None — «любое значение»
+            for key in ((cat, None, None), (cat, typ, None), (cat, None, diam), (cat, typ, diam)):
+                self._by_attr.setdefault(key, []).append(pos)
+            for tok in set(_WORD_RE.findall(it.name_lower)):
+                self._tokens.setdefault(tok, []).append(pos)
+
+    def positions(self, category: str, type: Optional[str] = None, diameter: Optional[str] = None) -> List[int]:
+        """Позиции по точному совпадению нормализованных category/type/diameter."""
+        return self._by_attr.get((category, type, diameter), [])
+
+    def named(self, *needles: str) -> tuple:
+        """Позиции элементов, в нижнерегистровом имени которых есть все подстроки needles."""
+        key = ("named",) + needles
+        hit = self._memo.get(key)
+        if hit is not None:
+            return hit
+        found: Optional[set] = None
+        for needle in needles:
+            cur = set(self._needle_positions(needle))
+            found = cur if found is None else found & cur
+        out = tuple(sorted(found if found is not None else range(len(self.items))))
+        self._remember(key, out)
+        return out
+
+    def _needle_positions(self, needle: str) -> tuple:
+        key = ("needle", needle)
+        hit = self._memo.get(key)
+        if hit is not None:
+            return hit
+        if _WORD_RE.fullmatch(needle):
+            # подстрока из «словесных» символов целиком лежит внутри одного токена имени
+            found = set()
+            for tok, plist in self._tokens.items():
+                if needle in tok:
+                    found.update(plist)
+            out = tuple(sorted(found))
+        else:
+            out = tuple(pos for pos, it in enumerate(self.items) if needle in it.name_lower)
+        self._remember(key, out)
+        return out
+
+    def _remember(self, key: tuple, value: tuple) -> None:
+        # диаметр приходит из запроса: не даём мемо расти без ограничений
+        if len(self._memo) >= self.MEMO_LIMIT:
+            self._memo.clear()
+        self._memo[key] = value
+
+    def first(self, *groups) -> Optional[CatalogItem]:
+        """Первый по порядку каталога элемент из объединения групп позиций."""
+        best = None
+        for group in groups:
+            if group and (best is None or group[0] < best):
+                best = group[0]
+        return self.items[best] if best is not None else None
+
+    @staticmethod
+    def both(a, b) -> List[int]:
+        """Пересечение двух групп позиций с сохранением порядка каталога."""
+        bs = set(b)
+        return [pos for pos in a if pos in bs]
+
+
+
+def pick_membrana_by_diam(diam: str, cat: Optional["CatalogSnapshot"] = None):
     """Ищем мембрану строго под диаметр: сначала по полю diameter, затем по имени."""
+    idx = (cat or catalog).index
     # по атрибуту diameter
-    it = _find(lambda x: _norm(x.get("category")) == "мембрана" and str(x.get("diameter", "")).strip() == diam)
+    it = idx.first(idx.positions("мембрана", diameter=diam))
     if it:
         return it
     # по имени (например, "VB-710" или просто "710")
-    return _find(lambda x: _norm(x.get("category")) == "мембрана" and (diam in _norm(x.get("name"))))
+    return idx.first(idx.both(idx.positions("мембрана"), idx.named(diam)))
 
 
-def pick_lenta():
+def pick_lenta(cat: Optional["CatalogSnapshot"] = None):
     """Ищем универсальную битумную ленту по имени."""
-    return _find(lambda x: "лента" in _norm(x.get("name")))
-
-
-def pick_hermetic(membrana: bool, lenta: bool):
-    out = []
-    if membrana:
-        it = _find(lambda x: _norm(x.get("category")) == "мембрана" or "мембран" in _norm(x.get("name")))
-        if it:
-            out.append(it)
-    if lenta:
-        it = _find(lambda x: "лента" in _norm(x.get("name")))  # иногда категория другая
-        if it:
-            out.append(it)
-    return out
+    idx = (cat or catalog).index
+    return idx.first(idx.named("лента"))
 
 
 # === Формирование ключа для _code_mapping ===
@@ -157,121 +271,301 @@ def build_code_key(payload: Dict[str, Any]) -> str:
 
 # === Подбор доп.комплектующих ===
 
-def pick_drive_for_pov(diam: str):
-    # Заглушка: на текущей итерации приводы не подбираем вовсе
-    return None
-
-
-def pick_top_part(kind: str, diam: str):
+def pick_top_part(kind: str, diam: str, cat: Optional["CatalogSnapshot"] = None):
     # kind: 'zont'|'rastrub' (универсальные, без привязки к диаметру)
+    cat = cat or catalog
+    idx = cat.index
     kind = _norm(kind)
     if kind == "zont":
         # сначала по категории, затем по имени
-        if "89174" in by_art:
-            return by_art["89174"]
-        it = _find(lambda x: _name_has(x, "комплект", "зонт"))
+        if "89174" in cat.by_art:
+            return cat.by_art["89174"]
+        it = idx.first(idx.named("комплект", "зонт"))
         if it:
-            return it    
-        it = _find(lambda x: _norm(x.get("category")) == "зонт")
+            return it
+        it = idx.first(idx.positions("зонт"))
         if it:
             return it
-        return _find(lambda x: _name_has(x, "зонт"))
+        return idx.first(idx.named("зонт"))
     if kind == "rastrub":
         # Раструб привязан к диаметру: сначала ищем по атрибутам, затем по имени
         # 1) по category/diameter, если в каталоге заполнены поля
-        it = _find(lambda x: _norm(x.get("category")) == "раструб" and str(x.get("diameter", "")).strip() == diam)
+        it = idx.first(idx.positions("раструб", diameter=diam))
         if it:
             return it
         # 2) по имени + диаметр (часто лежит в "прочее")
-        return _find(lambda x: _name_has(x, "раструб") and (diam in _norm(x.get("name"))))
+        return idx.first(idx.named("раструб", diam))
     return None
 
 
-def pick_udlinenie_sections(diam: str, meters: int):
+def pick_udlinenie_sections(diam: str, meters: int, cat: Optional["CatalogSnapshot"] = None):
     if not meters:
         return None, 0
     # Секции 1 м: category=='секция', type=='VB', diameter==diam
-    it = _find(lambda x: _norm(x.get("category")) == "секция" and _norm(x.get("type")) == "vb" and str(x.get("diameter", "")).strip() == diam)
+    idx = (cat or catalog).index
+    it = idx.first(idx.positions("секция", type="vb", diameter=diam))
     if it:
         return it, int(meters)
     # fallback по имени
-    it = _find(lambda x: _name_has(x, "секция") and ("vb" in _norm(x.get("type")) or " vb" in _norm(x.get("name"))) and diam in _norm(x.get("name")))
+    it = None
+    for pos in idx.named("секция", diam):
+        cand = idx.items[pos]
+        if "vb" in cand.type or " vb" in cand.name_lower:
+            it = cand
+            break
     return it, int(meters) if it else (None, 0)
 
 
-def pick_hermetic(membrana: bool, lenta: bool):
+def pick_hermetic(membrana: bool, lenta: bool, cat: Optional["CatalogSnapshot"] = None):
+    idx = (cat or catalog).index
     out = []
     if membrana:
-        it = _find(lambda x: _norm(x.get("category")) == "мембрана" or "мембран" in _norm(x.get("name")))
+        it = idx.first(idx.positions("мембрана"), idx.named("мембран"))
         if it:
             out.append(it)
     if lenta:
-        it = _find(lambda x: "лента" in _norm(x.get("name")))  # иногда категория другая
+        it = idx.first(idx.named("лента"))  # иногда категория другая
         if it:
             out.append(it)
     return out
 
 
-def pick_avtomat(target_amps: float):
-    """Выбираем автомат по номиналу тока: поддерживаются одиночные значения и диапазоны (например, 1.0-1.6A).
-    Парсим ток из имени (форматы: "3 A", "3A", "2,4 A", т.п.).
+_AMPS_RANGE_RE = re.compile(r"(\d+(?:[\.,]\d+)?)\s*[-–—]\s*(\d+(?:[\.,]\d+)?)(?:\s*A|A)?", re.IGNORECASE)
+_AMPS_SINGLE_RE = re.compile(r"(\d+(?:[\.,]\d+)?)\s*A", re.IGNORECASE)
+
+
+class BreakerTable:
+    """Автоматы защиты, разобранные один раз при загрузке каталога.
+
+    Диапазоны ("1.0-1.6А") и одиночные номиналы ("3 A") лежат в отсортированных
+    списках; подбор — bisect вместо regex по всему каталогу на каждый запрос.
     """
-    candidates_exact = []   # (val, item)
-    candidates_upper = []   # (upper_bound, item) for ranges and singles used as fallback
 
-    for x in items:
-        if not _name_has(x, "автомат"):
-            continue
-        name = x.get("name", "")
-        # 1) Диапазон, например: "1.0-1.6А" (пробелы и разные дефисы допустимы)
-        m_range = re.search(r"(\d+(?:[\.,]\d+)?)\s*[-–—]\s*(\d+(?:[\.,]\d+)?)(?:\s*A|A)?", name, flags=re.IGNORECASE)
-        if m_range:
-            try:
+    def __init__(self, items: List[CatalogItem]):
+        ranges = []   # (lo, hi, pos, item)
+        singles = []  # (val, pos, item)
+        uppers = []   # (upper_bound, pos, item) — для «минимального большего»
+        for pos, x in enumerate(items):
+            if not _name_has(x, "автомат"):
+                continue
+            name = x.name
+            # 1) Диапазон, например: "1.0-1.6А" (пробелы и разные дефисы допустимы)
+            m_range = _AMPS_RANGE_RE.search(name)
+            if m_range:
                 v1 = float(m_range.group(1).replace(',', '.'))
                 v2 = float(m_range.group(2).replace(',', '.'))
                 lo, hi = (v1, v2) if v1 <= v2 else (v2, v1)
-            except Exception:
-                lo = hi = None
-            if lo is not None and hi is not None:
-                # если искомый ток внутри диапазона — это идеальное совпадение
-                if lo - 1e-9 <= target_amps <= hi + 1e-9:
-                    return x
-                # иначе используем верхнюю границу как кандидат для "минимального большего"
-                candidates_upper.append((hi, x))
+                ranges.append((lo, hi, pos, x))
+                uppers.append((hi, pos, x))
                 continue
-        # 2) Одиночное значение: "3 A" или "3A"
-        m_single = re.search(r"(\d+(?:[\.,]\d+)?)\s*A", name, flags=re.IGNORECASE) or \
-                   re.search(r"(\d+(?:[\.,]\d+)?)A", name, flags=re.IGNORECASE)
-        if m_single:
-            try:
+            # 2) Одиночное значение: "3 A" или "3A"
+            m_single = _AMPS_SINGLE_RE.search(name)
+            if m_single:
                 val = float(m_single.group(1).replace(',', '.'))
-            except Exception:
-                continue
-            # сначала попытаемся найти точное совпадение
-            candidates_exact.append((val, x))
-            candidates_upper.append((val, x))
+                singles.append((val, pos, x))
+                uppers.append((val, pos, x))
+
+        self._ranges = sorted(ranges, key=lambda t: (t[0], t[2]))
+        self._range_lo = [t[0] for t in self._ranges]
+        self._singles = sorted(singles, key=lambda t: (t[0], t[1]))
+        self._single_val = [t[0] for t in self._singles]
+        self._uppers = sorted(uppers, key=lambda t: (t[0], t[1]))
+        self._upper_val = [t[0] for t in self._uppers]
+        self._memo: Dict[float, Optional[CatalogItem]] = {}
+
+    def pick(self, target_amps: float) -> Optional[CatalogItem]:
+        if target_amps in self._memo:
+            return self._memo[target_amps]
+        it = self._lookup(target_amps)
+        if len(self._memo) < 256:
+            self._memo[target_amps] = it
+        return it
 
-    # точное совпадение среди одиночных
-    for val, x in candidates_exact:
-        if abs(val - target_amps) < 1e-6:
-            return x
+    def _lookup(self, target_amps: float) -> Optional[CatalogItem]:
+        # 1) диапазон, содержащий ток, — идеальное совпадение (первый по порядку каталога)
+        i = bisect_right(self._range_lo, target_amps + 1e-9)
+        hits = [(pos, x) for lo, hi, pos, x in self._ranges[:i] if target_amps <= hi + 1e-9]
+        if hits:
+            return min(hits, key=lambda t: t[0])[1]
 
-    # минимальный больший среди всех верхних границ (и одиночных значений)
-    greater = [(val, x) for val, x in candidates_upper if val >= target_amps - 1e-9]
-    if greater:
-        val, x = sorted(greater, key=lambda t: t[0])[0]
-        return x
+        # 2) точное совпадение среди одиночных
+        lo_i = bisect_left(self._single_val, target_amps - 1e-6)
+        hi_i = bisect_right(self._single_val, target_amps + 1e-6)
+        exact = [(pos, x) for val, pos, x in self._singles[lo_i:hi_i] if abs(val - target_amps) < 1e-6]
+        if exact:
+            return min(exact, key=lambda t: t[0])[1]
 
-    return None
+        # 3) минимальный больший среди всех верхних границ (и одиночных значений)
+        j = bisect_left(self._upper_val, target_amps - 1e-9)
+        if j < len(self._uppers):
+            return self._uppers[j][2]
+        return None
+
+
+
+# === Приводы ===
+
+# Белый список (из номенклатуры) — идёт первым, в этом порядке
+DRIVE_WHITELIST = ("7547", "29299", "3557", "21370", "1191", "84015", "84935", "84016", "84934")
+DRIVE_REMINDER = "Не забудьте добавить привод!"
+
+
+def _is_true_drive(x: CatalogItem) -> bool:
+    nm = x.name_lower
+    # ключевые слова для приводов
+    is_drive_kw = ("электропривод" in nm) or ("привод" in x.category) or ("bvm" in nm)
+    if not is_drive_kw:
+        return False
+    # исключаем явные не-приводы
+    bad = ("секция" in nm) or ("vbv" in nm) or ("vba" in nm) or ("vbr" in nm) or ("клапан" in nm)
+    return not bad
+
+
+# Сколько приводов предлагать к клапану (в ответе и в КП)
+DRIVES_MAX = 50
+
+
+def find_drives(items: List[CatalogItem], by_art: Dict[str, CatalogItem], max_items: int = DRIVES_MAX) -> List[CatalogItem]:
+    """Приводы для подсказки пользователю; считается один раз на снимок каталога.
+    1) Сначала берём артикулы из белого списка (если есть в каталоге);
+    2) Затем добавляем найденные по строгому фильтру ("электропривод"|категория "привод"),
+       исключая любые секции/шахты/клапаны.
+    """
+    picked = [by_art[art] for art in DRIVE_WHITELIST if art in by_art]
+    seen = {x.article for x in picked}
+    for x in items:
+        if len(picked) >= max_items:
+            break
+        if x.article and x.article not in seen and _is_true_drive(x):
+            picked.append(x)
+            seen.add(x.article)
+    return picked[:max_items]
+
+
+# === Снимок каталога ===
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога вместе со всеми производными индексами.
+
+    Запрос берёт ссылку на текущий снимок один раз и работает с ней до конца;
+    перезагрузка собирает новый снимок целиком и подменяет глобальную ссылку.
+    """
+
+    __slots__ = ("path", "version", "generation", "loaded_at", "source",
+                 "items", "by_art", "prices", "code_mapping", "index", "breakers", "drives", "selections")
+
+    def __init__(self, path: str, version: tuple, generation: int,
+                 raw_items: List[Dict[str, Any]], code_mapping: Dict[str, str], source: str = "json"):
+        self.path = path
+        self.version = version
+        self.generation = generation
+        self.loaded_at = time.time()
+        self.source = source
+        self.items = items = [CatalogItem.from_dict(raw) for raw in raw_items]
+        self.code_mapping = code_mapping
+        # Индексы
+        by_art: Dict[str, CatalogItem] = {}
+        for it in items:
+            if it.article:
+                by_art[it.article] = it
+        self.by_art = by_art
+        # Цены разобраны один раз при загрузке: артикул → число
+        self.prices: Dict[str, float] = {art: it.price for art, it in by_art.items()}
+        self.index = CatalogIndex(items)
+        self.breakers = BreakerTable(items)
+        self.drives = tuple(find_drives(items, by_art))
+        # Таблица подбора по всему пространству конфигураций — precompute_selections()
+        self.selections: Optional["SelectionTable"] = None
+
+    @classmethod
+    def load(cls, path: str, generation: int = 1) -> "CatalogSnapshot":
+        st = os.stat(path)
+        # бинарный снимок рядом с JSON, если он собран из этого же файла; иначе сам JSON
+        raw, source = catalog_snapshot.load_catalog(path)
+
+        if isinstance(raw, dict):
+            code_mapping: Dict[str, str] = raw.get("_code_mapping", {})
+            items: List[Dict[str, Any]] = raw.get("items")
+            if not items:
+                # fallback: если данные пришли «плоским» массивом внутри словаря
+                items = [v for v in raw.values() if isinstance(v, dict)]
+        else:
+            # fallback: если это список словарей без служебного блока
+            items = raw
+            code_mapping = {}
+        return cls(path, (st.st_mtime_ns, st.st_size), generation, items, code_mapping, source)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "generation": self.generation,
+            "loaded_at": self.loaded_at,
+            "source": self.source,
+            "items": len(self.items),
+            "code_mapping": len(self.code_mapping),
+            "selections": len(self.selections.entries) if self.selections is not None else None,
+        }
 
 
-def pick_kapleu(diam: str):
+catalog = CatalogSnapshot.load(CATALOG_PATH)
+_catalog_lock = threading.Lock()
+_catalog_watcher: Optional[threading.Thread] = None
+
+
+def reload_catalog(force: bool = False) -> bool:
+    """Перечитывает каталог, если файл изменился (или force), и атомарно подменяет снимок.
+
+    Индексы строятся до подмены, поэтому запросы никогда не видят «полусобранный» каталог.
+    Ошибки чтения пробрасываются, текущий снимок при этом остаётся в работе.
+    """
+    global catalog
+    with _catalog_lock:
+        st = os.stat(CATALOG_PATH)
+        if not force and (st.st_mtime_ns, st.st_size) == catalog.version:
+            return False
+        fresh = CatalogSnapshot.load(CATALOG_PATH, generation=catalog.generation + 1)
+        if catalog.selections is not None:
+            precompute_selections(fresh)
+        catalog = fresh
+        selection_cache.clear()
+    return True
+
+
+def start_catalog_watcher(interval: float = 5.0) -> threading.Thread:
+    """Фоновая проверка mtime каталога; запускается один раз на процесс (после fork)."""
+    global _catalog_watcher
+    if _catalog_watcher is not None and _catalog_watcher.is_alive():
+        return _catalog_watcher
+
+    def _watch():
+        while True:
+            time.sleep(interval)
+            try:
+                if reload_catalog():
+                    app.logger.info("Каталог перезагружен: %s", catalog.info())
+            except Exception as exc:
+                app.logger.warning("Не удалось перезагрузить каталог: %s", exc)
+
+    _catalog_watcher = threading.Thread(target=_watch, name="catalog-watcher", daemon=True)
+    _catalog_watcher.start()
+    return _catalog_watcher
+
+
+def pick_avtomat(target_amps: float, cat: Optional["CatalogSnapshot"] = None):
+    """Выбираем автомат по номиналу тока: поддерживаются одиночные значения и диапазоны (например, 1.0-1.6A).
+    Номиналы разобраны заранее в BreakerTable снимка (форматы: "3 A", "3A", "2,4 A", т.п.).
+    """
+    return (cat or catalog).breakers.pick(target_amps)
+
+
+def pick_kapleu(diam: str, cat: Optional["CatalogSnapshot"] = None):
     # Универсальный подбор
-    return _find(lambda x: _name_has(x, "каплеулав"))
+    idx = (cat or catalog).index
+    return idx.first(idx.named("каплеулав"))
 
 
-def pick_korona():
-    return _find(lambda x: _name_has(x, "корона"))
+def pick_korona(cat: Optional["CatalogSnapshot"] = None):
+    idx = (cat or catalog).index
+    return idx.first(idx.named("корона"))
 
 
 # === База справочника компаний ===
@@ -283,12 +577,137 @@ def _normalize_text(value: Optional[str]) -> str:
 
 
 def _connect_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(PIFAGOR_DB)
+    """Соединение только для чтения с прагмами под чтение; функции регистрируются здесь один раз."""
+    conn = sqlite3.connect(f"file:{PIFAGOR_DB}?mode=ro", uri=True, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
-    conn.create_function("normtxt", 1, _normalize_text)
+    conn.create_function("normtxt", 1, _normalize_text, deterministic=True)
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute("PRAGMA mmap_size = 268435456")
+    conn.execute("PRAGMA cache_size = -16384")
+    conn.execute("PRAGMA temp_store = MEMORY")
     return conn
 
 
+class DbPool:
+    """Пул соединений к pifagor.db: по одному соединению на поток, переживающему запросы.
+
+    Подготовленные выражения переиспользуются через кэш выражений sqlite3 (cached_statements).
+    После fork (gunicorn) унаследованные соединения не используются — пул пересоздаётся.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._conns: List[sqlite3.Connection] = []
+        self.opened = 0
+        self.acquired = 0
+        self.discarded = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.generation = 0
+
+    def _reset_after_fork(self) -> None:
+        self._local = threading.local()
+        self._conns = []
+        self._pid = os.getpid()
+
+    def _acquire(self) -> sqlite3.Connection:
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._reset_after_fork()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+                self.opened += 1
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        self._local.conn = None
+        self._local.schema = None
+        self._local.data_version = None
+        with self._lock:
+            if conn in self._conns:
+                self._conns.remove(conn)
+            self.discarded += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        started = time.perf_counter()
+        try:
+            yield conn
+        except sqlite3.Error:
+            # соединение после ошибки не переиспользуем: следующее откроется заново
+            with self._lock:
+                self.errors += 1
+            self._discard(conn)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.acquired += 1
+                self.busy_seconds += elapsed
+
+    def data_generation(self, conn: sqlite3.Connection) -> int:
+        """Глобальный счётчик изменений БД для ключей кэшей.
+
+        PRAGMA data_version сравним только в пределах одного соединения, поэтому каждое
+        соединение помнит своё последнее значение и при его смене (или при открытии) сдвигает
+        общий счётчик — кэши, посчитанные до записи, перестают совпадать по ключу.
+        """
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if getattr(self._local, "data_version", None) != version:
+            self._local.data_version = version
+            with self._lock:
+                self.generation += 1
+        return self.generation
+
+    def has_table(self, conn: sqlite3.Connection, name: str) -> bool:
+        """Есть ли таблица в схеме; список таблиц кэшируется на соединение до смены schema_version."""
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        cached = getattr(self._local, "schema", None)
+        if cached is None or cached[0] != version:
+            tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            cached = (version, tables)
+            self._local.schema = cached
+        return name in cached[1]
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open": len(self._conns),
+                "opened": self.opened,
+                "acquired": self.acquired,
+                "reused": max(self.acquired - self.opened, 0),
+                "discarded": self.discarded,
+                "errors": self.errors,
+                "busy_seconds": round(self.busy_seconds, 6),
+            }
+
+
+db_pool = DbPool(_connect_db)
+
+
 def _parse_production_type(raw: Optional[str]) -> Dict[str, Any]:
     if not raw:
         return {}
@@ -317,80 +736,126 @@ def _company_row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
     }
 
 
-# New helper for listing available drives
-def list_available_drives(max_items: int = 50):
-    """Возвращает список приводов для подсказки пользователю.
-    1) Сначала берём артикулы из белого списка (если есть в каталоге);
-    2) Затем добавляем найденные по строгому фильтру ("электропривод"|категория "привод"),
-       исключая любые секции/шахты/клапаны.
-    """
-    # Белый список (из номенклатуры):
-    whitelist = {
-        "7547", "29299", "3557", "21370", "1191",
-        "84015", "84935", "84016", "84934",
-    }
-
-    picked = []
-    seen = set()
-
-    # 1) по whitelists — в фиксированном порядке
-    for art in [
-        "7547", "29299", "3557", "21370", "1191",
-        "84015", "84935", "84016", "84934",
-    ]:
-        it = by_art.get(art)
-        if it and art not in seen:
-            picked.append(it)
-            seen.add(art)
-        if len(picked) >= max_items:
-            return picked
-
-    # 2) строгий фильтр по каталогу
-    def is_true_drive(x: Dict[str, Any]) -> bool:
-        nm = _norm(x.get("name"))
-        cat = _norm(x.get("category"))
-        # ключевые слова для приводов
-        is_drive_kw = ("электропривод" in nm) or ("привод" in cat) or ("bvm" in nm)
-        if not is_drive_kw:
-            return False
-        # исключаем явные не-приводы
-        bad = ("секция" in nm) or ("vbv" in nm) or ("vba" in nm) or ("vbr" in nm) or ("клапан" in nm)
-        return not bad
-
-    for x in items:
-        art = str(x.get("artikul") or x.get("article") or "").strip()
-        if art and art not in seen and is_true_drive(x):
-            picked.append(x)
-            seen.add(art)
-        if len(picked) >= max_items:
-            break
-
-    return picked[:max_items]
+def _drive_rows(cat: "CatalogSnapshot") -> List[Dict[str, Any]]:
+    # cat.drives уже ограничен DRIVES_MAX при сборке снимка (find_drives)
+    return [{"article": d.article, "name": d.name} for d in cat.drives]
 
 # Helper for VBR подмешивание
-def pick_vbr_podmesh(diam: str):
+def pick_vbr_podmesh(diam: str, cat: Optional["CatalogSnapshot"] = None):
     # Ищем секцию подмешивания по имени + диаметр
-    return _find(lambda x: _name_has(x, "подмешив") and (diam in _norm(x.get("name"))))
+    idx = (cat or catalog).index
+    return idx.first(idx.named("подмешив", diam))
 
 
 # --- New helpers and refactored logic for export/select ---
 
-def _price_of(art: str) -> float:
-    it = by_art.get(str(art).strip())
-    if not it:
-        return 0.0
-    for key in ("price", "цена", "cost"):
-        v = it.get(key)
-        if v is None:
-            continue
-        try:
-            return float(str(v).replace(' ', '').replace(',', '.'))
-        except Exception:
-            continue
-    return 0.0
+def _price_of(art: str, cat: Optional["CatalogSnapshot"] = None) -> float:
+    return (cat or catalog).prices.get(str(art).strip(), 0.0)
+
+
+# === Цены КП ===
+
+KOPECK = Decimal("0.01")
+
+
+def _vat_rate(raw: str) -> Decimal:
+    """Ставка НДС из CHIMENEY_VAT_RATE; неверное значение — ошибка при запуске, а не «NaN» в КП."""
+    try:
+        rate = Decimal(raw)
+    except ArithmeticError:
+        rate = Decimal("NaN")
+    if not rate.is_finite() or not 0 <= rate < 100:
+        raise ValueError(f"CHIMENEY_VAT_RATE: ожидается ставка в процентах от 0 до 100, получено {raw!r}")
+    return rate
+
+
+VAT_RATE = _vat_rate(os.environ.get("CHIMENEY_VAT_RATE", "20"))  # %, цены каталога — с НДС
+PRICE_ROUNDING = {"kop": KOPECK, "rub": Decimal(1)}
+
 
+class PriceRules:
+    """Правила расчёта КП поверх таблицы цен.
 
-def _select_components(payload_in: Dict[str, Any]):
+    multiplier — множитель количеств (qty_multiplier), discounts — скидки в процентах
+    по группам: ключ — категория каталога ("привод", "секция", ...) или "*" для
+    остальных позиций; rounding — шаг округления цены за штуку ("kop" или "rub").
+    Цены каталога уже с НДС: НДС выделяется из итога и округляется до копеек.
+    """
+
+    __slots__ = ("multiplier", "discounts", "rounding")
+
+    def __init__(self, multiplier: int = 1, discounts: Optional[Dict[str, Decimal]] = None, rounding: str = "kop"):
+        self.multiplier = multiplier
+        self.discounts = discounts or {}
+        self.rounding = rounding
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any], multiplier: Optional[int] = None) -> "PriceRules":
+        """Правила из тела запроса; ValueError — если скидки, округление или qty_multiplier заданы неверно."""
+        raw = payload.get("discounts") or {}
+        if not isinstance(raw, dict):
+            raise ValueError("discounts: ожидается объект {группа: процент}")
+        discounts = {}
+        for group, pct in raw.items():
+            try:
+                value = Decimal(str(pct))
+            except ArithmeticError:
+                raise ValueError(f"discounts[{group}]: ожидается число") from None
+            if not value.is_finite() or not 0 <= value <= 100:
+                raise ValueError(f"discounts[{group}]: скидка должна быть от 0 до 100%")
+            discounts[_norm(group) or "*"] = value
+        rounding = str(payload.get("rounding") or "kop")
+        if rounding not in PRICE_ROUNDING:
+            raise ValueError(f"rounding: допустимо {', '.join(PRICE_ROUNDING)}")
+        if multiplier is None:
+            multiplier = _qty_multiplier(payload)
+        return cls(multiplier, discounts, rounding)
+
+    def discount(self, group: str) -> Decimal:
+        pct = self.discounts.get(group)
+        return self.discounts.get("*", Decimal(0)) if pct is None else pct
+
+
+def price_bom(rows: List[Dict[str, Any]], rules: Optional[PriceRules] = None,
+              cat: Optional["CatalogSnapshot"] = None) -> Dict[str, Any]:
+    """Оценивает спецификацию целиком по одному снимку каталога.
+
+    Строка: цена за штуку после скидки группы, округлённая по правилу, количество
+    с учётом множителя и сумма (до копеек). Итог — сумма строк, НДС выделяется из итога.
+    """
+    cat = cat or catalog
+    rules = rules or PriceRules()
+    step = PRICE_ROUNDING[rules.rounding]
+    lines: List[Dict[str, Any]] = []
+    total = Decimal(0)
+    for row in rows:
+        art = str(row.get("article") or "").strip()
+        it = cat.by_art.get(art)
+        base = Decimal(repr(it.price)) if it else Decimal(0)
+        pct = rules.discount(it.category if it else "")
+        price = (base * (100 - pct) / 100).quantize(step, ROUND_HALF_UP)
+        qty = Decimal(str(row.get("quantity") or 0)) * rules.multiplier
+        summa = (price * qty).quantize(KOPECK, ROUND_HALF_UP)
+        total += summa
+        lines.append({
+            "article": art,
+            "name": row.get("name", ""),
+            "base_price": float(base),
+            "discount": float(pct),
+            "price": float(price),
+            "quantity": float(qty),
+            "sum": float(summa),
+        })
+    vat = (total * VAT_RATE / (100 + VAT_RATE)).quantize(KOPECK, ROUND_HALF_UP)
+    return {"lines": lines, "total": float(total), "vat": float(vat), "vat_rate": float(VAT_RATE)}
+
+
+def _apply_backend_rules(payload_in: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str], Optional[List[str]]]:
+    """Приводит payload к допустимым параметрам.
+
+    Возвращает (payload, messages, error): при нехватке обязательных параметров
+    error — готовый список сообщений для ответа без подбора.
+    """
     payload = dict(payload_in or {})
     messages: List[str] = []
 
@@ -425,12 +890,12 @@ def _select_components(payload_in: Dict[str, Any]):
     required_power = {"560": "370", "710": "370", "800": "750"}.get(diam)
 
     if not tip or not diam or not klapan:
-        return [], ["Не хватает обязательных параметров"]
+        return payload, [], ["Не хватает обязательных параметров"]
 
     needs_motor = (tip in ("VBV", "VBA", "VBR")) and (klapan in ("pov", "grav"))
     if needs_motor:
         if not payload.get("tip_motora"):
-            return [], ["Не хватает параметров: укажите тип мотора (6E/6D)"]
+            return payload, [], ["Не хватает параметров: укажите тип мотора (6E/6D)"]
         if required_power:
             cur_power = str(payload.get("moshchnost", "")).strip()
             if not cur_power:
@@ -440,6 +905,271 @@ def _select_components(payload_in: Dict[str, Any]):
                 payload["moshchnost"] = required_power
                 messages.append(f"Мощность скорректирована до {required_power} Вт для D{diam}")
 
+    return payload, messages, None
+
+
+# Поля ключа _selection_key по порядку — для отчёта о покрытии
+SELECTION_KEY_FIELDS = (
+    "tip", "diametr", "tip_klapana", "raspolozhenie", "grav_variant", "tip_motora", "moshchnost",
+    "verhnyaya_chast", "membrana", "lenta", "avtomat", "udlinenie_m", "kapleulavlivatel", "korona",
+    "montazhny_komplekt",
+)
+
+
+def _selection_key(payload: Dict[str, Any]) -> Optional[tuple]:
+    """Канонический ключ уже скорректированного payload для кэша и таблицы подбора.
+
+    В ключ попадают только поля, влияющие на результат, в том виде, в каком их
+    читает _select_normalized. None — payload не кэшируется (нехешируемые значения).
+    """
+    tip = payload.get("tip")
+    klapan = payload.get("tip_klapana")
+    motor = payload.get("tip_motora")
+    active = klapan in ("pov", "grav")
+    needs_motor = (tip in ("VBV", "VBA", "VBR")) and active
+    g = payload.get("germetizatsiya") or {}
+    key = (
+        tip,
+        str(payload.get("diametr", "")).strip(),
+        klapan,
+        payload.get("raspolozhenie") if klapan == "pov" else None,
+        payload.get("grav_variant") if klapan == "grav" else None,
+        (bool(motor), _norm(motor)) if active else None,
+        str(payload.get("moshchnost", "")).strip() if active else None,
+        _norm(payload.get("verhnyaya_chast")),
+        bool(g.get("membrana")),
+        bool(g.get("lenta")),
+        bool(payload.get("avtomat")) and needs_motor,
+        int(payload.get("udlinenie_m") or 0),
+        bool(payload.get("kapleulavlivatel")),
+        bool(payload.get("korona")) and klapan != "dvustv",
+        bool(payload.get("montazhny_komplekt")),
+    )
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class LruCache:
+    """LRU-кэш с TTL и счётчиками попаданий (подбор, справочник компаний)."""
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+
+selection_cache = LruCache()
+
+
+# === Таблица подбора ===
+
+# Параметры веб-формы вне question_flow, влияющие на подбор
+SELECTION_EXTRA_PARAMS = {"montazhny_komplekt": [False, True]}
+# Параметры, которые читает и правит _apply_backend_rules; остальные (доп. комплектующие) он не трогает
+SELECTION_CORE_PARAMS = ("tip", "diametr", "tip_klapana", "raspolozhenie", "grav_variant", "tip_motora", "moshchnost")
+# Признак «позиция не найдена» в сообщениях подбора — дыра в каталоге
+_NOT_FOUND = "не найден"
+
+
+def _selection_entry(payload: Dict[str, Any], cat: CatalogSnapshot) -> tuple:
+    """(results, messages, needs_drive, ext_art) для payload с udlinenie_m 0/1.
+
+    ext_art — артикул секции удлинения: её количество подставляется по запросу,
+    поэтому одна запись обслуживает любое число метров.
+    """
+    results, extra, needs_drive = _select_normalized(payload, cat)
+    ext_art = None
+    if payload.get("udlinenie_m"):
+        it, _ = pick_udlinenie_sections(str(payload.get("diametr", "")).strip(), 1, cat)
+        ext_art = it.article if it else None
+    return tuple(results), tuple(extra), needs_drive, ext_art
+
+
+class SelectionTable:
+    """Результаты подбора по всему пространству конфигураций одного снимка каталога.
+
+    Ключ — _selection_key скорректированного payload (удлинение — 0/1 м); конфигурации
+    вне пространства (нестандартные значения) подбираются как раньше, через LRU-кэш.
+    Бэкенд-правила применяются к основным параметрам один раз, доп. комплектующие
+    перебираются поверх уже скорректированных.
+    """
+
+    def __init__(self, cat: CatalogSnapshot):
+        started = time.perf_counter()
+        cores: Dict[tuple, Dict[str, Any]] = {}
+        for raw in config_space.iter_configurations(cat.code_mapping, follow_depends=False, only=SELECTION_CORE_PARAMS):
+            payload, _, error = _apply_backend_rules(raw)
+            if error is None:
+                cores.setdefault(tuple(payload.get(p) for p in SELECTION_CORE_PARAMS), payload)
+        addons = list(config_space.iter_configurations(extensions=(0, 1), follow_depends=False,
+                                                       params=SELECTION_EXTRA_PARAMS, exclude=SELECTION_CORE_PARAMS))
+
+        entries: Dict[tuple, tuple] = {}
+        rows: Dict[tuple, Dict[str, Any]] = {}     # одинаковые строки BOM — один объект
+        texts: Dict[str, str] = {}
+        for core, addon in itertools.product(cores.values(), addons):
+            payload = dict(core, **addon)
+            key = _selection_key(payload)
+            if key is None or key in entries:
+                continue
+            results, extra, needs_drive, ext_art = _selection_entry(payload, cat)
+            results = tuple(rows.setdefault((r["article"], r["name"], r["quantity"]), r) for r in results)
+            extra = tuple(texts.setdefault(m, m) for m in extra)
+            entries[key] = (results, extra, needs_drive, ext_art)
+        self.entries = entries
+        self.generation = cat.generation
+        self.code_mapping = cat.code_mapping
+        self.build_seconds = time.perf_counter() - started
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        return self.entries.get(key)
+
+    @staticmethod
+    def _config(key: tuple) -> Dict[str, Any]:
+        # в виде payload: без пустых полей, мотор — строкой
+        config = {}
+        for field, value in zip(SELECTION_KEY_FIELDS, key):
+            if field == "tip_motora" and value:
+                value = value[1]
+            if value not in (None, "", False, 0):
+                config[field] = value
+        return config
+
+    def coverage(self, examples: int = 5) -> Dict[str, Any]:
+        """Конфигурации, на которых каталог не находит позицию, сгруппированные по сообщению.
+
+        Кроме сообщений «не найден» — конфигурации без основной секции: ключа нет
+        в _code_mapping (у VBP свои запасные варианты, для него только сообщения).
+        Примеры — самые короткие конфигурации (меньше всего заданных полей).
+        """
+        holes: Dict[str, Dict[str, Any]] = {}
+        total = 0
+        for key, (results, extra, _, _) in sorted(self.entries.items(), key=lambda kv: sum(map(bool, kv[0]))):
+            config = self._config(key)
+            reasons = [m for m in extra if _NOT_FOUND in m]
+            code_key = build_code_key(config)
+            if config.get("tip") != "VBP" and not self.code_mapping.get(code_key):
+                reasons.append(f"Основная секция не найдена в _code_mapping: {code_key or '—'}")
+            if not results:
+                reasons = reasons or ["Ничего не найдено"]
+            if not reasons:
+                continue
+            total += 1
+            for reason in reasons:
+                group = holes.setdefault(reason, {"message": reason, "count": 0, "examples": []})
+                group["count"] += 1
+                if len(group["examples"]) < examples:
+                    group["examples"].append(config)
+        return {
+            "generation": self.generation,
+            "configurations": len(self.entries),
+            "holes": total,
+            "by_message": sorted(holes.values(), key=lambda g: -g["count"]),
+        }
+
+
+def precompute_selections(cat: Optional[CatalogSnapshot] = None) -> SelectionTable:
+    """Строит таблицу подбора для снимка (один раз на версию каталога)."""
+    cat = cat or catalog
+    table = SelectionTable(cat)
+    cat.selections = table
+    report = table.coverage(examples=0)
+    app.logger.info("Таблица подбора: %d конфигураций за %.1f с, без позиции в каталоге: %d",
+                    report["configurations"], table.build_seconds, report["holes"])
+    return table
+
+
+def _select_components(payload_in: Dict[str, Any], cat: Optional[CatalogSnapshot] = None):
+    """Подбор по payload: (results, messages, drives).
+
+    drives — приводы, которые нужно предложить к выбранному клапану ([] если не нужны).
+    Готовый ответ берётся из таблицы подбора снимка, иначе из LRU-кэша или считается.
+    """
+    payload, messages, error = _apply_backend_rules(payload_in)
+    if error is not None:
+        return [], error, []
+
+    cat = cat or catalog
+    sampled = metrics.is_sampled()
+    started = time.perf_counter() if sampled else 0.0
+    meters = int(payload.get("udlinenie_m") or 0)
+    payload["udlinenie_m"] = 1 if meters > 0 else 0
+    key = _selection_key(payload)
+    entry = None
+    source = "table"
+    if key is not None and cat.selections is not None:
+        with CATALOG_LOOKUP_SECONDS.time(op="table"):
+            entry = cat.selections.get(key)
+    if entry is None:
+        source = "cache"
+        cache_key = (cat.generation,) + key if key is not None else None
+        if cache_key is not None:
+            with CATALOG_LOOKUP_SECONDS.time(op="cache"):
+                entry = selection_cache.get(cache_key)
+        if entry is None:
+            source = "compute"
+            with CATALOG_LOOKUP_SECONDS.time(op="compute"):
+                entry = _selection_entry(payload, cat)
+            if cache_key is not None:
+                selection_cache.put(cache_key, entry)
+    SELECT_TOTAL.inc(source=source)
+    if sampled:
+        SELECT_SECONDS.observe(time.perf_counter() - started, source=source)
+
+    results, extra, needs_drive, ext_art = entry
+    rows = [dict(r) for r in results]
+    if ext_art is not None and meters > 1:
+        for row in rows:
+            if row["article"] == ext_art:
+                row["quantity"] = meters
+    drives = _drive_rows(cat) if needs_drive else []
+    return rows, messages + list(extra), drives
+
+
+def _select_normalized(payload: Dict[str, Any], cat: CatalogSnapshot):
+    """Подбор по скорректированному payload; чистая функция payload и снимка каталога."""
+    messages: List[str] = []
+    by_art = cat.by_art
+    code_mapping = cat.code_mapping
+    idx = cat.index
+
+    tip = payload.get("tip")
+    diam = str(payload.get("diametr", "")).strip()
+    klapan = payload.get("tip_klapana")
+
     key = build_code_key(payload)
     if not key:
         t_upper = str(payload.get("tip", "")).upper()
@@ -466,27 +1196,30 @@ def _select_components(payload_in: Dict[str, Any]):
     result: Dict[str, Dict[str, Any]] = {}
     if key and code_mapping.get(key):
         art = code_mapping[key]
-        base = by_art.get(art, {"artikul": art, "name": f"Комплект шахты ({key})"})
-        result[art] = {"article": art, "name": base.get("name", ""), "quantity": 1}
+        base = by_art.get(art)
+        name = base.name if base else f"Комплект шахты ({key})"
+        result[art] = {"article": art, "name": name, "quantity": 1}
 
     tip_upper = str(tip).upper()
     if not result and tip_upper == "VBP":
         wildcard_key = f"VBP_{diam}_*_*_pov_niz"
         art = code_mapping.get(wildcard_key)
         if art:
-            base = by_art.get(art, {"artikul": art, "name": f"Комплект шахты VBP-{diam} (поворотный, низ)"})
-            result[art] = {"article": art, "name": base.get("name", ""), "quantity": 1}
+            base = by_art.get(art)
+            name = base.name if base else f"Комплект шахты VBP-{diam} (поворотный, низ)"
+            result[art] = {"article": art, "name": name, "quantity": 1}
         else:
-            it = _find(lambda x: _name_has(x, "vbp", diam, "поворот", "низ"))
+            it = idx.first(idx.named("vbp", diam, "поворот", "низ"))
             if it:
-                art = str(it.get("artikul") or it.get("article"))
-                result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+                art = it.article
+                result[art] = {"article": art, "name": it.name, "quantity": 1}
             else:
                 vbp_by_diam = {"560": "89142", "710": "89143", "800": "89153"}
                 art = vbp_by_diam.get(diam)
                 if art:
-                    base = by_art.get(art, {"artikul": art, "name": f"Секция камина VBP-{diam} (2м, поворотный клапан, низ)"})
-                    result[art] = {"article": art, "name": base.get("name", ""), "quantity": 1}
+                    base = by_art.get(art)
+                    name = base.name if base else f"Секция камина VBP-{diam} (2м, поворотный клапан, низ)"
+                    result[art] = {"article": art, "name": name, "quantity": 1}
 
     if not result:
         klapan_label = {"pov": "поворотный", "grav": "гравитационный", "dvustv": "двустворчатый"}.get(klapan, klapan or "—")
@@ -506,35 +1239,35 @@ def _select_components(payload_in: Dict[str, Any]):
         top = "zont"
 
     if top:
-        it = pick_top_part(top, diam)
+        it = pick_top_part(top, diam, cat)
         if it:
-            art = str(it.get("artikul") or it.get("article"))
-            result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+            art = it.article
+            result[art] = {"article": art, "name": it.name, "quantity": 1}
         else:
             if _norm(top) == "rastrub":
                 messages.append(f"Раструб для диаметра D{diam} не найден в каталоге")
 
     if tip_upper == "VBR":
-        it = pick_vbr_podmesh(diam)
+        it = pick_vbr_podmesh(diam, cat)
         if it:
-            art = str(it.get("artikul") or it.get("article"))
-            result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+            art = it.article
+            result[art] = {"article": art, "name": it.name, "quantity": 1}
         else:
             messages.append(f"Секция подмешивания для D{diam} не найдена в каталоге")
 
     g = payload.get("germetizatsiya") or {}
     if bool(g.get("membrana")):
-        it = pick_membrana_by_diam(diam)
+        it = pick_membrana_by_diam(diam, cat)
         if it:
-            art = str(it.get("artikul") or it.get("article"))
-            result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+            art = it.article
+            result[art] = {"article": art, "name": it.name, "quantity": 1}
         else:
             messages.append(f"Мембрана для диаметра D{diam} не найдена в каталоге")
     if bool(g.get("lenta")):
-        it = pick_lenta()
+        it = pick_lenta(cat=cat)
         if it:
-            art = str(it.get("artikul") or it.get("article"))
-            result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+            art = it.article
+            result[art] = {"article": art, "name": it.name, "quantity": 1}
         else:
             messages.append("Лента битумная не найдена в каталоге")
 
@@ -552,288 +1285,660 @@ def _select_components(payload_in: Dict[str, Any]):
         if target is None:
             messages.append("Не удалось определить номинал автомата: неизвестная комбинация тип мотора × мощность")
         else:
-            it = pick_avtomat(target)
+            it = pick_avtomat(target, cat)
             if it:
-                art = str(it.get("artikul") or it.get("article"))
-                result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+                art = it.article
+                result[art] = {"article": art, "name": it.name, "quantity": 1}
             else:
                 messages.append(f"Автомат защиты {target} A не найден в каталоге")
 
     meters = int(payload.get("udlinenie_m") or 0)
     if meters:
-        it, qty = pick_udlinenie_sections(diam, meters)
+        it, qty = pick_udlinenie_sections(diam, meters, cat)
         if it and qty > 0:
-            art = str(it.get("artikul") or it.get("article"))
-            result[art] = {"article": art, "name": it.get("name", ""), "quantity": qty}
+            art = it.article
+            result[art] = {"article": art, "name": it.name, "quantity": qty}
 
     if bool(payload.get("kapleulavlivatel")):
         if tip_upper in ("VBA", "VBP", "VBR"):
             messages.append("Каплеулавливатель не применяется для приточных шахт и будет проигнорирован")
         else:
-            it = pick_kapleu(diam)
+            it = pick_kapleu(diam, cat)
             if it:
-                art = str(it.get("artikul") or it.get("article"))
-                result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+                art = it.article
+                result[art] = {"article": art, "name": it.name, "quantity": 1}
 
     if payload.get("korona") and (payload.get("tip_klapana") != "dvustv"):
-        it = pick_korona()
+        it = pick_korona(cat=cat)
         if it:
-            art = str(it.get("artikul") or it.get("article"))
-            result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+            art = it.article
+            result[art] = {"article": art, "name": it.name, "quantity": 1}
 
     if bool(payload.get("montazhny_komplekt")):
         it = None
         if klapan == "pov":
-            it = by_art.get("89151") or _find(lambda x: _name_has(x, "монтажный", "комплект") and _name_has(x, "vb") and _name_has(x, "поворот"))
+            it = by_art.get("89151") or idx.first(idx.named("монтажный", "комплект", "vb", "поворот"))
         elif klapan == "grav":
-            it = by_art.get("89152") or _find(lambda x: _name_has(x, "монтажный", "комплект") and _name_has(x, "vb") and _name_has(x, "гравита"))
+            it = by_art.get("89152") or idx.first(idx.named("монтажный", "комплект", "vb", "гравита"))
         if it:
-            art = str(it.get("artikul") or it.get("article"))
-            result[art] = {"article": art, "name": it.get("name", ""), "quantity": 1}
+            art = it.article
+            result[art] = {"article": art, "name": it.name, "quantity": 1}
         else:
             messages.append("Монтажный комплект для выбранного типа клапана не найден в каталоге")
 
-    if klapan in ("pov", "dvustv"):
-        drives = list_available_drives()
-        if drives:
-            lines = [f"• {str(d.get('artikul') or d.get('article'))} — {d.get('name','')}" for d in drives]
-            listing = "&lt;br&gt;".join(lines)
-            messages.append(f"Не забудьте добавить привод! Доступные приводы:&lt;br&gt;{listing}")
-        else:
-            messages.append("Не забудьте добавить привод! (в каталоге приводы не найдены)")
+    # Сами приводы — в структурированном списке drives ответа (см. _select_components)
+    needs_drive = klapan in ("pov", "dvustv")
+    if needs_drive:
+        messages.append(DRIVE_REMINDER if cat.drives else f"{DRIVE_REMINDER} (в каталоге приводы не найдены)")
 
     out = list(result.values())
-    return out, messages
+    return out, messages, needs_drive
 
 
 
+def _select_response(results: List[Dict[str, Any]], messages: List[str],
+                     drives: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    if not results:
+        base_reason = "; ".join(messages) if messages else "Основание подбора не найдено в каталоге/маппинге"
+        response = {"results": [], "message": f"Ничего не найдено. {base_reason}"}
+    elif messages:
+        response = {"results": results, "message": "; ".join(messages)}
+    else:
+        response = {"results": results}
+    if drives:
+        response["drives"] = drives
+    return response
+
+
+def _wants_pricing(payload: Dict[str, Any]) -> bool:
+    return bool(payload.get("priced")) or request.args.get("priced") == "1"
+
+
 @app.route("/api/select", methods=["POST"])
 def api_select():
     payload = request.get_json(silent=True) or {}
-    results, messages = _select_components(payload)
-    if not results:
-        base_reason = "; ".join(messages) if messages else "Основание подбора не найдено в каталоге/маппинге"
-        return jsonify({"results": [], "message": f"Ничего не найдено. {base_reason}"})
-    if messages:
-        return jsonify({"results": results, "message": "; ".join(messages)})
-    return jsonify({"results": results})
+    try:
+        rules = PriceRules.from_payload(payload) if _wants_pricing(payload) else None
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    results, messages, drives = _select_components(payload)
+    response = _select_response(results, messages, drives)
+    if rules is not None and results:
+        response["pricing"] = price_bom(results, rules)
+    return jsonify(response)
+
+
+BATCH_MAX_ITEMS = 500
+
+
+def _qty_multiplier(payload: Dict[str, Any]) -> int:
+    """qty_multiplier из payload: без него — 1; ValueError — если это не целое число от 1."""
+    raw = payload.get("qty_multiplier")
+    if raw is None or raw == "":
+        return 1
+    try:
+        value = Decimal(str(raw).strip()) if not isinstance(raw, bool) else Decimal("NaN")
+    except ArithmeticError:
+        value = Decimal("NaN")
+    if not value.is_finite() or value != value.to_integral_value() or value < 1:
+        raise ValueError("qty_multiplier: ожидается целое число не меньше 1")
+    return int(value)
+
+
+def _select_batch(payloads: List[Dict[str, Any]], cat: Optional[CatalogSnapshot] = None) -> Dict[str, Any]:
+    """Подбор для списка шахт: одинаковые конфигурации считаются один раз,
+    спецификация (bom) суммирует количества по артикулам с учётом qty_multiplier."""
+    by_config: Dict[str, Tuple[List[Dict[str, Any]], List[str], List[Dict[str, Any]]]] = {}
+    out_items: List[Dict[str, Any]] = []
+    bom: Dict[str, Dict[str, Any]] = {}
+
+    for i, payload in enumerate(payloads):
+        config = {k: v for k, v in payload.items() if k != "qty_multiplier"}
+        config_key = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+        if config_key not in by_config:
+            by_config[config_key] = _select_components(config, cat=cat)
+        results, messages, drives = by_config[config_key]
+
+        qty = _qty_multiplier(payload)
+        item = _select_response([dict(r) for r in results], messages, [dict(d) for d in drives])
+        item["index"] = i
+        item["qty_multiplier"] = qty
+        out_items.append(item)
+
+        for row in results:
+            art = row["article"]
+            line = bom.get(art)
+            if line is None:
+                line = bom[art] = {"article": art, "name": row.get("name", ""), "quantity": 0}
+            line["quantity"] += (row.get("quantity") or 0) * qty
+
+    return {"items": out_items, "bom": list(bom.values()), "unique_configurations": len(by_config)}
+
+
+@app.route("/api/select/batch", methods=["POST"])
+def api_select_batch():
+    body = request.get_json(silent=True)
+    payloads = body.get("items") if isinstance(body, dict) else body
+    if not isinstance(payloads, list) or not all(isinstance(p, dict) for p in payloads):
+        return jsonify({"error": "Ожидается список конфигураций: {\"items\": [{...}, ...]}"}), 400
+    if len(payloads) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Слишком много конфигураций в одном запросе (максимум {BATCH_MAX_ITEMS})"}), 400
+    for i, payload in enumerate(payloads, start=1):
+        try:
+            _qty_multiplier(payload)
+        except ValueError as exc:
+            return jsonify({"error": f"Конфигурация {i}: {exc}"}), 400
+    options = body if isinstance(body, dict) else {}
+    try:
+        # количества в bom уже умножены на qty_multiplier каждой конфигурации
+        rules = PriceRules.from_payload(options, multiplier=1) if _wants_pricing(options) else None
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    response = _select_batch(payloads)
+    if rules is not None:
+        response["pricing"] = price_bom(response["bom"], rules)
+    return jsonify(response)
+
+
+@app.route("/api/select/cache", methods=["GET"])
+def api_select_cache():
+    table = catalog.selections
+    stats = selection_cache.stats()
+    stats["table"] = None if table is None else {
+        "configurations": len(table.entries),
+        "build_seconds": table.build_seconds,
+    }
+    return jsonify(stats)
+
+
+# === Метрики ===
+
+HTTP_REQUESTS = metrics.REGISTRY.counter(
+    "chimeney_http_requests_total", "HTTP-запросы по маршруту, методу и статусу", ("endpoint", "method", "status"))
+HTTP_SECONDS = metrics.REGISTRY.histogram(
+    "chimeney_http_request_seconds", "Время обработки запроса (сэмплируется)", ("endpoint",))
+SELECT_TOTAL = metrics.REGISTRY.counter(
+    "chimeney_select_total", "Подборы по источнику: table — таблица подбора, cache — LRU, compute — расчёт", ("source",))
+SELECT_SECONDS = metrics.REGISTRY.histogram(
+    "chimeney_select_seconds", "Поиск или расчёт подбора в _select_components (сэмплируется)", ("source",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+CATALOG_LOOKUP_SECONDS = metrics.REGISTRY.histogram(
+    "chimeney_catalog_lookup_seconds",
+    "Поиск готового подбора: table — таблица подбора, cache — LRU, compute — расчёт по индексам каталога"
+    " (сэмплируется)", ("op",),
+    buckets=(0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001, 0.005))
+EXPORT_SECONDS = metrics.REGISTRY.histogram(
+    "chimeney_export_seconds", "Экспорт КП: build — подбор и сборка книги, serialize — запись xlsx", ("endpoint", "stage"))
+EXPORT_BYTES = metrics.REGISTRY.counter("chimeney_export_bytes_total", "Размер отданных xlsx", ("endpoint",))
+DB_QUERY_SECONDS = metrics.REGISTRY.histogram(
+    "chimeney_db_query_seconds", "SQL-запросы справочника компаний (сэмплируется)", ("query",))
+
+_CACHES = {
+    "selection": lambda: selection_cache,
+    "companies_total": lambda: companies_total_cache,
+    "company_details": lambda: company_details_cache,
+    "facets": lambda: facets_cache,
+}
+
+
+def _cache_stat(field: str):
+    return lambda: [({"cache": name}, get().stats()[field]) for name, get in _CACHES.items()]
+
+
+metrics.REGISTRY.callback("chimeney_cache_hits_total", "Попадания в кэши", "counter", _cache_stat("hits"), ("cache",))
+metrics.REGISTRY.callback("chimeney_cache_misses_total", "Промахи кэшей", "counter", _cache_stat("misses"), ("cache",))
+metrics.REGISTRY.callback("chimeney_cache_entries", "Записей в кэшах", "gauge", _cache_stat("size"), ("cache",))
+metrics.REGISTRY.callback("chimeney_db_busy_seconds_total", "Время, проведённое с соединением пула pifagor.db",
+                          "counter", lambda: [({}, db_pool.busy_seconds)])
+metrics.REGISTRY.callback("chimeney_db_connections_opened_total", "Открыто соединений пулом", "counter",
+                          lambda: [({}, db_pool.opened)])
+metrics.REGISTRY.callback("chimeney_db_errors_total", "Ошибки SQLite в пуле", "counter", lambda: [({}, db_pool.errors)])
+metrics.REGISTRY.callback("chimeney_catalog_generation", "Поколение снимка каталога", "gauge",
+                          lambda: [({}, catalog.generation)])
+metrics.REGISTRY.callback("chimeney_selection_table_entries", "Конфигураций в таблице подбора", "gauge",
+                          lambda: [({}, len(catalog.selections.entries) if catalog.selections is not None else 0)])
+metrics.REGISTRY.callback("chimeney_metrics_sample_rate", "Доля сэмплируемых запросов", "gauge",
+                          lambda: [({}, metrics.sample_rate())])
+
+
+@app.before_request
+def _metrics_start() -> None:
+    metrics.start_request()
+    g.metrics_started = time.perf_counter()
+
+
+def _metrics_endpoint() -> str:
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+@app.after_request
+def _metrics_record(response):
+    endpoint = _metrics_endpoint()
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    g.metrics_recorded = True
+    started = g.get("metrics_started")
+    if started is not None and metrics.is_sampled():
+        HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    return response
+
+
+@app.teardown_request
+def _metrics_end(exc) -> None:
+    if exc is not None and not g.get("metrics_recorded"):
+        # исключение проброшено наружу (PROPAGATE_EXCEPTIONS): ответ 500 after_request не видел;
+        # иначе handle_exception уже собрал 500 через finalize_request и запрос учтён
+        HTTP_REQUESTS.inc(endpoint=_metrics_endpoint(), method=request.method, status=500)
+    metrics.end_request()
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# === Профилирование медленных запросов ===
+
+# Выключено, пока не задан CHIMENEY_PROFILE_SLOW_MS (см. profiling.py)
+slow_profiler = profiling.SlowRequestProfiler.from_env(app.wsgi_app, default_dir=os.path.join(BASE_DIR, "profiles"))
+if slow_profiler.enabled:
+    app.wsgi_app = slow_profiler
+
+
+# === Администрирование ===
+
+def _admin_allowed() -> bool:
+    # Если задан CHIMENEY_ADMIN_TOKEN — админ-эндпоинты требуют заголовок X-Admin-Token
+    token = os.environ.get("CHIMENEY_ADMIN_TOKEN")
+    return not token or request.headers.get("X-Admin-Token") == token
+
+
+@app.route("/api/admin/catalog", methods=["GET"])
+def api_admin_catalog():
+    if not _admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify(catalog.info())
+
+
+@app.route("/api/admin/db-pool", methods=["GET"])
+def api_admin_db_pool():
+    if not _admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify(db_pool.stats())
+
+
+@app.route("/api/admin/selection/coverage", methods=["GET"])
+def api_admin_selection_coverage():
+    """Отчёт о покрытии: конфигурации опроса, для которых в каталоге нет позиции."""
+    if not _admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    cat = catalog
+    table = cat.selections if cat.selections is not None else precompute_selections(cat)
+    try:
+        examples = max(0, min(int(request.args.get("examples", 5)), 100))
+    except ValueError:
+        examples = 5
+    return jsonify(table.coverage(examples=examples))
+
+
+@app.route("/api/admin/profiles", methods=["GET"])
+def api_admin_profiles():
+    """Профили медленных запросов, новые первыми, и заполненность кольцевого буфера."""
+    if not _admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    info = slow_profiler.info()
+    info["items"] = slow_profiler.store.list()
+    return jsonify(info)
+
+
+@app.route("/api/admin/profiles/<profile_id>", methods=["GET"])
+def api_admin_profile(profile_id: str):
+    """Сводка и запрос (для воспроизведения); ?format=prof — файл pstats, ?format=text — топ функций."""
+    if not _admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    store = slow_profiler.store
+    fmt = request.args.get("format", "json")
+    if fmt == "prof":
+        path = store.path(profile_id, "prof")
+        if path is None:
+            return jsonify({"error": "not_found"}), 404
+        return send_file(path, mimetype="application/octet-stream", as_attachment=True,
+                         download_name=f"{profile_id}.prof", max_age=0)
+    if fmt == "text":
+        sort = request.args.get("sort", "cumulative")
+        if sort not in ("cumulative", "tottime", "ncalls"):
+            return jsonify({"error": "sort: cumulative, tottime или ncalls"}), 400
+        text = store.stats_text(profile_id, sort=sort)
+        if text is None:
+            return jsonify({"error": "not_found"}), 404
+        return Response(text, content_type="text/plain; charset=utf-8")
+    meta = store.meta(profile_id)
+    if meta is None:
+        return jsonify({"error": "not_found"}), 404
+    return jsonify(meta)
+
+
+@app.route("/api/admin/catalog/reload", methods=["POST"])
+def api_admin_catalog_reload():
+    if not _admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    force = request.args.get("force") == "1"
+    try:
+        reloaded = reload_catalog(force=force)
+    except (OSError, ValueError) as exc:
+        return jsonify({"error": "catalog_error", "details": str(exc)}), 500
+    payload = catalog.info()
+    payload["reloaded"] = reloaded
+    return jsonify(payload)
 
 
 # --- New export route ---
 @app.route("/api/export", methods=["POST"])
 def api_export():
     payload = request.get_json(silent=True) or {}
-    results, messages = _select_components(payload)
+    try:
+        # Опциональные параметры цены: qty_multiplier, discounts, rounding
+        rules = PriceRules.from_payload(payload)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    cat = catalog
+    results, messages, drives = _select_components(payload, cat=cat)
     if not results:
         msg = "; ".join(messages) if messages else "Ничего не найдено"
         return jsonify({"error": msg}), 400
+    pricing = price_bom(results, rules, cat=cat)
 
-    # Поддержка опциональных параметров: group, qty_multiplier
     group_title = str(payload.get("group") or "").strip()  # например: "Коридор"
-    qty_multiplier = int(payload.get("qty_multiplier") or 1)
-    if qty_multiplier < 1:
-        qty_multiplier = 1
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "КП"
-
-    # Заголовки по требуемой форме
-    headers = ["н/п", "Наименование", "Цена, руб. с НДС", "Кол-во, шт.", "Сумма, руб. с НДС"]
-    ws.append(headers)
-
-    # Стили заголовков
-    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-    bold = Font(bold=True)
-    center = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    left = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    thin = Side(style="thin")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-    header_fill = PatternFill("solid", fgColor="F2F2F2")
 
-    for col in range(1, len(headers) + 1):
-        cell = ws.cell(row=1, column=col)
-        cell.font = bold
-        cell.alignment = center
-        cell.border = border
-        cell.fill = header_fill
+    started = time.perf_counter()
+    wb = Workbook(write_only=True)
+    _kp_register_styles(wb)
+    ws = _kp_sheet(wb, "КП")
 
     # Необязательная строка-группа (например, "Коридор")
-    row_idx = 2
     if group_title:
-        ws.append([group_title, "", "", "", ""])
-        for col in range(1, len(headers) + 1):
-            ws.cell(row=row_idx, column=col).border = border
-            ws.cell(row=row_idx, column=col).font = bold
-            ws.cell(row=row_idx, column=1).alignment = left
-        row_idx += 1
+        _kp_group_row(ws, group_title)
 
     # Данные
-    total = 0.0
-    counter = 1
-    for row in results:
-        name = row.get("name", "")
-        base_qty = float(row.get("quantity") or 0)
-        qty = base_qty * qty_multiplier
-        art = str(row.get("article") or "").strip()
-        # Цена
-        price = _price_of(art)
-        summa = price * qty
-        total += summa
-
-        ws.append([counter, name, price, qty, summa])
-        for col in range(1, len(headers) + 1):
-            ws.cell(row=row_idx, column=col).border = border
-            ws.cell(row=row_idx, column=2).alignment = left
-            if col in (1, 3, 4, 5):
-                ws.cell(row=row_idx, column=col).alignment = center
-        # Числовые форматы (RU): пробел как разделитель тысяч, запятая — десятичная
-        ws.cell(row=row_idx, column=3).number_format = '# ##0'
-        ws.cell(row=row_idx, column=4).number_format = '# ##0'
-        ws.cell(row=row_idx, column=5).number_format = '# ##0'
-        row_idx += 1
-        counter += 1
+    for counter, line in enumerate(pricing["lines"], start=1):
+        _kp_item_row(ws, counter, line["name"], line["price"], line["quantity"], line["sum"])
 
     # ИТОГО
-    ws.append(["", "", "", "ИТОГО, руб. с НДС", total])
-    for col in range(1, len(headers) + 1):
-        ws.cell(row=row_idx, column=col).border = border
-        if col in (4, 5):
-            ws.cell(row=row_idx, column=col).font = bold
-            ws.cell(row=row_idx, column=col).alignment = center
-        if col == 5:
-            ws.cell(row=row_idx, column=col).number_format = '# ##0'
-    row_idx += 1
-
-    # Ширины колонок и выравнивание
-    ws.column_dimensions['A'].width = 6   # н/п
-    ws.column_dimensions['B'].width = 70  # Наименование
-    ws.column_dimensions['C'].width = 18  # Цена
-    ws.column_dimensions['D'].width = 12  # Кол-во
-    ws.column_dimensions['E'].width = 20  # Сумма
-
-    if messages:
-        ws2 = wb.create_sheet("Комментарии")
-        from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-        bold = Font(bold=True)
-        center = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        left = Alignment(horizontal="left", vertical="center", wrap_text=True)
-        thin = Side(style="thin")
-        border = Border(left=thin, right=thin, top=thin, bottom=thin)
-        header_fill = PatternFill("solid", fgColor="F2F2F2")
-
-        # Заголовки как у основного листа
-        headers2 = ["н/п", "Наименование", "Цена, руб. с НДС", "Кол-во, шт.", "Сумма, руб. с НДС"]
-        ws2.append(headers2)
-        for col in range(1, len(headers2) + 1):
-            cell = ws2.cell(row=1, column=col)
-            cell.font = bold
-            cell.alignment = center
-            cell.border = border
-            cell.fill = header_fill
-
-        row_c = 2
-        counter_c = 1
-
-        # Если среди сообщений есть общий заголовок (например, про приводы) — выведем строкой-группой
-        title_written = False
-        for msg in messages:
-            if "Не забудьте добавить привод" in str(msg):
-                ws2.append(["Не забудьте добавить привод!", "", "", "", ""])
-                for col in range(1, len(headers2) + 1):
-                    ws2.cell(row=row_c, column=col).border = border
-                    ws2.cell(row=row_c, column=col).font = bold
-                    ws2.cell(row=row_c, column=1).alignment = left
-                row_c += 1
-                title_written = True
-                break
-
-        import re
-        leftovers: list[str] = []
-
-        # Разбираем каждое сообщение, ищем маркеры вида "• 7547 — Электропривод ..."
-        for msg in messages:
-            text = str(msg).replace("&lt;br&gt;", "\n").replace("<br>", "\n")
-            # Если это список с точками — распарсим построчно
-            lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-            parsed_any = False
-            for ln in lines:
-                # Уберём лидирующие маркеры
-                ln_clean = ln.lstrip("•-— ").strip()
-                m = re.match(r"^(\d+)\s*[—-]\s*(.+)$", ln_clean)
-                if not m:
-                    continue
-                art = m.group(1).strip()
-                name = m.group(2).strip()
-                price = _price_of(art)
-                qty = 1.0
-                summa = price * qty
-
-                ws2.append([counter_c, f"{art} — {name}", price, qty, summa])
-                for col in range(1, len(headers2) + 1):
-                    ws2.cell(row=row_c, column=col).border = border
-                    ws2.cell(row=row_c, column=2).alignment = left
-                    if col in (1, 3, 4, 5):
-                        ws2.cell(row=row_c, column=col).alignment = center
-                ws2.cell(row=row_c, column=3).number_format = '# ##0'
-                ws2.cell(row=row_c, column=4).number_format = '# ##0'
-                ws2.cell(row=row_c, column=5).number_format = '# ##0'
-                row_c += 1
-                counter_c += 1
-                parsed_any = True
-
-            if not parsed_any and text:
-                leftovers.append(text)
-
-        # Если есть непреобразованные сообщения — добавим их отдельным блоком ниже таблицы
-        if leftovers:
-            # Пустая строка-разделитель
-            ws2.append(["", "", "", "", ""])
-            for col in range(1, len(headers2) + 1):
-                ws2.cell(row=row_c, column=col).border = border
-            row_c += 1
+    _kp_pricing_totals(ws, pricing)
 
-            ws2.append(["Примечания", "", "", "", ""])
-            for col in range(1, len(headers2) + 1):
-                ws2.cell(row=row_c, column=col).border = border
-                ws2.cell(row=row_c, column=col).font = bold
-            row_c += 1
+    if messages or drives:
+        ws2 = _kp_sheet(wb, "Комментарии")
+        if drives:
+            _kp_group_row(ws2, DRIVE_REMINDER)
+            _kp_drive_rows(ws2, drives, rules, cat)
 
+        # Остальные сообщения — отдельным блоком ниже таблицы
+        leftovers = [str(msg).replace("&lt;br&gt;", "\n") for msg in messages if msg != DRIVE_REMINDER]
+        if leftovers:
+            # Пустая строка-разделитель
+            ws2.append(_kp_cells(ws2, [""] * 5, ["kp_cell"] * 5))
+            ws2.append(_kp_cells(ws2, ["Примечания", "", "", "", ""], ["kp_group_cell"] * 5))
             for text in leftovers:
                 # Каждое примечание — одной ячейкой в колонке B, во всех остальных — прочерки
-                ws2.append(["", text, "", "", ""])
-                ws2.cell(row=row_c, column=2).alignment = left
-                for col in range(1, len(headers2) + 1):
-                    ws2.cell(row=row_c, column=col).border = border
-                row_c += 1
-
-        # Ширины колонок как у основного листа
-        ws2.column_dimensions['A'].width = 6
-        ws2.column_dimensions['B'].width = 70
-        ws2.column_dimensions['C'].width = 18
-        ws2.column_dimensions['D'].width = 12
-        ws2.column_dimensions['E'].width = 20
-
-    stream = BytesIO()
-    wb.save(stream)
-    stream.seek(0)
+                _kp_note_row(ws2, text)
+
     filename = f"KP_{payload.get('tip','X')}_{payload.get('diametr','D')}.xlsx"
-    return send_file(stream, as_attachment=True, download_name=filename, mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    return _send_workbook(wb, filename, started)
+
+
+# === КП: общие стили и строки (write-only) ===
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+KP_HEADERS = ["н/п", "Наименование", "Цена, руб. с НДС", "Кол-во, шт.", "Сумма, руб. с НДС"]
+KP_WIDTHS = {"A": 6, "B": 70, "C": 18, "D": 12, "E": 20}
+
+
+def _kp_register_styles(wb: Workbook) -> None:
+    """Именованные стили КП: создаются один раз на книгу, ячейки ссылаются на них по имени."""
+    thin = Side(style="thin")
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    center = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    left = Alignment(horizontal="left", vertical="center", wrap_text=True)
+    bold = Font(bold=True)
+    specs = {
+        "kp_header": dict(font=bold, alignment=center, fill=PatternFill("solid", fgColor="F2F2F2")),
+        "kp_group": dict(font=bold, alignment=left),
+        "kp_group_cell": dict(font=bold),
+        "kp_cell": dict(),
+        "kp_center": dict(alignment=center),
+        "kp_text": dict(alignment=left),
+        "kp_num": dict(alignment=center, number_format="# ##0"),
+        "kp_total_label": dict(font=bold, alignment=center),
+        "kp_total": dict(font=bold, alignment=center, number_format="# ##0"),
+    }
+    for name, attrs in specs.items():
+        wb.add_named_style(NamedStyle(name=name, border=border, **attrs))
+
+
+def _kp_cells(ws, values: List[Any], styles: List[str]) -> List[WriteOnlyCell]:
+    cells = []
+    for value, style in zip(values, styles):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = style
+        cells.append(cell)
+    return cells
+
+
+def _kp_sheet(wb: Workbook, title: str):
+    ws = wb.create_sheet(title)
+    for col, width in KP_WIDTHS.items():
+        ws.column_dimensions[col].width = width
+    ws.append(_kp_cells(ws, KP_HEADERS, ["kp_header"] * len(KP_HEADERS)))
+    return ws
+
+
+def _kp_group_row(ws, title: str) -> None:
+    ws.append(_kp_cells(ws, [title, "", "", "", ""], ["kp_group"] + ["kp_group_cell"] * 4))
+
+
+def _kp_item_row(ws, n: Any, name: str, price: float, qty: float, summa: float) -> None:
+    ws.append(_kp_cells(ws, [n, name, price, qty, summa], ["kp_center", "kp_text", "kp_num", "kp_num", "kp_num"]))
 
 
-def _list_companies(filters: Dict[str, Any], limit: int, offset: int) -> Dict[str, Any]:
+def _kp_total_row(ws, label: str, total: float) -> None:
+    ws.append(_kp_cells(ws, ["", "", "", label, total], ["kp_cell", "kp_cell", "kp_cell", "kp_total_label", "kp_total"]))
+
+
+def _kp_pricing_totals(ws, pricing: Dict[str, Any], label: str = "ИТОГО, руб. с НДС") -> None:
+    _kp_total_row(ws, label, pricing["total"])
+    _kp_total_row(ws, f"в т.ч. НДС {pricing['vat_rate']:g}%", pricing["vat"])
+
+
+def _kp_drive_rows(ws, drives: List[Dict[str, Any]], rules: PriceRules, cat: CatalogSnapshot) -> None:
+    """Приводы на выбор: по одному, со скидкой и округлением КП, без множителя количества."""
+    priced = price_bom([dict(d, quantity=1) for d in drives],
+                       PriceRules(1, rules.discounts, rules.rounding), cat=cat)
+    for n, line in enumerate(priced["lines"], start=1):
+        _kp_item_row(ws, n, f"{line['article']} — {line['name']}", line["price"], line["quantity"], line["sum"])
+
+
+def _kp_note_row(ws, text: str) -> None:
+    ws.append(_kp_cells(ws, ["", text, "", "", ""], ["kp_cell", "kp_text", "kp_cell", "kp_cell", "kp_cell"]))
+
+
+def _send_workbook(wb: Workbook, filename: str, started: Optional[float] = None):
+    """Сохраняет write-only книгу во временный файл на диске и отдаёт его потоком.
+
+    Строки write-only листов уже лежат во временных файлах openpyxl, а готовый
+    xlsx не собирается в памяти целиком: пик памяти на экспорт не растёт с числом строк.
+    started — начало сборки книги (для метрики стадии build).
+    """
+    endpoint = request.endpoint or "export"
+    if started is not None and metrics.is_sampled():
+        EXPORT_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, stage="build")
+    fh = tempfile.TemporaryFile(prefix="kp_", suffix=".xlsx")
+    try:
+        with EXPORT_SECONDS.time(endpoint=endpoint, stage="serialize"):
+            wb.save(fh)
+        size = fh.tell()
+        fh.seek(0)
+    except Exception:
+        fh.close()
+        raise
+    EXPORT_BYTES.inc(size, endpoint=endpoint)
+    resp = send_file(fh, as_attachment=True, download_name=filename, mimetype=XLSX_MIMETYPE)
+    resp.content_length = size
+    return resp
+
+
+@app.route("/api/export/project", methods=["POST"])
+def api_export_project():
+    """КП на проект целиком: по секции на группу (\"Коридор\", \"Корпус 3\"...) и сводный лист.
+
+    Тело: {"title": "...", "groups": [{"title": "Коридор", "items": [payload, ...]}, ...]},
+    у каждого payload может быть свой qty_multiplier.
+    """
+    body = request.get_json(silent=True)
+    groups = body.get("groups") if isinstance(body, dict) else None
+    if not isinstance(groups, list) or not groups:
+        return jsonify({"error": "Ожидается список групп: {\"groups\": [{\"title\": ..., \"items\": [...]}]}"}), 400
+
+    sections = []
+    total_items = 0
+    for n, group in enumerate(groups, start=1):
+        payloads = group.get("items") if isinstance(group, dict) else None
+        if not isinstance(payloads, list) or not all(isinstance(p, dict) for p in payloads):
+            return jsonify({"error": f"Группа {n}: ожидается список конфигураций в поле items"}), 400
+        for i, payload in enumerate(payloads, start=1):
+            try:
+                _qty_multiplier(payload)
+            except ValueError as exc:
+                return jsonify({"error": f"Группа {n}, конфигурация {i}: {exc}"}), 400
+        total_items += len(payloads)
+        title = str(group.get("title") or f"Группа {n}").strip()
+        sections.append((title, payloads))
+    if total_items > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Слишком много конфигураций в одном запросе (максимум {BATCH_MAX_ITEMS})"}), 400
+    try:
+        # скидки и округление — на проект; количества уже умножены в _select_batch
+        rules = PriceRules.from_payload(body, multiplier=1)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    started = time.perf_counter()
+    wb = Workbook(write_only=True)
+    _kp_register_styles(wb)
+    ws = _kp_sheet(wb, "КП")
+
+    cat = catalog
+    summary: Dict[str, Dict[str, Any]] = {}
+    notes: List[Tuple[str, str]] = []
+    drives: List[Dict[str, Any]] = []  # один список на снимок каталога — достаточно первого
+    reminder: Optional[str] = None  # напоминание о приводе — одно на проект, не в каждой группе
+    counter = 1
+    for title, payloads in sections:
+        batch = _select_batch(payloads, cat=cat)
+        priced = price_bom(batch["bom"], rules, cat=cat)
+        _kp_group_row(ws, title)
+        for line in priced["lines"]:
+            _kp_item_row(ws, counter, line["name"], line["price"], line["quantity"], line["sum"])
+            counter += 1
+            row = summary.setdefault(line["article"], {"article": line["article"], "name": line["name"], "quantity": 0.0})
+            row["quantity"] += line["quantity"]
+        _kp_total_row(ws, f"Итого: {title}", priced["total"])
+
+        seen = set()
+        for item in batch["items"]:
+            parts = []
+            for part in (item.get("message") or "").split("; "):
+                if part.startswith(DRIVE_REMINDER):
+                    reminder = reminder or part
+                elif part:
+                    parts.append(part)
+            msg = "; ".join(parts)
+            if msg and msg not in seen:
+                seen.add(msg)
+                notes.append((title, msg))
+            drives = drives or item.get("drives", [])
+
+    # цена за штуку одна на весь проект, поэтому итог сводной совпадает с суммой групп
+    total = price_bom(list(summary.values()), rules, cat=cat)
+    _kp_pricing_totals(ws, total)
+
+    ws_sum = _kp_sheet(wb, "Сводная")
+    for n, line in enumerate(total["lines"], start=1):
+        _kp_item_row(ws_sum, n, line["name"], line["price"], line["quantity"], line["sum"])
+    _kp_pricing_totals(ws_sum, total)
+
+    if notes or drives or reminder:
+        ws_notes = _kp_sheet(wb, "Комментарии")
+        current = None
+        for title, msg in notes:
+            if title != current:
+                _kp_group_row(ws_notes, title)
+                current = title
+            _kp_note_row(ws_notes, msg.replace("&lt;br&gt;", "\n"))
+        if drives:
+            _kp_group_row(ws_notes, DRIVE_REMINDER)
+            _kp_drive_rows(ws_notes, drives, rules, cat)
+        elif reminder:
+            # приводов в каталоге нет — только напоминание с пометкой
+            _kp_group_row(ws_notes, reminder)
+
+    project = re.sub(r"[^\w\-]+", "_", str(body.get("title") or "project")).strip("_") or "project"
+    return _send_workbook(wb, f"KP_{project}.xlsx", started)
+
+
+FTS_MIN_QUERY = 3  # trigram-индекс ищет подстроки от трёх символов; короче — прежний LIKE
+
+
+def _fts_phrase(search: str) -> str:
+    # строка запроса целиком — одна фраза FTS5 (кавычки экранируются удвоением)
+    return '"' + search.replace('"', '""') + '"'
+
+
+def _encode_cursor(values: List[Any]) -> str:
+    raw = json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(token: str, size: int) -> List[Any]:
+    """Разбирает курсор страницы; ValueError — если курсор испорчен или от другого режима."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception as exc:
+        raise ValueError("bad cursor") from exc
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("bad cursor")
+    # значения уходят параметрами в SQLite: списки/словари дали бы InterfaceError (500)
+    if not all(v is None or isinstance(v, (str, int, float)) for v in values):
+        raise ValueError("bad cursor")
+    return values
+
+
+companies_total_cache = LruCache(maxsize=512, ttl=600.0)
+
+
+def _use_fts(conn: sqlite3.Connection, search: Optional[str]) -> bool:
+    return bool(search) and len(search) >= FTS_MIN_QUERY and db_pool.has_table(conn, "companies_fts")
+
+
+def _filters_cache_key(conn: sqlite3.Connection, filters: Dict[str, Any], use_fts: bool) -> tuple:
+    """Ключ кэшей справочника: поколение данных БД + нормализованный набор фильтров."""
+    return (db_pool.data_generation(conn), use_fts, filters.get("search_norm"),
+            filters.get("region"), filters.get("production"), bool(filters.get("only_roots")))
+
+
+def _companies_filters_sql(filters: Dict[str, Any], use_fts: bool) -> Tuple[str, List[Any]]:
+    """FROM/WHERE справочника по фильтрам (поиск, регион, тип производства, только головные)."""
+    search = filters.get("search_norm")
     base_sql = [
-        "SELECT c.id, c.name, c.production_type, c.address_full, c.postal_code,",
-        "       c.region, c.district, c.locality, c.street, c.parent_company_id,",
-        "       c.holding_id, h.name as holding_name",
         "FROM companies c",
         "LEFT JOIN holdings h ON h.id = c.holding_id",
-        "WHERE 1 = 1",
     ]
+    if use_fts:
+        base_sql.append("JOIN companies_fts ON companies_fts.rowid = c.id")
+    base_sql.append("WHERE 1 = 1")
     params: List[Any] = []
 
-    search = filters.get("search_norm")
-    if search:
+    if use_fts:
+        base_sql.append("AND companies_fts MATCH ?")
+        params.append(_fts_phrase(search))
+    elif search:
         token = f"%{search}%"
         base_sql.append(
             "AND ("
@@ -862,97 +1967,209 @@ def _list_companies(filters: Dict[str, Any], limit: int, offset: int) -> Dict[st
     if only_roots:
         base_sql.append("AND c.parent_company_id IS NULL")
 
-    filters_sql = "\n".join(base_sql)
-    data_sql = f"{filters_sql}\nORDER BY c.name COLLATE NOCASE\nLIMIT ? OFFSET ?"
-    params_with_limit = params + [limit, offset]
+    return "\n".join(base_sql), params
 
-    count_sql = f"SELECT COUNT(*) FROM ({filters_sql}) sub"
 
-    with _connect_db() as conn:
-        rows = conn.execute(data_sql, params_with_limit).fetchall()
-        total = conn.execute(count_sql, params).fetchone()[0]
+def _companies_query(filters: Dict[str, Any], use_fts: bool,
+                     after: Optional[List[Any]] = None) -> Tuple[str, List[Any], str, List[Any]]:
+    """SQL страницы справочника: (data_sql, data_params, count_sql, count_params).
+
+    data_sql заканчивается на "LIMIT ?" (keyset после after) или "LIMIT ? OFFSET ?";
+    значения limit/offset добавляет вызывающий. Итог не считается в data_sql: оконный
+    COUNT(*) OVER () заставил бы прочитать и отсортировать всю выборку вместо прохода
+    по индексу до LIMIT.
+    """
+    columns = [
+        "c.id, c.name, c.production_type, c.address_full, c.postal_code,",
+        "       c.region, c.district, c.locality, c.street, c.parent_company_id,",
+        "       c.holding_id, h.name as holding_name",
+    ]
+    if use_fts:
+        columns.append("       , companies_fts.rank AS fts_rank")
+    filters_sql, params = _companies_filters_sql(filters, use_fts)
+    count_sql = f"SELECT COUNT(*)\n{filters_sql}"
+
+    # при поиске по индексу — сначала самые релевантные (bm25), затем по имени
+    if use_fts:
+        order_sql = "companies_fts.rank, c.name COLLATE NOCASE, c.id"
+    else:
+        order_sql = "c.name COLLATE NOCASE, c.id"
+
+    if after is not None:
+        if use_fts:
+            key_sql = "AND (companies_fts.rank, c.name COLLATE NOCASE, c.id) > (?, ?, ?)"
+            key_params = list(after)
+        else:
+            # явная нижняя граница по name позволяет SQLite идти по индексу (name COLLATE NOCASE, id)
+            key_sql = "AND c.name >= ? COLLATE NOCASE AND (c.name COLLATE NOCASE, c.id) > (?, ?)"
+            key_params = [after[0]] + list(after)
+        select_sql = "SELECT " + "\n".join(columns)
+        data_sql = f"{select_sql}\n{filters_sql}\n{key_sql}\nORDER BY {order_sql}\nLIMIT ?"
+        return data_sql, params + key_params, count_sql, params
+
+    select_sql = "SELECT " + "\n".join(columns)
+    data_sql = f"{select_sql}\n{filters_sql}\nORDER BY {order_sql}\nLIMIT ? OFFSET ?"
+    return data_sql, params, count_sql, params
+
+
+def _list_companies(filters: Dict[str, Any], limit: int, offset: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """Страница справочника: keyset по (name, id) при cursor, иначе LIMIT/OFFSET по page.
+
+    total считается отдельным COUNT(*) только при промахе кэша и кэшируется по набору
+    фильтров до изменения БД, так что следующие страницы его не пересчитывают.
+    """
+    search = filters.get("search_norm")
+
+    with db_pool.connection() as conn:
+        use_fts = _use_fts(conn, search)
+        after = _decode_cursor(cursor, 3 if use_fts else 2) if cursor else None
+        data_sql, params, count_sql, count_params = _companies_query(filters, use_fts, after)
+        total_key = _filters_cache_key(conn, filters, use_fts)
+
+        if after is not None:
+            with DB_QUERY_SECONDS.time(query="companies_cursor"):
+                rows = conn.execute(data_sql, params + [limit + 1]).fetchall()
+        else:
+            with DB_QUERY_SECONDS.time(query="companies_page"):
+                rows = conn.execute(data_sql, params + [limit + 1, offset]).fetchall()
+
+        total = companies_total_cache.get(total_key)
+        if total is None:
+            with DB_QUERY_SECONDS.time(query="companies_count"):
+                total = conn.execute(count_sql, count_params).fetchone()[0]
+            companies_total_cache.put(total_key, total)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        values = [last["name"], last["id"]]
+        if use_fts:
+            values.insert(0, last["fts_rank"])
+        next_cursor = _encode_cursor(values)
 
     items = [_company_row_to_dict(r) for r in rows]
-    return {"items": items, "total": total}
+    return {"items": items, "total": total, "next_cursor": next_cursor}
 
 
-def _catalog_facets() -> Dict[str, List[str]]:
-    with _connect_db() as conn:
-        regions = [r[0] for r in conn.execute(
-            "SELECT DISTINCT region FROM companies WHERE region IS NOT NULL AND TRIM(region) <> '' ORDER BY region COLLATE NOCASE"
-        ).fetchall()]
-        productions = [r[0] for r in conn.execute(
-            "SELECT DISTINCT json_extract(production_type, '$.primary') AS prod FROM companies WHERE json_extract(production_type, '$.primary') IS NOT NULL ORDER BY prod COLLATE NOCASE"
-        ).fetchall()]
-    return {"regions": regions, "productions": productions}
+# Фасеты справочника: имя -> (значение, условие «значение задано», собственный фильтр фасета)
+FACETS = {
+    "regions": ("c.region", "c.region IS NOT NULL AND TRIM(c.region) <> ''", "region"),
+    "productions": (
+        "json_extract(c.production_type, '$.primary')",
+        "json_extract(c.production_type, '$.primary') IS NOT NULL",
+        "production",
+    ),
+}
 
+# (фасеты, etag) по ключу _filters_cache_key
+facets_cache = LruCache(maxsize=512, ttl=600.0)
 
-def _load_company_details(company_id: int) -> Optional[Dict[str, Any]]:
-    sql = """
-        SELECT c.*, h.name AS holding_name, h.region AS holding_region
-        FROM companies c
-        LEFT JOIN holdings h ON h.id = c.holding_id
-        WHERE c.id = ?
+
+def _facet_query(name: str, filters: Dict[str, Any], use_fts: bool) -> Tuple[str, List[Any]]:
+    value_sql, present_sql, own_filter = FACETS[name]
+    filters_sql, params = _companies_filters_sql(dict(filters, **{own_filter: None}), use_fts)
+    sql = (
+        f"SELECT {value_sql} AS value, COUNT(*) AS cnt\n{filters_sql}\nAND {present_sql}\n"
+        f"GROUP BY {value_sql}\nORDER BY value COLLATE NOCASE"
+    )
+    return sql, params
+
+
+def _catalog_facets(filters: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, List[Dict[str, Any]]], str]:
+    """Регионы и типы производства с количеством компаний: ({"regions": [{"value", "count"}], ...}, etag).
+
+    Количество по фасету учитывает все фильтры, кроме собственного: в списке регионов видно,
+    сколько компаний даст выбор другого региона при тех же поиске и типе производства.
+    etag — хэш содержимого, поэтому совпадает между процессами и перезапусками.
     """
-    with _connect_db() as conn:
-        row = conn.execute(sql, (company_id,)).fetchone()
+    filters = filters or {}
+    with db_pool.connection() as conn:
+        use_fts = _use_fts(conn, filters.get("search_norm"))
+        key = _filters_cache_key(conn, filters, use_fts)
+        cached = facets_cache.get(key)
+        if cached is not None:
+            return cached
+
+        facets: Dict[str, List[Dict[str, Any]]] = {}
+        for name in FACETS:
+            sql, params = _facet_query(name, filters, use_fts)
+            with DB_QUERY_SECONDS.time(query=f"facet_{name}"):
+                facets[name] = [{"value": r["value"], "count": r["cnt"]} for r in conn.execute(sql, params)]
+
+    body = json.dumps(facets, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    cached = (facets, hashlib.sha1(body).hexdigest())
+    facets_cache.put(key, cached)
+    return cached
+
+
+# Карточка компании одним запросом: дочерние, контакты и сайты собираются в JSON
+# коррелированными подзапросами (каждый — поиск по индексу от c.id)
+COMPANY_DETAIL_SQL = """
+    SELECT c.*, h.name AS holding_name, h.region AS holding_region,
+           (SELECT json_group_array(json_object('id', ch.id, 'name', ch.name, 'region', ch.region))
+            FROM (SELECT id, name, region FROM companies
+                  WHERE parent_company_id = c.id
+                  ORDER BY name COLLATE NOCASE) AS ch) AS children_json,
+           (SELECT json_group_array(json_object('id', ct.id, 'role', ct.role, 'full_name', ct.full_name,
+                                                'email', ct.email, 'phones', ct.phones))
+            FROM (SELECT sc.id, sc.role, sc.full_name, sc.email,
+                         group_concat(scp.phone, ', ') AS phones
+                  FROM site_contacts sc
+                  JOIN sites s ON s.id = sc.site_id
+                  LEFT JOIN site_contact_phones scp ON scp.contact_id = sc.id
+                  WHERE s.company_id = c.id
+                  GROUP BY sc.id
+                  ORDER BY sc.role COLLATE NOCASE) AS ct) AS contacts_json,
+           (SELECT json_group_array(json_object('id', sw.id, 'url', sw.url))
+            FROM (SELECT sw.id, sw.url
+                  FROM site_websites sw
+                  JOIN sites s ON s.id = sw.site_id
+                  WHERE s.company_id = c.id
+                  ORDER BY sw.id) AS sw) AS websites_json
+    FROM companies c
+    LEFT JOIN holdings h ON h.id = c.holding_id
+    WHERE c.id = ?
+"""
+
+# Карточки по (поколение данных БД, company_id); запись в pifagor.db сдвигает поколение
+company_details_cache = LruCache(maxsize=1024, ttl=600.0)
+
+
+def _load_company_details(company_id: int) -> Optional[Dict[str, Any]]:
+    """Карточка компании (общая для всех запросов из кэша — не изменять)."""
+    with db_pool.connection() as conn:
+        key = (db_pool.data_generation(conn), company_id)
+        company = company_details_cache.get(key)
+        if company is not None:
+            return company
+
+        with DB_QUERY_SECONDS.time(query="company_detail"):
+            row = conn.execute(COMPANY_DETAIL_SQL, (company_id,)).fetchone()
         if not row:
             return None
 
-        company = _company_row_to_dict(row)
-        company["holding_region"] = row["holding_region"]
-
-        child_rows = conn.execute(
-            "SELECT id, name, region FROM companies WHERE parent_company_id = ? ORDER BY name COLLATE NOCASE",
-            (company_id,),
-        ).fetchall()
-        company["children"] = [
-            {"id": r["id"], "name": r["name"], "region": r["region"]}
-            for r in child_rows
-        ]
-
-        contact_rows = conn.execute(
-            """
-            SELECT sc.id, sc.role, sc.full_name, sc.email,
-                   group_concat(scp.phone, ', ') AS phones
-            FROM site_contacts sc
-            JOIN sites s ON s.id = sc.site_id
-            LEFT JOIN site_contact_phones scp ON scp.contact_id = sc.id
-            WHERE s.company_id = ?
-            GROUP BY sc.id
-            ORDER BY sc.role COLLATE NOCASE
-            """,
-            (company_id,),
-        ).fetchall()
-        company["contacts"] = [
-            {
-                "id": r["id"],
-                "role": r["role"],
-                "full_name": r["full_name"],
-                "email": r["email"],
-                "phones": r["phones"],
-            }
-            for r in contact_rows
-        ]
-
-        site_rows = conn.execute(
-            """
-            SELECT sw.id, sw.url
-            FROM site_websites sw
-            JOIN sites s ON s.id = sw.site_id
-            WHERE s.company_id = ?
-            ORDER BY sw.id
-            """,
-            (company_id,),
-        ).fetchall()
-        company["websites"] = [
-            {"id": r["id"], "url": r["url"]}
-            for r in site_rows
-        ]
-
+    company = _company_row_to_dict(row)
+    company["holding_region"] = row["holding_region"]
+    company["children"] = json.loads(row["children_json"])
+    company["contacts"] = json.loads(row["contacts_json"])
+    company["websites"] = json.loads(row["websites_json"])
+    company_details_cache.put(key, company)
     return company
 
 
+def _directory_filters(args) -> Dict[str, Any]:
+    search_raw = (args.get("q") or "").strip()
+    return {
+        "search": search_raw,
+        "search_norm": _normalize_text(search_raw) or None,
+        "region": (args.get("region") or "").strip() or None,
+        "production": (args.get("production") or "").strip() or None,
+        "only_roots": args.get("roots") == "1",
+    }
+
+
 @app.route("/api/catalog/companies")
 def api_companies_list():
     try:
@@ -968,26 +2185,36 @@ def api_companies_list():
     page = max(1, page)
     offset = (page - 1) * limit
 
-    search_raw = (request.args.get("q") or "").strip()
-    filters = {
-        "search": search_raw,
-        "search_norm": _normalize_text(search_raw) or None,
-        "region": (request.args.get("region") or "").strip() or None,
-        "production": (request.args.get("production") or "").strip() or None,
-        "only_roots": request.args.get("roots") == "1",
-    }
+    cursor = (request.args.get("cursor") or "").strip() or None
+    filters = _directory_filters(request.args)
 
     try:
-        payload = _list_companies(filters, limit, offset)
+        payload = _list_companies(filters, limit, offset, cursor=cursor)
         if request.args.get("facets") == "1":
-            payload["facets"] = _catalog_facets()
+            facets, _ = _catalog_facets()
+            payload["facets"] = {name: [f["value"] for f in values] for name, values in facets.items()}
         payload["page"] = page
         payload["limit"] = limit
         return jsonify(payload)
+    except ValueError:
+        return jsonify({"error": "bad_cursor"}), 400
     except sqlite3.Error as exc:
         return jsonify({"error": "db_error", "details": str(exc)}), 500
 
 
+@app.route("/api/catalog/facets")
+def api_catalog_facets():
+    """Фасеты с количествами под текущие фильтры (q, region, production, roots); ETag/304."""
+    try:
+        facets, etag = _catalog_facets(_directory_filters(request.args))
+    except sqlite3.Error as exc:
+        return jsonify({"error": "db_error", "details": str(exc)}), 500
+    response = jsonify(facets)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
 @app.route("/api/catalog/companies/<int:company_id>")
 def api_company_detail(company_id: int):
     try:
@@ -1015,6 +2242,25 @@ def favicon():
     return send_from_directory("web", "agroventlabel.png", mimetype='image/png')
 
 
+# === Запуск ===
+
+def create_app(precompute: bool = True, watch: bool = True) -> Flask:
+    """Точка входа WSGI: готовит общее состояние процесса и возвращает app.
+
+    gunicorn с preload_app (gunicorn.conf.py) вызывает её в мастере до fork: каталог,
+    индексы и таблица подбора строятся один раз и достаются воркерам копией страниц
+    при fork. Наблюдатель каталога — поток, fork его не переносит: под gunicorn он
+    запускается в каждом воркере (post_fork), поэтому туда передаётся watch=False.
+    """
+    if precompute and catalog.selections is None:
+        precompute_selections()
+    if watch:
+        start_catalog_watcher()
+    return app
+
+
 if __name__ == "__main__":
-    # PROD: запускать через gunicorn/uwsgi; debug только локально
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    # Локальная разработка. PROD: gunicorn -c gunicorn.conf.py (см. start.sh)
+    create_app()
+    app.run(host="0.0.0.0", port=int(os.environ.get("CHIMENEY_PORT", "5001")),
+            debug=os.environ.get("CHIMENEY_DEBUG") == "1", threaded=True)
@@ -0,0 +1,402 @@
+"""
+Метрики процесса в текстовом формате Prometheus (exposition 0.0.4), без внешних зависимостей.
+
+Счётчики (Counter) считают всё. Гистограммы времени (Histogram.time) пишутся только для
+сэмплированных запросов: доля задаётся CHIMENEY_METRICS_SAMPLE (0..1, по умолчанию 1),
+решение принимается один раз на запрос (start_request). Вне запросов (предрасчёт таблицы
+подбора, перезагрузка каталога) гистограммы не пишутся. Несэмплированный замер — проверка
+флага и общий no-op объект.
+
+Многопроцессный режим (gunicorn, несколько воркеров): если задан CHIMENEY_METRICS_DIR, каждый
+процесс раз в CHIMENEY_METRICS_FLUSH секунд (по умолчанию 1) пишет свои значения в
+<каталог>/<pid>.json, а /metrics в любом воркере сводит файлы всех процессов: счётчики и
+гистограммы суммируются, gauge отдаются по процессам с меткой pid. Значения других воркеров
+запаздывают не больше чем на период записи. Счётчики завершившихся воркеров остаются в сумме,
+их gauge убирает mark_process_dead (хук child_exit в gunicorn.conf.py).
+Без CHIMENEY_METRICS_DIR (python main.py) /metrics отдаёт значения своего процесса.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+MULTIPROCESS_ENV = "CHIMENEY_METRICS_DIR"
+
+Labels = Tuple[str, ...]
+
+
+def _env_rate(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+_sample_rate = min(max(_env_rate("CHIMENEY_METRICS_SAMPLE", 1.0), 0.0), 1.0)
+_flush_interval = max(_env_rate("CHIMENEY_METRICS_FLUSH", 1.0), 0.05)
+_local = threading.local()
+
+
+def set_sample_rate(rate: float) -> None:
+    global _sample_rate
+    _sample_rate = min(max(float(rate), 0.0), 1.0)
+
+
+def sample_rate() -> float:
+    return _sample_rate
+
+
+def start_request() -> bool:
+    """Решает, сэмплируется ли текущий запрос; возвращает решение."""
+    _local.sampled = _sample_rate >= 1.0 or (_sample_rate > 0.0 and random.random() < _sample_rate)
+    return _local.sampled
+
+
+def end_request() -> None:
+    _local.sampled = None
+
+
+def is_sampled() -> bool:
+    return bool(getattr(_local, "sampled", None))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Labels:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получено {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def values(self) -> Dict[Labels, Any]:
+        """Текущие значения процесса: метки -> число (у гистограммы — строка корзин)."""
+        raise NotImplementedError
+
+    def lines(self, values: Dict[Labels, Any], labelnames: Sequence[str]) -> List[str]:
+        return self.header() + [f"{self.name}{_labels_text(labelnames, k)} {_number(v)}"
+                                for k, v in sorted(values.items())]
+
+    def collect(self) -> List[str]:
+        return self.lines(self.values(), self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        _changed()
+
+    def values(self) -> Dict[Labels, Any]:
+        with self._lock:
+            return dict(self._values)
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopTimer":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам..., +Inf, сумма]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+        _changed()
+
+    def time(self, **labels):
+        """Контекстный менеджер замера; для несэмплированного запроса — no-op."""
+        if not is_sampled():
+            return _NOOP
+        return _Timer(self, labels)
+
+    def values(self) -> Dict[Labels, Any]:
+        with self._lock:
+            return {k: list(v) for k, v in self._values.items()}
+
+    def lines(self, values: Dict[Labels, Any], labelnames: Sequence[str]) -> List[str]:
+        lines = self.header()
+        for key, row in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels_text(labelnames, key, le)} {cumulative}")
+            labels = _labels_text(labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(row[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Callback(_Metric):
+    """Значения, снимаемые в момент запроса /metrics (размеры кэшей, счётчики пулов)."""
+
+    def __init__(self, name: str, documentation: str, kind: str,
+                 collect: Callable[[], Iterable[Tuple[Dict[str, Any], float]]], labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self._collect = collect
+
+    def values(self) -> Dict[Labels, Any]:
+        return {self._key(labels): value for labels, value in self._collect()}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, kind: str,
+                 collect: Callable[[], Iterable[Tuple[Dict[str, Any], float]]],
+                 labelnames: Sequence[str] = ()) -> Callback:
+        return self._register(Callback(name, documentation, kind, collect, labelnames))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def _all(self) -> List[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self) -> Dict[str, List[List[Any]]]:
+        """Значения процесса в виде, пригодном для JSON: имя -> [[метки, значение], ...]."""
+        return {m.name: [[list(k), v] for k, v in m.values().items()] for m in self._all()}
+
+    def render(self) -> str:
+        directory = multiprocess_dir()
+        lines: List[str] = []
+        if directory is None:
+            for metric in self._all():
+                lines.extend(metric.collect())
+            return "\n".join(lines) + "\n"
+
+        flush(self)
+        merged = self._merge(_read_snapshots(directory))
+        for metric in self._all():
+            labelnames = metric.labelnames + ("pid",) if metric.kind == "gauge" else metric.labelnames
+            lines.extend(metric.lines(merged.get(metric.name, {}), labelnames))
+        return "\n".join(lines) + "\n"
+
+    def _merge(self, snapshots: Dict[int, Dict[str, List[List[Any]]]]) -> Dict[str, Dict[Labels, Any]]:
+        merged: Dict[str, Dict[Labels, Any]] = {}
+        for pid, snapshot in snapshots.items():
+            for name, values in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                acc = merged.setdefault(name, {})
+                for labels, value in values:
+                    key = tuple(labels)
+                    if metric.kind == "gauge":
+                        acc[key + (str(pid),)] = value
+                    elif isinstance(value, list):
+                        row = acc.get(key)
+                        acc[key] = list(value) if row is None else [a + b for a, b in zip(row, value)]
+                    else:
+                        acc[key] = acc.get(key, 0) + value
+        return merged
+
+
+REGISTRY = Registry()
+
+
+# === Многопроцессный режим ===
+
+_flusher_pid: Optional[int] = None
+_flusher_lock = threading.Lock()
+_dirty = threading.Event()
+
+
+# Читается при импорте: gunicorn.conf.py задаёт переменную до загрузки приложения
+_multiprocess_dir = os.environ.get(MULTIPROCESS_ENV) or None
+
+
+def multiprocess_dir() -> Optional[str]:
+    return _multiprocess_dir
+
+
+def _changed() -> None:
+    _dirty.set()
+    if _flusher_pid != os.getpid() and multiprocess_dir() is not None:
+        _start_flusher()
+
+
+def _start_flusher() -> None:
+    """Фоновая запись значений процесса; потоки не переживают fork — свой в каждом воркере."""
+    global _flusher_pid, _dirty
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        _dirty = threading.Event()
+        _dirty.set()
+
+    def _loop(dirty: threading.Event) -> None:
+        while True:
+            dirty.wait()
+            time.sleep(_flush_interval)
+            dirty.clear()
+            try:
+                flush()
+            except OSError:
+                pass
+
+    threading.Thread(target=_loop, args=(_dirty,), name="metrics-flush", daemon=True).start()
+
+
+def _path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"{pid}.json")
+
+
+def _write(path: str, snapshot: Dict[str, Any]) -> None:
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def flush(registry: Optional[Registry] = None) -> None:
+    """Пишет значения процесса в <CHIMENEY_METRICS_DIR>/<pid>.json (атомарно)."""
+    directory = multiprocess_dir()
+    if directory is None:
+        return
+    _write(_path(directory, os.getpid()), (registry or REGISTRY).snapshot())
+
+
+def _read_snapshots(directory: str) -> Dict[int, Dict[str, List[List[Any]]]]:
+    snapshots = {}
+    for name in os.listdir(directory):
+        stem, _, ext = name.partition(".")
+        if ext != "json" or not stem.isdigit():
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                snapshots[int(stem)] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def mark_process_dead(pid: int, registry: Optional[Registry] = None) -> None:
+    """Процесс завершился: его gauge убираются, счётчики и гистограммы остаются в сумме."""
+    directory = multiprocess_dir()
+    if directory is None:
+        return
+    path = _path(directory, pid)
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+    registry = registry or REGISTRY
+    kept = {}
+    for name, values in snapshot.items():
+        metric = registry.get(name)
+        if metric is not None and metric.kind != "gauge":
+            kept[name] = values
+    _write(path, kept)
+
+
+def clear_multiprocess_dir() -> None:
+    """Удаляет файлы прошлого запуска (вызывается мастером до старта воркеров)."""
+    directory = multiprocess_dir()
+    if directory is None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith((".json", ".tmp")):
+            os.unlink(os.path.join(directory, name))
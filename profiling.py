@@ -0,0 +1,373 @@
+"""
+Профилирование медленных запросов (включается явно, по умолчанию выключено).
+
+SlowRequestProfiler — WSGI-обёртка над app.wsgi_app: запросы к выбранным путям идут под
+cProfile, и если запрос шёл дольше порога, профиль (.prof, формат pstats) и сам запрос
+(метод, путь, query string, тело) пишутся в каталог ProfileStore. Хранилище — кольцевой
+буфер: самые старые профили удаляются, когда превышены лимит байт или число профилей.
+
+Настройка через окружение:
+    CHIMENEY_PROFILE_SLOW_MS   порог в мс; не задан — профилирование выключено
+    CHIMENEY_PROFILE_PATHS     префиксы путей через запятую (по умолчанию /api/)
+    CHIMENEY_PROFILE_DIR       каталог профилей (по умолчанию profiles/ рядом с main.py)
+    CHIMENEY_PROFILE_MAX_MB    лимит на диске (по умолчанию 50)
+    CHIMENEY_PROFILE_MAX_COUNT лимит числа профилей (по умолчанию 200)
+    CHIMENEY_PROFILE_SAMPLE    доля запросов под профилировщиком, 0..1 (по умолчанию 1)
+
+Цену cProfile платит каждый профилируемый запрос, а не только медленный: обработка
+замедляется в ~2.5 раза (замер: /api/select с 0.5 до 1.2 мс, /api/export с 13 до 32 мс).
+Поэтому профилирование выключено по умолчанию (под gunicorn нужен ещё CHIMENEY_PROFILE_ENABLE=1)
+и включается на время разбора, узкими префиксами и с долей CHIMENEY_PROFILE_SAMPLE. В процессе под
+профилировщиком одновременно не больше одного запроса: с Python 3.12 cProfile глобален
+для процесса, второй enable() падает; остальные запросы в это время идут без профиля.
+
+Запуск:
+    python profiling.py list
+    python profiling.py show <id> [--sort cumulative] [--limit 30]
+    python profiling.py replay <id> [--sort cumulative] [--limit 30]
+"""
+
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DIR = os.path.join(BASE_DIR, "profiles")
+DEFAULT_PATHS = ("/api/",)
+ADMIN_PREFIX = "/api/admin/"
+# Тело запроса сохраняется для воспроизведения целиком, но не больше этого
+MAX_BODY_BYTES = 1024 * 1024
+
+# <дата>T<время>-<микросекунды><случайный хвост>: сортировка по id хронологическая
+_ID_RE = re.compile(r"^\d{8}T\d{6}-\d{6}[0-9a-f]{4}$")
+# Один профилируемый запрос на процесс (см. docstring модуля)
+_PROFILER_LOCK = threading.Lock()
+# Ключ WSGI environ: запрос с True в нём идёт мимо профилировщика (replay профилирует сам)
+SKIP_ENVIRON_KEY = "chimeney.profile.skip"
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    raw = os.environ.get(name)
+    if raw is None or not raw.strip():
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+class ProfileStore:
+    """Каталог профилей: <id>.prof (pstats) и <id>.json (запрос и сводка) — кольцевой буфер."""
+
+    def __init__(self, directory: str, max_bytes: int = 50 * 1024 * 1024, max_count: int = 200):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def valid_id(profile_id: str) -> bool:
+        return bool(_ID_RE.match(profile_id or ""))
+
+    def path(self, profile_id: str, ext: str) -> Optional[str]:
+        if not self.valid_id(profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.{ext}")
+        return path if os.path.isfile(path) else None
+
+    def save(self, profile: cProfile.Profile, meta: Dict[str, Any]) -> str:
+        now = time.time()
+        profile_id = (time.strftime("%Y%m%dT%H%M%S", time.localtime(now))
+                      + f"-{int(now % 1 * 1_000_000):06d}" + uuid.uuid4().hex[:4])
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            prof_path = os.path.join(self.directory, profile_id + ".prof")
+            profile.dump_stats(prof_path)
+            meta = dict(meta, id=profile_id, profile_bytes=os.path.getsize(prof_path))
+            with open(os.path.join(self.directory, profile_id + ".json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            self._evict()
+        return profile_id
+
+    def _files(self) -> Dict[str, List[str]]:
+        groups: Dict[str, List[str]] = {}
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return groups
+        for name in names:
+            stem, _, ext = name.rpartition(".")
+            if ext in ("prof", "json") and self.valid_id(stem):
+                groups.setdefault(stem, []).append(os.path.join(self.directory, name))
+        return groups
+
+    def _evict(self) -> None:
+        groups = self._files()
+        sizes = {pid: sum(os.path.getsize(p) for p in paths) for pid, paths in groups.items()}
+        total = sum(sizes.values())
+        for pid in sorted(groups):
+            if total <= self.max_bytes and len(groups) <= self.max_count:
+                break
+            for path in groups.pop(pid):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            total -= sizes[pid]
+
+    def meta(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = self.path(profile_id, "json")
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Сводки профилей, новые первыми (без тел запросов)."""
+        out = []
+        for pid in sorted(self._files(), reverse=True):
+            meta = self.meta(pid)
+            if meta is not None:
+                meta.pop("request", None)
+                out.append(meta)
+        return out
+
+    def usage(self) -> Dict[str, Any]:
+        groups = self._files()
+        return {
+            "directory": self.directory,
+            "profiles": len(groups),
+            "bytes": sum(os.path.getsize(p) for paths in groups.values() for p in paths),
+            "max_bytes": self.max_bytes,
+            "max_count": self.max_count,
+        }
+
+    def stats_text(self, profile_id: str, sort: str = "cumulative", limit: int = 40) -> Optional[str]:
+        path = self.path(profile_id, "prof")
+        if path is None:
+            return None
+        buf = io.StringIO()
+        pstats.Stats(path, stream=buf).strip_dirs().sort_stats(sort).print_stats(limit)
+        return buf.getvalue()
+
+
+def _decode_body(body: bytes, content_type: str) -> Dict[str, Any]:
+    if not body:
+        return {}
+    if len(body) > MAX_BODY_BYTES:
+        return {"body_truncated": len(body)}
+    text = body.decode("utf-8", errors="replace")
+    if "json" in content_type:
+        try:
+            return {"json": json.loads(text)}
+        except ValueError:
+            pass
+    return {"body": text}
+
+
+class SlowRequestProfiler:
+    """WSGI-обёртка: профилирует запросы по префиксам путей, сохраняет те, что дольше порога."""
+
+    def __init__(self, wsgi_app: Callable, store: ProfileStore, threshold_ms: Optional[float],
+                 paths: Sequence[str] = DEFAULT_PATHS, sample: float = 1.0):
+        self.wsgi_app = wsgi_app
+        self.store = store
+        self.threshold_ms = threshold_ms
+        self.paths = tuple(paths)
+        self.sample = min(max(sample, 0.0), 1.0)
+        # profiled и saved меняются только под _PROFILER_LOCK, busy — и без него, под своим
+        self.saved = 0
+        self.profiled = 0
+        self.busy = 0
+        self._busy_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, wsgi_app: Callable, default_dir: str = DEFAULT_DIR) -> "SlowRequestProfiler":
+        max_mb = _env_float("CHIMENEY_PROFILE_MAX_MB", 50.0)
+        max_count = _env_float("CHIMENEY_PROFILE_MAX_COUNT", 200.0)
+        store = ProfileStore(os.environ.get("CHIMENEY_PROFILE_DIR") or default_dir,
+                             max_bytes=int(max_mb * 1024 * 1024), max_count=max(int(max_count), 1))
+        paths = [p.strip() for p in os.environ.get("CHIMENEY_PROFILE_PATHS", "").split(",") if p.strip()]
+        return cls(wsgi_app, store, _env_float("CHIMENEY_PROFILE_SLOW_MS", None), paths or DEFAULT_PATHS,
+                   sample=_env_float("CHIMENEY_PROFILE_SAMPLE", 1.0))
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms is not None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold_ms,
+            "paths": list(self.paths),
+            "sample": self.sample,
+            "profiled": self.profiled,
+            "saved": self.saved,
+            "busy": self.busy,
+            "store": self.store.usage(),
+        }
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        path = environ.get("PATH_INFO", "")
+        # админ-эндпоинты (в том числе выдача самих профилей) не профилируются
+        if not self.enabled or not path.startswith(self.paths) or path.startswith(ADMIN_PREFIX):
+            return self.wsgi_app(environ, start_response)
+        if environ.get(SKIP_ENVIRON_KEY):
+            return self.wsgi_app(environ, start_response)
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return self.wsgi_app(environ, start_response)
+        if not _PROFILER_LOCK.acquire(blocking=False):
+            # профилировщик занят другим запросом — этот идёт без профиля
+            self._count_busy()
+            return self.wsgi_app(environ, start_response)
+        try:
+            return self._profiled_call(environ, start_response)
+        finally:
+            _PROFILER_LOCK.release()
+
+    def _count_busy(self) -> None:
+        with self._busy_lock:
+            self.busy += 1
+
+    def _profiled_call(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        # тело читается заранее, приложению подставляется копия
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        body = environ["wsgi.input"].read(length) if length > 0 else b""
+        environ["wsgi.input"] = io.BytesIO(body)
+
+        status_box: List[str] = []
+
+        def _start_response(status, headers, exc_info=None):
+            status_box.append(status)
+            return start_response(status, headers, exc_info)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # активен чужой профилировщик (с 3.12 — один на процесс): запрос без профиля
+            self._count_busy()
+            return self.wsgi_app(environ, start_response)
+        started = time.perf_counter()
+        try:
+            result = self.wsgi_app(environ, _start_response)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            self.profiled += 1
+            # тело ответа (send_file) отдаётся уже после: в профиль входит обработка, не передача
+            if elapsed * 1000 >= self.threshold_ms:
+                self._save(profile, environ, body, elapsed, status_box)
+        return result
+
+    def _save(self, profile: cProfile.Profile, environ: Dict[str, Any], body: bytes,
+              elapsed: float, status_box: List[str]) -> None:
+        request = {
+            "method": environ.get("REQUEST_METHOD", "GET"),
+            "path": environ.get("PATH_INFO", ""),
+            "query_string": environ.get("QUERY_STRING", ""),
+            "content_type": environ.get("CONTENT_TYPE", ""),
+        }
+        request.update(_decode_body(body, request["content_type"]))
+        meta = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "method": request["method"],
+            "path": request["path"],
+            "status": status_box[0].split(" ", 1)[0] if status_box else None,
+            "seconds": round(elapsed, 6),
+            "threshold_ms": self.threshold_ms,
+            "request": request,
+        }
+        try:
+            self.store.save(profile, meta)
+            self.saved += 1
+        except OSError as exc:
+            print(f"⚠️ Профиль медленного запроса не сохранён: {exc}", file=sys.stderr)
+
+
+# === Воспроизведение ===
+
+def replay(store: ProfileStore, profile_id: str) -> cProfile.Profile:
+    """Повторяет сохранённый запрос через test client приложения под cProfile."""
+    meta = store.meta(profile_id)
+    if meta is None:
+        raise KeyError(profile_id)
+    req = meta["request"]
+    if "body_truncated" in req:
+        raise ValueError(f"тело запроса ({req['body_truncated']} байт) не сохранено")
+
+    import main as app_module
+    client = app_module.app.test_client()
+    # мимо обёртки профилировщика приложения: второй cProfile в процессе подменил бы наш
+    kwargs: Dict[str, Any] = {"method": req["method"], "query_string": req.get("query_string") or None,
+                              "environ_overrides": {SKIP_ENVIRON_KEY: True}}
+    if "json" in req:
+        kwargs["json"] = req["json"]
+    elif "body" in req:
+        kwargs["data"] = req["body"].encode("utf-8")
+        kwargs["content_type"] = req.get("content_type") or None
+    # прогрев (соединения, ленивые импорты), затем холодные кэши — как у медленного запроса
+    client.open(req["path"], **kwargs)
+    for cache in (app_module.selection_cache, app_module.companies_total_cache,
+                  app_module.company_details_cache, app_module.facets_cache):
+        cache.clear()
+    profile = cProfile.Profile()
+    profile.enable()
+    response = client.open(req["path"], **kwargs)
+    profile.disable()
+    print(f"{req['method']} {req['path']} → {response.status_code}")
+    return profile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Профили медленных запросов")
+    parser.add_argument("--dir", default=os.environ.get("CHIMENEY_PROFILE_DIR") or DEFAULT_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="сохранённые профили, новые первыми")
+    for name, help_text in (("show", "статистика сохранённого профиля"),
+                            ("replay", "повторить запрос локально и показать свежий профиль")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("id")
+        p.add_argument("--sort", default="cumulative")
+        p.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+    store = ProfileStore(args.dir)
+
+    if args.command == "list":
+        for meta in store.list():
+            print(f"{meta['id']}  {meta['seconds'] * 1000:>9.1f} мс  {meta.get('status') or '-':>3}  "
+                  f"{meta['method']} {meta['path']}")
+        return
+    if args.command == "show":
+        text = store.stats_text(args.id, sort=args.sort, limit=args.limit)
+        if text is None:
+            sys.exit(f"Профиль {args.id} не найден в {store.directory}")
+        print(text)
+        return
+    try:
+        profile = replay(store, args.id)
+    except KeyError:
+        sys.exit(f"Профиль {args.id} не найден в {store.directory}")
+    except ValueError as exc:
+        sys.exit(str(exc))
+    pstats.Stats(profile).strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+
+
+if __name__ == "__main__":
+    main()
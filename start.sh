@@ -1,3 +1,7 @@
 #!/bin/bash
 pip install -r requirements.txt
-python main.py
\ No newline at end of file
+python db_migrate.py
+python catalog_snapshot.py build
+# Продакшен: gunicorn (gunicorn.conf.py), каталог и таблица подбора загружаются до fork.
+# Локальная разработка с отладчиком: CHIMENEY_DEBUG=1 python main.py
+exec gunicorn -c gunicorn.conf.py
@@ -0,0 +1,67 @@
+import json
+
+import pandas as pd
+
+import converter
+
+VBP_NAME = 'Секция камина VBР-560 (2м_поворотный клапан_низ)'  # «Р» кириллицей, как в выгрузке
+
+
+def _sources(rows):
+    return pd.DataFrame(rows, columns=['artikul', 'name', 'price']).astype(object)
+
+
+def _items(path):
+    with open(path, encoding='utf-8') as f:
+        return {item['artikul']: item for item in json.load(f)}
+
+
+def _hand_edit(path):
+    items = _items(path)
+    items['1']['name'] = 'Секция камина VBP-560 (2м_поворотный клапан_низ)'
+    items['1']['type'] = 'VBP'
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(list(items.values()), f, ensure_ascii=False)
+    return items['1']
+
+
+def test_incremental_keeps_hand_edits(tmp_path):
+    out = str(tmp_path / 'k.json')
+    source = _sources([('1', VBP_NAME, '38750'), ('2', 'Комплект зонта', '11250')])
+    converter.convert_incremental(output_file=out, sources=source, snapshot=False)
+    edited = _hand_edit(out)
+
+    _, diff = converter.convert_incremental(output_file=out, sources=source, snapshot=False)
+    assert _items(out)['1'] == edited
+    assert diff['changed'] == [] and diff['unverified'] == []
+
+    # изменилась другая строка выгрузки — правка первой остаётся
+    _, diff = converter.convert_incremental(
+        output_file=out, sources=_sources([('1', VBP_NAME, '38750'), ('2', 'Комплект зонта', '12000')]),
+        snapshot=False)
+    items = _items(out)
+    assert items['1'] == edited
+    assert items['2']['price'] == '12000' and diff['repriced'] == ['2']
+
+
+def test_incremental_reparses_row_changed_in_source(tmp_path):
+    out = str(tmp_path / 'k.json')
+    converter.convert_incremental(output_file=out, sources=_sources([('1', VBP_NAME, '38750')]), snapshot=False)
+    _hand_edit(out)
+
+    _, diff = converter.convert_incremental(output_file=out, sources=_sources([('1', VBP_NAME, '40000')]),
+                                            snapshot=False)
+    assert _items(out)['1']['price'] == '40000'
+    assert diff['repriced'] == ['1']
+
+
+def test_incremental_without_source_history_keeps_items(tmp_path):
+    out = str(tmp_path / 'k.json')
+    source = _sources([('1', VBP_NAME, '38750')])
+    converter.convert_incremental(output_file=out, sources=source, snapshot=False)
+    edited = _hand_edit(out)
+    (tmp_path / 'k.sources.json').unlink()
+
+    _, diff = converter.convert_incremental(output_file=out, sources=source, snapshot=False)
+    assert _items(out)['1'] == edited
+    assert diff['unverified'] == ['1']
@@ -0,0 +1,48 @@
+import base64
+import json
+
+import pytest
+
+import main
+
+
+def _cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.mark.parametrize("values", [[[1], {}], [{"a": 1}, 2], ["x", [None]]])
+def test_cursor_with_non_scalar_values_is_rejected(client, values):
+    errors = main.db_pool.stats()["errors"]
+    resp = client.get("/api/catalog/companies", query_string={"cursor": _cursor(values)})
+    assert resp.status_code == 400
+    assert main.db_pool.stats()["errors"] == errors
+
+
+def test_next_cursor_pages_forward(client):
+    first = client.get("/api/catalog/companies", query_string={"limit": 2}).get_json()
+    cursor = first.get("next_cursor")
+    if cursor is None:
+        pytest.skip("в справочнике меньше двух страниц")
+    second = client.get("/api/catalog/companies", query_string={"limit": 2, "cursor": cursor})
+    assert second.status_code == 200
+    ids = [c["id"] for c in first["items"]] + [c["id"] for c in second.get_json()["items"]]
+    assert len(ids) == len(set(ids))
+
+
+def test_page_total_counted_once_per_filter_set(client, monkeypatch):
+    main.companies_total_cache.clear()
+    first = client.get("/api/catalog/companies", query_string={"limit": 2}).get_json()
+    with main.db_pool.connection() as conn:
+        assert first["total"] == conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+
+    # итог из кэша: COUNT(*) на следующих страницах не выполняется
+    query = main._companies_query
+    monkeypatch.setattr(main, "_companies_query",
+                        lambda *args, **kwargs: query(*args, **kwargs)[:2] + ("SELECT -1", []))
+    second = client.get("/api/catalog/companies", query_string={"limit": 2, "page": 2}).get_json()
+    assert second["total"] == first["total"]
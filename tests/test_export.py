@@ -0,0 +1,40 @@
+import io
+
+from openpyxl import load_workbook
+
+import config_space
+import main
+
+
+def _valve_payloads(valve, count):
+    configs = config_space.iter_configurations(main.catalog.code_mapping)
+    found = []
+    for payload in configs:
+        if payload.get("tip_klapana") == valve and main._select_components(dict(payload))[0]:
+            found.append(payload)
+            if len(found) == count:
+                break
+    return found
+
+
+def _cells(resp, sheet):
+    wb = load_workbook(io.BytesIO(resp.data), read_only=True)
+    return [str(v) for row in wb[sheet].iter_rows(values_only=True) for v in row if v is not None]
+
+
+def test_project_export_reminds_about_drive_once():
+    payloads = _valve_payloads("pov", 3)
+    assert len(payloads) == 3
+    groups = [{"title": f"Корпус {n}", "items": [p, p]} for n, p in enumerate(payloads, start=1)]
+    resp = main.app.test_client().post("/api/export/project", json={"title": "t", "groups": groups})
+    assert resp.status_code == 200
+    notes = _cells(resp, "Комментарии")
+    assert sum(main.DRIVE_REMINDER in text for text in notes) == 1
+
+
+def test_project_export_rejects_non_object_body():
+    client = main.app.test_client()
+    for body in ([{"title": "x", "items": []}], "groups", 1, None):
+        resp = client.post("/api/export/project", json=body)
+        assert resp.status_code == 400
+        assert resp.get_json()["error"].startswith("Ожидается список групп")
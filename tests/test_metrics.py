@@ -0,0 +1,27 @@
+import pytest
+
+import main
+
+
+def _boom():
+    raise RuntimeError("boom")
+
+
+def _errors(rule):
+    return main.HTTP_REQUESTS.values().get((rule, "GET", "500"), 0)
+
+
+@pytest.mark.parametrize("propagate", [False, True])
+def test_unhandled_exception_counted_once(monkeypatch, propagate):
+    rule = "/api/select/cache"
+    endpoint = next(r.endpoint for r in main.app.url_map.iter_rules() if r.rule == rule)
+    monkeypatch.setitem(main.app.view_functions, endpoint, _boom)
+    monkeypatch.setitem(main.app.config, "PROPAGATE_EXCEPTIONS", propagate)
+    before = _errors(rule)
+    client = main.app.test_client()
+    if propagate:
+        with pytest.raises(RuntimeError):
+            client.get(rule)
+    else:
+        assert client.get(rule).status_code == 500
+    assert _errors(rule) - before == 1
@@ -0,0 +1,91 @@
+from decimal import ROUND_HALF_UP, Decimal
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+def _cat(**items):
+    """Снимок каталога для price_bom: артикул -> (цена, категория)."""
+    return SimpleNamespace(by_art={art: SimpleNamespace(price=price, category=category)
+                                   for art, (price, category) in items.items()})
+
+
+def _rules(multiplier=None, **payload):
+    return main.PriceRules.from_payload(payload, multiplier=multiplier)
+
+
+CAT = _cat(A=(100.555, "секция"), D=(1234.4, "привод"), X=(10.0, ""))
+
+
+def test_rounding_per_unit_kop_and_rub():
+    rows = [{"article": "A", "quantity": 3}]
+    kop = main.price_bom(rows, _rules(), cat=CAT)
+    assert kop["lines"][0]["price"] == 100.56
+    assert kop["total"] == 301.68  # округляется цена за штуку, затем умножается
+    rub = main.price_bom(rows, _rules(rounding="rub"), cat=CAT)
+    assert rub["lines"][0]["price"] == 101
+    assert rub["total"] == 303
+
+
+def test_discounts_by_category_and_wildcard():
+    rows = [{"article": "A", "quantity": 1}, {"article": "D", "quantity": 1}, {"article": "X", "quantity": 1}]
+    priced = main.price_bom(rows, _rules(discounts={"Привод": 10, "*": "2.5"}), cat=CAT)
+    lines = {line["article"]: line for line in priced["lines"]}
+    assert lines["D"]["discount"] == 10 and lines["D"]["price"] == 1110.96
+    assert lines["A"]["discount"] == 2.5 and lines["A"]["price"] == 98.04
+    assert lines["X"]["discount"] == 2.5 and lines["X"]["price"] == 9.75
+    assert priced["total"] == 1218.75
+    # НДС выделяется из итога с округлением до копеек вверх от половины (при 20% — 203.125 -> 203.13)
+    vat = Decimal("1218.75") * main.VAT_RATE / (100 + main.VAT_RATE)
+    assert priced["vat"] == float(vat.quantize(main.KOPECK, ROUND_HALF_UP))
+
+
+def test_without_wildcard_other_groups_are_not_discounted():
+    rules = _rules(discounts={"привод": 10})
+    assert rules.discount("привод") == 10
+    assert rules.discount("секция") == 0
+
+
+def test_qty_multiplier_scales_quantities():
+    rows = [{"article": "A", "quantity": 2}]
+    priced = main.price_bom(rows, _rules(qty_multiplier="3"), cat=CAT)
+    assert priced["lines"][0]["quantity"] == 6
+    assert priced["total"] == 603.36
+    # в пакете количества уже умножены — правило с multiplier=1 не умножает второй раз
+    once = main.price_bom(rows, _rules(multiplier=1, qty_multiplier=3), cat=CAT)
+    assert once["lines"][0]["quantity"] == 2
+
+
+@pytest.mark.parametrize("value", [0, -2, 1.5, "2.5", "x", True, float("inf")])
+def test_bad_qty_multiplier_is_rejected(value):
+    with pytest.raises(ValueError, match="qty_multiplier"):
+        _rules(qty_multiplier=value)
+
+
+@pytest.mark.parametrize("value", [None, "", 2, 2.0, "4"])
+def test_qty_multiplier_values(value):
+    assert _rules(qty_multiplier=value).multiplier == (1 if value in (None, "") else int(float(value)))
+
+
+@pytest.mark.parametrize("payload", [{"discounts": [10]}, {"discounts": {"*": 101}}, {"discounts": {"*": "x"}},
+                                     {"rounding": "cent"}])
+def test_bad_rules_are_rejected(payload):
+    with pytest.raises(ValueError):
+        _rules(**payload)
+
+
+@pytest.mark.parametrize("raw", ["abc", "NaN", "-1", "100", "Infinity"])
+def test_bad_vat_rate_is_rejected(raw):
+    with pytest.raises(ValueError, match="CHIMENEY_VAT_RATE"):
+        main._vat_rate(raw)
+
+
+def test_bad_qty_multiplier_in_batch_is_400():
+    client = main.app.test_client()
+    resp = client.post("/api/select/batch", json={"items": [{"tip": "VBV"}, {"tip": "VBV", "qty_multiplier": 0}]})
+    assert resp.status_code == 400
+    assert resp.get_json()["error"].startswith("Конфигурация 2: qty_multiplier")
+    resp = client.post("/api/export", json={"tip": "VBV", "qty_multiplier": -1})
+    assert resp.status_code == 400
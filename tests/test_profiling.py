@@ -0,0 +1,37 @@
+import threading
+
+import profiling
+
+
+def _app(environ, start_response):
+    start_response("200 OK", [])
+    return [b"ok"]
+
+
+def _profiler(tmp_path):
+    return profiling.SlowRequestProfiler(_app, profiling.ProfileStore(str(tmp_path)), threshold_ms=0)
+
+
+def _call(profiler, **environ):
+    environ = dict({"PATH_INFO": "/api/select", "REQUEST_METHOD": "GET"}, **environ)
+    return profiler(environ, lambda status, headers, exc_info=None: None)
+
+
+def test_busy_counted_from_many_threads(tmp_path):
+    profiler = _profiler(tmp_path)
+    threads = [threading.Thread(target=lambda: [_call(profiler) for _ in range(200)]) for _ in range(8)]
+    with profiling._PROFILER_LOCK:  # профилировщик занят: все запросы идут мимо
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert profiler.busy == 8 * 200
+    assert profiler.profiled == 0
+
+
+def test_skip_key_bypasses_profiler(tmp_path):
+    profiler = _profiler(tmp_path)
+    assert _call(profiler, **{profiling.SKIP_ENVIRON_KEY: True}) == [b"ok"]
+    assert profiler.profiled == 0 and profiler.store.list() == []
+    _call(profiler)
+    assert profiler.profiled == 1 and profiler.saved == 1
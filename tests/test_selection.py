@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+import config_space
+import main
+
+SAMPLE = 400
+# кроме 0 и 2 из опроса — длины вне таблицы (0/1 м) и большие удлинения
+EXTENSIONS = (0, 1, 2, 3, 7)
+
+
+@pytest.fixture(scope="module")
+def snapshots():
+    """Один и тот же каталог: с таблицей подбора и без неё (подбор через LRU/расчёт)."""
+    table = main.CatalogSnapshot.load(main.CATALOG_PATH, generation=1001)
+    main.precompute_selections(table)
+    plain = main.CatalogSnapshot.load(main.CATALOG_PATH, generation=1002)
+    return table, plain
+
+
+def _sample(code_mapping):
+    rnd = random.Random(7)
+    payloads = []
+    for follow_depends in (True, False):
+        configs = list(config_space.iter_configurations(code_mapping, extensions=EXTENSIONS,
+                                                        follow_depends=follow_depends,
+                                                        params=main.SELECTION_EXTRA_PARAMS))
+        payloads += rnd.sample(configs, min(SAMPLE, len(configs)))
+    return payloads
+
+
+def _select(payload, cat):
+    """Результат подбора и источник ответа (table/cache/compute) по счётчику chimeney_select_total."""
+    before = main.SELECT_TOTAL.values()
+    result = main._select_components(dict(payload), cat)
+    after = main.SELECT_TOTAL.values()
+    sources = [k[0] for k, v in after.items() if v != before.get(k, 0)]
+    return result, sources
+
+
+def test_table_cache_and_compute_agree(snapshots, monkeypatch):
+    table, plain = snapshots
+    monkeypatch.setattr(main, "selection_cache", main.LruCache(maxsize=16))
+    from_table = 0
+    for payload in _sample(table.code_mapping):
+        expected, source = _select(payload, table)
+        if not source:
+            continue  # ошибка бэкенд-правил: подбора нет ни в одном пути
+        from_table += source == ["table"]
+        main.selection_cache.clear()  # разные удлинения дают один ключ
+        computed, source = _select(payload, plain)
+        assert source == ["compute"], payload
+        assert computed == expected, payload
+        cached, source = _select(payload, plain)
+        assert source == ["cache"], payload
+        assert cached == expected, payload
+    assert from_table > SAMPLE
+
+
+def test_reload_swaps_selection_table(snapshots, monkeypatch):
+    table, _ = snapshots
+    monkeypatch.setattr(main, "catalog", table)
+    monkeypatch.setattr(main, "selection_cache", main.LruCache())
+    main.selection_cache.put((table.generation, "stale"), ([], (), False, None))
+
+    assert main.reload_catalog(force=True)
+    fresh = main.catalog
+    assert fresh is not table
+    assert fresh.generation == table.generation + 1
+    assert fresh.selections is not None and fresh.selections is not table.selections
+    assert fresh.selections.generation == fresh.generation
+    assert fresh.selections.entries.keys() == table.selections.entries.keys()
+    assert main.selection_cache.stats()["size"] == 0
+
+
+def test_drive_suggestions_are_capped(snapshots):
+    table, _ = snapshots
+    assert 0 < len(table.drives) <= main.DRIVES_MAX
+    payload = next(p for p in _sample(table.code_mapping) if main._select_components(dict(p), table)[2])
+    assert len(main._select_components(dict(payload), table)[2]) <= main.DRIVES_MAX
@@ -70,6 +70,9 @@
     loading: false,
     selectedId: null,
     hasFacets: false,
+    facetsSeq: 0,
+    // cursors[i] — курсор для загрузки страницы i+1 (keyset-пагинация на сервере)
+    cursors: [null],
   };
 
   function mapType(x){
@@ -299,6 +302,13 @@
     return withBr;
   }
 
+  // --- Приводы на выбор приходят отдельным списком drives ---
+  function formatDrives(drives){
+    if (!Array.isArray(drives) || !drives.length) return '';
+    const items = drives.map(d => `<li>${escapeHtml(d.article)} — ${escapeHtml(d.name)}</li>`).join('');
+    return `<div>Доступные приводы:</div><ul>${items}</ul>`;
+  }
+
   fldKlapan.addEventListener('change', ()=>{ enforceValveConstraints(); toggleValveFields(); toggleMotorFields(); toggleKoronaVisibility(); toggleKapVisibility(); enforcePowerByDiamAndType(); toggleMountVisibility(); });
   fldType.addEventListener('change', ()=>{ enforceValveConstraints(); toggleMotorFields(); toggleValveFields(); toggleKoronaVisibility(); toggleKapVisibility(); enforcePowerByDiamAndType(); toggleMountVisibility(); });
   fldDiam.addEventListener('change', ()=>{ enforcePowerByDiamAndType(); });
@@ -344,11 +354,12 @@
           const qty = it.quantity ?? '-';
           return `<div class="result-item"><strong>Артикул:</strong> ${art}<br><strong>Наименование:</strong> ${name}<br><strong>Количество:</strong> ${qty}</div>`;
         }).join('');
-        const messageHtml = data.message ? `<div class="result-item"><br><em>${formatMessage(data.message)}</em></div>` : '';
+        const notes = (data.message ? formatMessage(data.message) : '') + formatDrives(data.drives);
+        const messageHtml = notes ? `<div class="result-item"><br><em>${notes}</em></div>` : '';
         resultDiv.innerHTML = html + messageHtml;
         enableDownloadIfResults(data.results, payload);
       } else {
-        resultDiv.innerHTML = data.message ? `<em>${formatMessage(data.message)}</em>` : 'Ничего не найдено';
+        resultDiv.innerHTML = data.message ? `<em>${formatMessage(data.message)}${formatDrives(data.drives)}</em>` : 'Ничего не найдено';
         enableDownloadIfResults([], payload);
       }
     } catch(err){
@@ -394,23 +405,42 @@
     }
   }
 
+  // Элемент фасета — строка или {value, count} (/api/catalog/facets)
+  function facetOptions(values, current){
+    const list = (values || []).map(v => (typeof v === 'string' ? { value: v } : v));
+    if (current && !list.some(v => v.value === current)) list.push({ value: current, count: 0 });
+    return list.map(v => {
+      const label = v.count == null ? v.value : `${v.value} (${v.count})`;
+      return `<option value="${escapeHtml(v.value)}">${escapeHtml(label)}</option>`;
+    }).join('');
+  }
+
   function updateFacetOptions(facets){
     if (!facets) return;
     directoryState.hasFacets = true;
     if (dirRegion) {
       const cur = dirRegion.value;
-      const options = (facets.regions || []).map(r => `<option value="${escapeHtml(r)}">${escapeHtml(r)}</option>`).join('');
-      dirRegion.innerHTML = '<option value="">Все регионы</option>' + options;
+      dirRegion.innerHTML = '<option value="">Все регионы</option>' + facetOptions(facets.regions, cur);
       if (cur) dirRegion.value = cur;
     }
     if (dirProduction) {
       const cur = dirProduction.value;
-      const options = (facets.productions || []).map(p => `<option value="${escapeHtml(p)}">${escapeHtml(p)}</option>`).join('');
-      dirProduction.innerHTML = '<option value="">Любой тип</option>' + options;
+      dirProduction.innerHTML = '<option value="">Любой тип</option>' + facetOptions(facets.productions, cur);
       if (cur) dirProduction.value = cur;
     }
   }
 
+  // Количества по фасетам под текущие фильтры; сервер отвечает 304, если ничего не изменилось
+  async function loadFacets(filterParams){
+    const seq = ++directoryState.facetsSeq;
+    try {
+      const facets = await fetchJSON(`/api/catalog/facets?${filterParams.toString()}`);
+      if (seq === directoryState.facetsSeq) updateFacetOptions(facets);
+    } catch (err) {
+      console.error(err);
+    }
+  }
+
   function renderDirectoryList(items){
     if (!dirList) return;
     dirList.innerHTML = '';
@@ -452,31 +482,38 @@
 
   async function loadDirectory({ resetPage = false, withFacets = false } = {}){
     if (!dirList) return;
-    if (resetPage) directoryState.page = 1;
+    if (resetPage) {
+      directoryState.page = 1;
+      directoryState.cursors = [null];
+    }
     directoryState.loading = true;
     setDirectoryStatus('Загрузка...');
     dirList.innerHTML = '';
     if (dirEmpty) dirEmpty.hidden = true;
 
-    const params = new URLSearchParams();
-    params.set('limit', String(directoryState.limit));
-    params.set('page', String(directoryState.page));
+    const filterParams = new URLSearchParams();
     const query = (dirSearch?.value || '').trim();
-    if (query) params.set('q', query);
-    if (dirRegion && dirRegion.value) params.set('region', dirRegion.value);
-    if (dirProduction && dirProduction.value) params.set('production', dirProduction.value);
-    if (dirRoots && dirRoots.checked) params.set('roots', '1');
-    if (withFacets || !directoryState.hasFacets) params.set('facets', '1');
+    if (query) filterParams.set('q', query);
+    if (dirRegion && dirRegion.value) filterParams.set('region', dirRegion.value);
+    if (dirProduction && dirProduction.value) filterParams.set('production', dirProduction.value);
+    if (dirRoots && dirRoots.checked) filterParams.set('roots', '1');
+    if (resetPage || withFacets || !directoryState.hasFacets) loadFacets(filterParams);
+
+    const params = new URLSearchParams(filterParams);
+    params.set('limit', String(directoryState.limit));
+    const cursor = directoryState.cursors[directoryState.page - 1];
+    if (cursor) params.set('cursor', cursor);
+    else params.set('page', String(directoryState.page));
 
     try {
       const data = await fetchJSON(`/api/catalog/companies?${params.toString()}`);
       directoryState.total = data.total || 0;
+      directoryState.cursors[directoryState.page] = data.next_cursor || null;
       if (dirCounter) dirCounter.textContent = `${directoryState.total} записей`;
       renderDirectoryList(data.items || []);
       if ((data.items || []).length === 0 && dirEmpty) dirEmpty.hidden = false;
       setDirectoryStatus((data.items || []).length ? '' : 'Нет результатов');
       updatePagination();
-      if (data.facets) updateFacetOptions(data.facets);
     } catch (err) {
       console.error(err);
       setDirectoryStatus('Не удалось загрузить данные');